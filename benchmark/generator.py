@@ -0,0 +1,111 @@
+"""
+ベンチマーク用の合成マスターデータとバリデーターファイルを作るモジュール
+"""
+import csv
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Sequence
+
+from master_validator.conversion_cache import DATETIME_FORMAT
+
+COLUMN_TYPES = ('int', 'float', 'datetime', 'str')
+DISTRIBUTIONS = ('uniform', 'zipf', 'sequential', 'constant')
+
+_BASE_DATETIME = datetime(2022, 5, 1, 14, 0, 0)
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    """
+    合成するカラムの定義
+    """
+    name: str
+    type: str = 'int'
+    # 値の分布。uniform: 一様, zipf: 少数の値に偏る, sequential: 行毎に異なる, constant: 全行同じ
+    distribution: str = 'uniform'
+    # 値の種類数。sequential, constant では使わない
+    cardinality: int = 100
+
+    def __post_init__(self):
+        if self.type not in COLUMN_TYPES:
+            raise ValueError(f'unknown column type. type=[{self.type}]')
+        if self.distribution not in DISTRIBUTIONS:
+            raise ValueError(f'unknown distribution. distribution=[{self.distribution}]')
+
+
+DEFAULT_COLUMNS = (
+    ColumnSpec('type', 'int', 'uniform', 10),
+    ColumnSpec('rarity', 'int', 'zipf', 5),
+    ColumnSpec('attack', 'int', 'uniform', 1000),
+    ColumnSpec('rate', 'float', 'uniform', 100),
+    ColumnSpec('start_data', 'datetime', 'zipf', 50),
+    ColumnSpec('name', 'str', 'sequential'),
+)
+
+
+def _ordinal(spec: ColumnSpec, row: int, rnd: random.Random) -> int:
+    if spec.distribution == 'sequential':
+        return row
+    if spec.distribution == 'constant':
+        return 0
+    if spec.distribution == 'zipf':
+        return min(int(rnd.paretovariate(1.2)) - 1, spec.cardinality - 1)
+    return rnd.randrange(spec.cardinality)
+
+
+def _value(spec: ColumnSpec, ordinal: int, rnd: random.Random) -> str:
+    if spec.type == 'int':
+        return str(ordinal + 1)
+    if spec.type == 'float':
+        return f'{ordinal / 4:.2f}'
+    if spec.type == 'datetime':
+        dt = _BASE_DATETIME + timedelta(hours=ordinal)
+        # 1%の行は秒が0ではない値にする
+        if rnd.random() < 0.01:
+            dt += timedelta(seconds=59)
+        return dt.strftime(DATETIME_FORMAT)
+    return f'{spec.name}{ordinal + 1}'
+
+
+def generate_master(path: Path, rows: int, columns: Sequence[ColumnSpec] = DEFAULT_COLUMNS, seed: int = 0):
+    """
+    id列とcolumnsのカラムを持つrows行のcsvファイルを作る
+    同じ引数なら同じ内容になる
+    :param path: 出力先
+    :param rows: 行数
+    :param columns: id以外のカラムの定義
+    :param seed: 乱数のシード
+    :return:
+    """
+    rnd = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(['id'] + [spec.name for spec in columns])
+        for row in range(rows):
+            writer.writerow([str(row + 1)] + [_value(spec, _ordinal(spec, row, rnd), rnd) for spec in columns])
+
+
+def validator_lines(columns: Sequence[ColumnSpec] = DEFAULT_COLUMNS) -> List[str]:
+    """
+    columnsに合わせたバリデーターファイルの各行を返す
+    フィルターの共有や融合が効くように、先頭のフィルターが共通する行を含める。
+    """
+    int_columns = [spec.name for spec in columns if spec.type == 'int']
+    lines = ['no_filter() > count_validation(1)']
+    for name in int_columns:
+        lines.append(f'equal_filter({name}, 1) > count_validation(1)')
+    if len(int_columns) >= 2:
+        first, second = int_columns[:2]
+        lines.append(f'equal_filter({first}, 1) > equal_filter({second}, 1) > count_validation(1)')
+        lines.append(f'equal_filter({first}, 1) > equal_filter({second}, 2) > count_validation(1)')
+    if any(spec.name == 'start_data' and spec.type == 'datetime' for spec in columns):
+        lines.append('no_filter() > time_0sec_validation()')
+    return lines
+
+
+def generate_validator(path: Path, columns: Sequence[ColumnSpec] = DEFAULT_COLUMNS):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(''.join(line + '\n' for line in validator_lines(columns)))
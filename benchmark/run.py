@@ -0,0 +1,185 @@
+"""
+ベンチマークを実行し、結果をJSONで保存するスクリプト
+基準の結果を指定すると比較し、遅くなった項目があれば終了コード1で終了する。
+
+使い方:
+    python -m benchmark.run --rows 1000 10000 100000 1000000 --output bench.json
+    python -m benchmark.run --rows 1000 10000 --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from benchmark.generator import generate_master, generate_validator, validator_lines
+from master_validator import compiler, csv_reader, vectorized
+from master_validator.csv_reader import read_csv
+from master_validator.lexer import lexer
+from master_validator.master_data import ComparisonInt
+from master_validator.parser import Context, Validator
+from master_validator.snapshot_cache import SnapshotCache
+from master_validator.validator import validate_all
+
+DEFAULT_ROWS = (1000, 10000, 100000, 1000000)
+FILTER_METHODS = ('remove_eq', 'remove_not_eq', 'remove_gt', 'remove_lt', 'remove_ge', 'remove_le')
+# 基準よりこの倍率以上遅くなったら劣化とみなす
+DEFAULT_THRESHOLD = 1.2
+
+
+def best_of(func: Callable[[], object], repeat: int) -> float:
+    """
+    funcをrepeat回実行し、最も速かった実行時間(秒)を返す
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@contextmanager
+def _chdir(path: Path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def bench_rows(rows: int, work_dir: Path, repeat: int) -> Dict[str, float]:
+    """
+    rows行の合成マスタで各処理の実行時間を計測する
+    :param rows:
+    :param work_dir: 合成したファイルを置くディレクトリ
+    :param repeat: 各処理の繰り返し回数
+    :return: 項目名 -> 秒
+    """
+    result: Dict[str, float] = {}
+    csv_path = work_dir.joinpath('csv', 'bench.csv')
+    generate_master(csv_path, rows)
+    generate_validator(work_dir.joinpath('validator', 'bench.txt'))
+
+    result['read_csv'] = best_of(lambda: read_csv(csv_path), repeat)
+    result['read_csv.mmap'] = best_of(lambda: read_csv(csv_path, mapped=True), repeat)
+    csv_reader.set_parse_jobs(os.cpu_count() or 1, 0)
+    try:
+        result['read_csv.parallel'] = best_of(lambda: read_csv(csv_path), repeat)
+    finally:
+        csv_reader.set_parse_jobs(None)
+    csv_reader.set_snapshot_cache(SnapshotCache(work_dir.joinpath('snapshot')))
+    try:
+        # 1回目でスナップショットを作り、2回目以降はスナップショットから読み込む
+        read_csv(csv_path)
+        result['read_csv.snapshot'] = best_of(lambda: read_csv(csv_path), repeat)
+    finally:
+        csv_reader.set_snapshot_cache(None)
+
+    lines = validator_lines()
+    result['lexer'] = best_of(lambda: [lexer(line) for line in lines], repeat)
+    token_lists = [lexer(line) for line in lines]
+
+    def parse():
+        for tokens in token_lists:
+            Validator().parse(Context(None, tokens, compiler.DEFAULT_MOD_PATH))
+
+    result['Validator.parse'] = best_of(parse, repeat)
+    result['compile_lines'] = best_of(lambda: compiler.compile_lines('bench', lines), repeat)
+
+    master = read_csv(csv_path)
+    value = ComparisonInt('500')
+    # 初回は索引の作成を含む
+    result['filter.cold'] = best_of(lambda: master.view().remove_eq('attack', value), 1)
+    for method in FILTER_METHODS:
+        result[f'filter.{method}'] = best_of(lambda: getattr(master.view(), method)('attack', value), repeat)
+
+    def run_validate_all():
+        compiler.clear_memory_cache()
+        with _chdir(work_dir):
+            validate_all('csv')
+
+    result['validate_all'] = best_of(run_validate_all, repeat)
+    return result
+
+
+def run(rows_list: List[int], repeat: int) -> Dict:
+    results = {}
+    for rows in rows_list:
+        with tempfile.TemporaryDirectory() as work_dir:
+            print(f'rows={rows}', file=sys.stderr)
+            results[str(rows)] = bench_rows(rows, Path(work_dir), repeat)
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': vectorized.is_enabled(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """
+    currentとbaselineで共通する項目を比較し、threshold倍以上遅くなった項目を返す
+    :param current: run()の戻り値
+    :param baseline: run()の戻り値
+    :param threshold:
+    :return:
+    """
+    regressions = []
+    for rows, metrics in current['results'].items():
+        base_metrics = baseline['results'].get(rows, {})
+        for name, seconds in metrics.items():
+            base = base_metrics.get(name)
+            if not base:
+                continue
+            ratio = seconds / base
+            if ratio >= threshold:
+                regressions.append({'rows': rows, 'metric': name, 'baseline': base, 'current': seconds,
+                                    'ratio': ratio})
+    return regressions
+
+
+def print_table(report: Dict, file=sys.stdout):
+    for rows, metrics in report['results'].items():
+        print(f'## rows={rows}', file=file)
+        for name, seconds in metrics.items():
+            print(f'{name:<24}{seconds * 1000:>12.3f} ms', file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='master_validator benchmark')
+    parser.add_argument('--rows', type=int, nargs='+', default=list(DEFAULT_ROWS), help='合成するマスタの行数')
+    parser.add_argument('--repeat', type=int, default=3, help='各処理の繰り返し回数')
+    parser.add_argument('--output', default=None, help='結果を保存するJSONファイル')
+    parser.add_argument('--baseline', default=None, help='比較する基準の結果のJSONファイル')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='劣化とみなす倍率')
+    args = parser.parse_args(argv)
+
+    report = run(args.rows, args.repeat)
+    print_table(report)
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.baseline is not None:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.threshold)
+        for r in regressions:
+            print(f'REGRESSION rows={r["rows"]} {r["metric"]}: '
+                  f'{r["baseline"] * 1000:.3f} ms -> {r["current"] * 1000:.3f} ms (x{r["ratio"]:.2f})')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+集計のバリデーションを1回の走査でまとめて評価するためのモジュール
+@aggregateで宣言されたバリデーションはAggregateを作り、run_aggregates()で同じ行の集合を1度だけ走査して集計する。
+グループ化はグループのキーから集計値へのハッシュ表1つで行い、同じカラムでグループ化する集計は表を共有する。
+スケッチで近似できる集計は、run_aggregates(sketch=True)で一定のメモリで集計できる。
+"""
+import math
+from abc import ABCMeta, abstractmethod
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+from master_validator.column_store import normalize_key
+from master_validator.master_data import MasterRow
+from master_validator.parser import APPROXIMATE_SKETCH, ValidationResult
+from master_validator.sketch import HyperLogLog, QuantileSketch
+
+Number = Union[int, float]
+
+
+def parse_number(value: str) -> Number:
+    """
+    コマンドの引数を整数か小数にする
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def column_number(row: MasterRow, column: str) -> Optional[Number]:
+    """
+    rowのcolumnカラムの値を整数か小数にして返す。空の値はNone
+    整数として読めない値だけを小数として変換する
+    """
+    raw = row.row[column]
+    if raw is None or raw.strip() == '':
+        return None
+    try:
+        return row.get_column_int(column)
+    except ValueError:
+        return row.get_column_float(column)
+
+
+class Accumulator(metaclass=ABCMeta):
+    """
+    1行ずつ受け取って1つの集計値を求めるクラスの抽象基底クラス
+    """
+
+    @abstractmethod
+    def add(self, row: MasterRow):
+        raise NotImplementedError
+
+
+class Count(Accumulator):
+    """
+    行数を数える。最初の行をエラーの表示用に保持する
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.first: Optional[MasterRow] = None
+
+    def add(self, row: MasterRow):
+        if self.first is None:
+            self.first = row
+        self.value += 1
+
+
+class Sum(Accumulator):
+    """
+    columnカラムの合計を求める。空の値は数えない
+    """
+
+    def __init__(self, column: str):
+        self._column = column
+        self.value: Number = 0
+
+    def add(self, row: MasterRow):
+        value = column_number(row, self._column)
+        if value is not None:
+            self.value += value
+
+
+class Min(Accumulator):
+    """
+    columnカラムの最小値と、最初にその値になった行を求める。空の値は数えない
+    """
+
+    def __init__(self, column: str):
+        self._column = column
+        self.value: Optional[Number] = None
+        self.row: Optional[MasterRow] = None
+
+    def _better(self, value: Number) -> bool:
+        return value < self.value
+
+    def add(self, row: MasterRow):
+        value = column_number(row, self._column)
+        if value is not None and (self.value is None or self._better(value)):
+            self.value = value
+            self.row = row
+
+
+class Max(Min):
+    """
+    columnカラムの最大値と、最初にその値になった行を求める。空の値は数えない
+    """
+
+    def _better(self, value: Number) -> bool:
+        return value > self.value
+
+
+class Distinct(Accumulator):
+    """
+    columnカラムの値の種類数を求める。値はnormalize_key()で比較し、空の値は数えない
+    """
+
+    def __init__(self, column: str):
+        self._column = column
+        self._values = set()
+
+    @property
+    def value(self) -> int:
+        return len(self._values)
+
+    def add(self, row: MasterRow):
+        value = normalize_key(row.row[self._column])
+        if value is not None:
+            self._values.add(value)
+
+
+class ApproxDistinct(Accumulator):
+    """
+    columnカラムの値の種類数をHyperLogLogで近似する。Distinctと同じく値はnormalize_key()で比較する
+    """
+
+    def __init__(self, column: str):
+        self._column = column
+        self._sketch = HyperLogLog()
+
+    @property
+    def value(self) -> int:
+        return self._sketch.count()
+
+    def add(self, row: MasterRow):
+        value = normalize_key(row.row[self._column])
+        if value is not None:
+            self._sketch.add(value)
+
+
+def nearest_rank(values: List[Number], q: float) -> Optional[Number]:
+    """
+    整列済みのvaluesのq分位数を返す。ceil(q * n)番目(1始まり)の値で、値が無い場合はNone
+    """
+    if not values:
+        return None
+    return values[min(max(math.ceil(q * len(values)) - 1, 0), len(values) - 1)]
+
+
+class Quantile(Accumulator):
+    """
+    columnカラムのq分位数を求める。空の値は数えない
+    全ての値を保持するので、行数に比例したメモリを使う
+    """
+
+    def __init__(self, column: str, q: float):
+        self._column = column
+        self._q = q
+        self._values: List[Number] = []
+
+    @property
+    def value(self) -> Optional[Number]:
+        return nearest_rank(sorted(self._values), self._q)
+
+    def add(self, row: MasterRow):
+        value = column_number(row, self._column)
+        if value is not None:
+            self._values.append(value)
+
+
+class ApproxQuantile(Accumulator):
+    """
+    columnカラムのq分位数をQuantileSketchで近似する。空の値は数えない
+    """
+
+    def __init__(self, column: str, q: float):
+        self._column = column
+        self._q = q
+        self._sketch = QuantileSketch()
+
+    @property
+    def value(self) -> Optional[Number]:
+        return self._sketch.quantile(self._q)
+
+    def add(self, row: MasterRow):
+        value = column_number(row, self._column)
+        if value is not None:
+            self._sketch.add(value)
+
+
+class Aggregate:
+    """
+    集計のバリデーション1つ分の定義
+    group_byカラムの値の組毎にmake_accumulator()で作ったAccumulatorで集計し、check()で結果にする。
+    """
+
+    def __init__(self, group_by: Tuple[str, ...], make_accumulator: Callable[[], Accumulator],
+                 check: Callable[[str, Dict[Hashable, Accumulator]], ValidationResult],
+                 make_sketch: Optional[Callable[[], Accumulator]] = None):
+        """
+        :param group_by: グループ化するカラム名。空なら全ての行を1つのグループにする
+        :param make_accumulator: グループ毎に呼ばれ、新しいAccumulatorを返す関数
+        :param check: マスタ名と、グループのキー -> 集計済みのAccumulatorを受け取って結果を返す関数。
+            group_byが空の場合のキーは()で、行が無くても必ず含まれる
+        :param make_sketch: make_accumulatorの代わりに近似で集計する場合に、一定のメモリで集計するAccumulatorを返す関数。
+            valueはmake_accumulatorのものと同じ意味で、checkにそのまま渡せるものとする
+        """
+        self.group_by = tuple(group_by)
+        self.make_accumulator = make_accumulator
+        self.check = check
+        self.make_sketch = make_sketch
+
+    def factory(self, sketch: bool) -> Callable[[], Accumulator]:
+        """
+        sketchが真で、make_sketchがあればmake_sketchを、それ以外はmake_accumulatorを返す
+        """
+        return self.make_sketch if sketch and self.make_sketch is not None else self.make_accumulator
+
+
+def run_aggregates(master_data, aggregates: List[Aggregate], sketch: bool = False) -> List[ValidationResult]:
+    """
+    master_dataを1度だけ走査して、aggregatesを全て集計する
+    同じカラムでグループ化するAggregateは、1つのハッシュ表にグループ毎のAccumulatorを並べて持つ
+    :param master_data: MasterDataManipulatorかMasterDataStream
+    :param aggregates:
+    :param sketch: 真ならmake_sketchを持つAggregateをスケッチで近似し、その結果を近似の結果として記録する
+    :return: aggregatesと同じ順の結果
+    """
+    # グループ化するカラム -> そのカラムでグループ化するAggregateの番号
+    members: Dict[Tuple[str, ...], List[int]] = {}
+    for i, aggregate in enumerate(aggregates):
+        members.setdefault(aggregate.group_by, []).append(i)
+    # グループ化するカラム -> グループのキー -> membersの順のAccumulator
+    tables: Dict[Tuple[str, ...], Dict[Hashable, List[Accumulator]]] = {}
+    for group_by, indices in members.items():
+        tables[group_by] = {}
+        if not group_by:
+            tables[group_by][()] = [aggregates[i].factory(sketch)() for i in indices]
+
+    plans = [(group_by, tables[group_by], [aggregates[i].factory(sketch) for i in indices])
+             for group_by, indices in members.items()]
+    for row in master_data.all():
+        for group_by, table, factories in plans:
+            if group_by:
+                key = tuple(normalize_key(row.row[column]) for column in group_by)
+                accumulators = table.get(key)
+                if accumulators is None:
+                    accumulators = table[key] = [make() for make in factories]
+            else:
+                accumulators = table[()]
+            for accumulator in accumulators:
+                accumulator.add(row)
+
+    results: List[Optional[ValidationResult]] = [None] * len(aggregates)
+    for group_by, indices in members.items():
+        table = tables[group_by]
+        for j, i in enumerate(indices):
+            groups = {key: accumulators[j] for key, accumulators in table.items()}
+            results[i] = aggregates[i].check(master_data.master_name, groups)
+            if sketch and aggregates[i].make_sketch is not None:
+                results[i].mark_approximate(APPROXIMATE_SKETCH)
+    return results
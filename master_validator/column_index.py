@@ -0,0 +1,88 @@
+"""
+カラムの値から行位置を引くための索引を扱うモジュール
+索引はカラムが初めてフィルターされたときに作り、ColumnStoreにキャッシュして実行中は使い回す。
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional
+
+from master_validator import vectorized
+
+
+class ColumnIndex:
+    """
+    1カラム分の索引
+    等値の検索はハッシュ索引、範囲の検索はソート済み索引を使う。どちらも初めて必要になったときに作る。
+    """
+
+    def __init__(self, values: List[Any]):
+        """
+        :param values: 行位置毎の型変換済みの値
+        """
+        self._values = values
+        # 値 -> 行位置の配列
+        self._hash: Optional[Dict[Any, array]] = None
+        # 昇順に並べた値と、それぞれの行位置
+        self._sorted_values: Optional[List[Any]] = None
+        self._sorted_positions: Optional[array] = None
+
+    def _hash_index(self) -> Dict[Any, array]:
+        if self._hash is None:
+            self._hash = {}
+            for pos, value in enumerate(self._values):
+                positions = self._hash.get(value)
+                if positions is None:
+                    positions = self._hash[value] = array('l')
+                positions.append(pos)
+        return self._hash
+
+    def _sorted_index(self):
+        if self._sorted_values is None:
+            order = sorted(range(len(self._values)), key=self._values.__getitem__)
+            self._sorted_values = [self._values[pos] for pos in order]
+            self._sorted_positions = array('l', order)
+        return self._sorted_values, self._sorted_positions
+
+    def positions(self, op: str, value):
+        """
+        「カラムの値 op value」を満たす行位置を返す
+        :param op: 'eq', 'gt', 'lt', 'ge', 'le' のいずれか
+        :param value:
+        :return:
+        """
+        if op == 'eq':
+            return self._hash_index().get(value, ())
+
+        values, positions = self._sorted_index()
+        if op == 'gt':
+            return positions[bisect_right(values, value):]
+        if op == 'ge':
+            return positions[bisect_left(values, value):]
+        if op == 'lt':
+            return positions[:bisect_left(values, value)]
+        if op == 'le':
+            return positions[:bisect_right(values, value)]
+        raise ValueError(f'unknown operator. op=[{op}]')
+
+
+def get_index(store, column: str, kind: str):
+    """
+    columnカラムをkind型にした値の索引を返す
+    初回の呼び出しで作ってstoreにキャッシュする。変換できない値がある場合はNoneを返す
+    :param store: ColumnStore
+    :param column:
+    :param kind: ConversionCacheの型名
+    :return: ColumnIndex、NumPyが使える場合は vectorized.SortedIndex
+    """
+    key = (column, kind)
+    if key in store.indexes:
+        return store.indexes[key]
+
+    if vectorized.is_enabled():
+        index = vectorized.build_index(store, column, kind)
+    else:
+        values = store.conversions.convert_all(column, kind)
+        index = None if values is None else ColumnIndex(values)
+
+    store.indexes[key] = index
+    return index
@@ -0,0 +1,350 @@
+"""
+マスターデータを列単位で保持するためのモジュール
+"""
+from array import array
+from collections.abc import Mapping
+from sys import intern
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from master_validator.conversion_cache import ConversionCache
+
+# array('q')に格納できる整数の範囲
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+# 主キーを指定しない場合のカラム。この場合だけpkを整数として扱う
+DEFAULT_KEY_COLUMNS: Tuple[str, ...] = ('id',)
+
+
+def normalize_key(value: Optional[str]):
+    """
+    参照や複合主キーの比較に使うキーを返す
+    pkと同じく整数として読める値は整数に、それ以外は前後の空白を除いた文字列にする。空の値はNone
+    :param value:
+    :return:
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def key_of(row: Mapping, key_columns: Sequence[str] = DEFAULT_KEY_COLUMNS):
+    """
+    rowの主キーの値を返す
+    :param row: 1行を表す辞書
+    :param key_columns: 主キーのカラム名
+    :return: 主キーがidなら整数、複合主キーならnormalize_key()した値のタプル
+    """
+    if tuple(key_columns) == DEFAULT_KEY_COLUMNS:
+        if 'id' not in row:
+            raise KeyError('not exist id column error.')
+        return int(row['id'])
+    missing = [column for column in key_columns if column not in row]
+    if missing:
+        raise KeyError(f'not exist key column error. columns=[{missing}]')
+    return tuple(normalize_key(row[column]) for column in key_columns)
+
+
+def _as_exact_int(value) -> Optional[int]:
+    """
+    文字列に戻したときに元の文字列と完全に一致する整数ならその値を返す
+    一致しない場合(空白や先頭の0を含む場合など)はNoneを返す
+    """
+    if value is None:
+        return None
+    try:
+        i = int(value)
+    except ValueError:
+        return None
+    if str(i) != value or not _INT64_MIN <= i <= _INT64_MAX:
+        return None
+    return i
+
+
+class Column:
+    """
+    1カラム分の値を保持するクラス
+    全ての値が整数として表現できる間はarray('q')で保持し、
+    そうでない値が現れた時点で文字列のリストに切り替える。
+    """
+    __slots__ = ('_ints', '_strs')
+
+    def __init__(self):
+        self._ints: Optional[array] = array('q')
+        self._strs: Optional[List[Optional[str]]] = None
+
+    @property
+    def is_int(self) -> bool:
+        return self._strs is None
+
+    def _degrade(self):
+        self._strs = [intern(str(i)) for i in self._ints]
+        self._ints = None
+
+    def append(self, value: Optional[str]):
+        if self._strs is None:
+            i = _as_exact_int(value)
+            if i is not None:
+                self._ints.append(i)
+                return
+            self._degrade()
+        self._strs.append(value if value is None else intern(value))
+
+    def set(self, pos: int, value: Optional[str]):
+        if self._strs is None:
+            i = _as_exact_int(value)
+            if i is not None:
+                self._ints[pos] = i
+                return
+            self._degrade()
+        self._strs[pos] = value if value is None else intern(value)
+
+    def extend(self, other: 'Column'):
+        """
+        otherの値を末尾に追加する。どちらも整数の配列ならまとめてコピーする
+        """
+        if self._strs is None and other._strs is None:
+            self._ints.extend(other._ints)
+            return
+        if self._strs is None:
+            self._degrade()
+        if other._strs is None:
+            self._strs.extend(intern(str(i)) for i in other._ints)
+        else:
+            # 別のプロセスから受け取った文字列は同じ値でも別のオブジェクトなので、internし直す
+            self._strs.extend(value if value is None else intern(value) for value in other._strs)
+
+    def __getitem__(self, pos: int) -> Optional[str]:
+        if self._strs is None:
+            return str(self._ints[pos])
+        return self._strs[pos]
+
+    def __len__(self):
+        return len(self._ints) if self._strs is None else len(self._strs)
+
+    @property
+    def ints(self) -> array:
+        """
+        is_intの場合の値の配列
+        """
+        return self._ints
+
+    def state(self):
+        """
+        スナップショットに保存する値。is_intならarray('q')、そうでなければ文字列のリスト
+        """
+        return self._ints if self._strs is None else self._strs
+
+    @classmethod
+    def from_state(cls, state) -> 'Column':
+        column = cls()
+        if isinstance(state, array):
+            column._ints = state
+        else:
+            # 同じ文字列はpickleで同じオブジェクトとして復元されるので、改めてinternしない
+            column._ints = None
+            column._strs = state
+        return column
+
+
+class ColumnStore:
+    """
+    マスタデータを列単位で保持するクラス
+    ヘッダーは1度だけ保持し、値はカラム毎のColumnに格納する。
+    主キーはpkの配列とpkから行位置への索引で保持する。
+    主キーがidの場合はpkを整数としてarray('q')に、複合主キーの場合はnormalize_key()した値のタプルとしてリストに格納する。
+    """
+
+    def __init__(self, header: Iterable[str], key_columns: Sequence[str] = DEFAULT_KEY_COLUMNS):
+        """
+        :param header: カラム名のリスト
+        :param key_columns: 主キーのカラム名。複数指定した場合は複合主キーになる
+        """
+        self.header: List[str] = list(header)
+        self.key_columns: Tuple[str, ...] = tuple(key_columns)
+        self._columns: Dict[str, Column] = {name: Column() for name in self.header}
+        # 主キーがidだけの場合はpkを整数として扱う
+        self._int_pk = self.key_columns == DEFAULT_KEY_COLUMNS
+        self._pks = array('q') if self._int_pk else []
+        self.pk_index: Dict = {}
+        # 読み込み中に見つかった重複したpk -> 上書きされた行数
+        self.duplicates: Dict = {}
+        # 型変換結果のキャッシュ。このストアを参照する全てのフィルターとバリデーションで共有する
+        self.conversions = ConversionCache(self)
+        # (カラム, 型) -> NumPyの配列。vectorizedモジュールが使う
+        self.vector_cache: Dict = {}
+        # (カラム, 型) -> 索引。column_indexモジュールが使う
+        self.indexes: Dict = {}
+
+    @classmethod
+    def from_dicts(cls, rows, header: Optional[Iterable[str]] = None,
+                   key_columns: Sequence[str] = DEFAULT_KEY_COLUMNS):
+        """
+        csv.DictReaderなどの辞書のイテラブルからColumnStoreを作る
+        :param rows: 1行を辞書で表したイテラブル
+        :param header: カラム名のリスト。省略時はrows.fieldnamesか先頭行のキーを使う
+        :param key_columns: 主キーのカラム名
+        :return:
+        """
+        if header is None:
+            header = getattr(rows, 'fieldnames', None)
+        it = iter(rows)
+        if header is None:
+            # ヘッダーが分からない場合は先頭行のキーをヘッダーにする
+            first = next(it, None)
+            store = cls(first.keys() if first is not None else [], key_columns)
+            if first is not None:
+                store.append(first)
+        else:
+            store = cls(header, key_columns)
+        for row in it:
+            store.append(row)
+        return store
+
+    def to_snapshot(self) -> Dict:
+        """
+        値をpickleで保存できる辞書にして返す。from_snapshot()で同じ内容のColumnStoreに戻せる
+        型変換のキャッシュや索引は含めない
+        """
+        return {
+            'header': self.header,
+            'key_columns': self.key_columns,
+            'pks': self._pks,
+            'duplicates': self.duplicates,
+            'columns': {name: column.state() for name, column in self._columns.items()},
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict) -> 'ColumnStore':
+        """
+        to_snapshot()で作った辞書からColumnStoreを作る。csvの解析と重複したpkの処理は済んでいるので行わない
+        """
+        store = cls(snapshot['header'], snapshot['key_columns'])
+        store._columns = {name: Column.from_state(state) for name, state in snapshot['columns'].items()}
+        store._pks = snapshot['pks']
+        store.pk_index = dict(zip(store._pks, range(len(store._pks))))
+        store.duplicates = snapshot['duplicates']
+        return store
+
+    def key_of(self, row: Dict):
+        """
+        rowの主キーの値を返す
+        :param row: 1行を表す辞書
+        :return: 主キーがidなら整数、複合主キーならnormalize_key()した値のタプル
+        """
+        return key_of(row, self.key_columns)
+
+    def append(self, row: Dict):
+        """
+        1行追加する
+        既に同じpkの行がある場合は、辞書と同じく元の位置のまま値を上書きし、duplicatesに記録する
+        """
+        pk = self.key_of(row)
+
+        pos = self.pk_index.get(pk)
+        if pos is not None:
+            self.duplicates[pk] = self.duplicates.get(pk, 0) + 1
+            for name, column in self._columns.items():
+                column.set(pos, row.get(name))
+            return
+
+        self.pk_index[pk] = len(self._pks)
+        self._pks.append(pk)
+        for name, column in self._columns.items():
+            column.append(row.get(name))
+
+    def extend(self, other: 'ColumnStore'):
+        """
+        otherの行を順に末尾に追加する
+        otherのpkが既にある場合はappend()と同じく元の位置の値を上書きし、duplicatesに記録する
+        """
+        if other.header != self.header or other.key_columns != self.key_columns:
+            raise ValueError('can not extend a store with different columns.')
+        for pk, count in other.duplicates.items():
+            self.duplicates[pk] = self.duplicates.get(pk, 0) + count
+        if not self.pk_index.keys().isdisjoint(other.pk_index):
+            # 同じpkの行がある場合は1行ずつ追加して上書きする
+            for pos in range(len(other)):
+                self.append(other.row_dict(pos))
+            return
+
+        base = len(self._pks)
+        self._pks.extend(other._pks)
+        self.pk_index.update(zip(other._pks, range(base, len(self._pks))))
+        for name, column in self._columns.items():
+            column.extend(other._columns[name])
+
+    def __len__(self):
+        return len(self._pks)
+
+    def pk_at(self, pos: int):
+        return self._pks[pos]
+
+    def position_of(self, pk) -> int:
+        return self.pk_index[pk]
+
+    def has_column(self, column: str) -> bool:
+        return column in self._columns
+
+    def value(self, pos: int, column: str) -> Optional[str]:
+        return self._columns[column][pos]
+
+    def column(self, column: str) -> Column:
+        return self._columns[column]
+
+    def row(self, pos: int) -> 'StoreRow':
+        """
+        pos行目を辞書と同じように参照できるビューを返す。値は参照されたときに取り出す
+        """
+        return StoreRow(self, pos)
+
+    def row_dict(self, pos: int) -> Dict[str, Optional[str]]:
+        """
+        pos行目を csv.DictReader と同じ形式の辞書にして返す
+        """
+        return {name: column[pos] for name, column in self._columns.items()}
+
+
+class StoreRow(Mapping):
+    """
+    ColumnStoreの1行を csv.DictReader の辞書と同じように参照するためのビュー
+    辞書と比較でき、reprも辞書と同じになる。
+    """
+    __slots__ = ('_store', '_pos')
+
+    def __init__(self, store, pos: int):
+        """
+        :param store: ColumnStoreかMappedStore
+        :param pos:
+        """
+        self._store = store
+        self._pos = pos
+
+    def __getitem__(self, column: str):
+        if not self._store.has_column(column):
+            raise KeyError(column)
+        return self._store.value(self._pos, column)
+
+    def __contains__(self, column):
+        return self._store.has_column(column)
+
+    def __iter__(self):
+        return iter(self._store.header)
+
+    def __len__(self):
+        return len(self._store.header)
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self))
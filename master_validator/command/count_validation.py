@@ -1,7 +1,9 @@
+from master_validator.declaration import streamable
 from master_validator.master_data import MasterDataManipulator
 from master_validator.parser import ValidationResult, RowsResult
 
 
+@streamable
 def count_validation(master_data: MasterDataManipulator, min_count: str) -> ValidationResult:
     """
     最低でもmin_count件のレコードがあるなら真
@@ -0,0 +1,28 @@
+from master_validator.aggregate import Aggregate, ApproxDistinct, Distinct, run_aggregates
+from master_validator.declaration import aggregate, streamable
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def _distinct_count(column: str, min_count: str) -> Aggregate:
+    bound = int(min_count)
+
+    def check(master_name, groups) -> ValidationResult:
+        count = groups[()].value
+        return RowsResult(count < bound,
+                          master_name=master_name,
+                          validator_name=distinct_count_validation.__name__,
+                          err_msg=f'{column}の値が{min_count}種類以上ありません。{count}種類')
+
+    return Aggregate((), lambda: Distinct(column), check, lambda: ApproxDistinct(column))
+
+
+@streamable
+@aggregate(_distinct_count)
+def distinct_count_validation(master_data: MasterDataManipulator, column: str, min_count: str) -> ValidationResult:
+    """
+    columnカラムの値が最低でもmin_count種類あるなら真
+    値はnormalize_key()で比較し、空の値は数えない
+    :return:
+    """
+    return run_aggregates(master_data, [_distinct_count(column, min_count)])[0]
@@ -0,0 +1,22 @@
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def duplicate_key_validation(master_data: MasterDataManipulator) -> ValidationResult:
+    """
+    csvファイルに主キーが重複した行が無いなら真
+    重複は読み込み時に検出したものを使うので、再度の走査はしない
+    :param master_data:
+    :return: 重複したpkでfind_by_pk()して得られる行を返す。読み込み時に上書きされた行は含まない
+    """
+    duplicates = master_data.duplicate_keys()
+    invalid_rows = [master_data.find_by_pk(pk) for pk in duplicates]
+
+    is_err = len(invalid_rows) >= 1
+    result = RowsResult(is_err,
+                        master_data.master_name,
+                        duplicate_key_validation.__name__,
+                        f'主キーが重複しています。{sum(duplicates.values())}行',
+                        invalid_rows,
+                        )
+    return result
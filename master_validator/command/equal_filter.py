@@ -1,6 +1,13 @@
-from master_validator.master_data import MasterDataManipulator, ComparisonInt
+from master_validator.declaration import predicate, streamable
+from master_validator.master_data import MasterDataManipulator, ComparisonInt, ComparisonPredicate
 
 
+def _keep_equal(column: str, value: str):
+    return ComparisonPredicate(column, ComparisonInt(value), 'eq')
+
+
+@streamable
+@predicate(_keep_equal)
 def equal_filter(master_data: MasterDataManipulator, column: str, value: str):
     """
     同値フィルター
@@ -0,0 +1,30 @@
+from master_validator.aggregate import Aggregate, Count, run_aggregates
+from master_validator.declaration import aggregate, streamable
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def _group_count(column: str, min_count: str) -> Aggregate:
+    bound = int(min_count)
+
+    def check(master_name, groups) -> ValidationResult:
+        invalid = [(key[0], accumulator) for key, accumulator in groups.items() if accumulator.value < bound]
+        counts = ', '.join(f'{value}:{accumulator.value}件' for value, accumulator in invalid)
+        return RowsResult(len(invalid) >= 1,
+                          master_name=master_name,
+                          validator_name=group_count_validation.__name__,
+                          err_msg=f'{column}毎に{min_count}件以上のレコードがありません。{counts}',
+                          err_rows=[accumulator.first for _, accumulator in invalid])
+
+    return Aggregate((column,), Count, check)
+
+
+@streamable
+@aggregate(_group_count)
+def group_count_validation(master_data: MasterDataManipulator, column: str, min_count: str) -> ValidationResult:
+    """
+    columnカラムの値毎に、最低でもmin_count件のレコードがあるなら真
+    値はnormalize_key()で比較する。エラーの場合は件数が足りない値の最初の行を返す
+    :return:
+    """
+    return run_aggregates(master_data, [_group_count(column, min_count)])[0]
@@ -0,0 +1,30 @@
+from master_validator.aggregate import Aggregate, Max, parse_number, run_aggregates
+from master_validator.declaration import aggregate, streamable
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def _max(column: str, max_value: str) -> Aggregate:
+    bound = parse_number(max_value)
+
+    def check(master_name, groups) -> ValidationResult:
+        accumulator = groups[()]
+        is_err = accumulator.value is not None and accumulator.value > bound
+        return RowsResult(is_err,
+                          master_name=master_name,
+                          validator_name=max_validation.__name__,
+                          err_msg=f'{column}の最大値が{max_value}を超えています。{accumulator.value}',
+                          err_rows=[accumulator.row] if is_err else [])
+
+    return Aggregate((), lambda: Max(column), check)
+
+
+@streamable
+@aggregate(_max)
+def max_validation(master_data: MasterDataManipulator, column: str, max_value: str) -> ValidationResult:
+    """
+    columnカラムの最大値がmax_value以下なら真
+    空の値は検証しない。エラーの場合は最大値の行を返す
+    :return:
+    """
+    return run_aggregates(master_data, [_max(column, max_value)])[0]
@@ -0,0 +1,30 @@
+from master_validator.aggregate import Aggregate, Min, parse_number, run_aggregates
+from master_validator.declaration import aggregate, streamable
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def _min(column: str, min_value: str) -> Aggregate:
+    bound = parse_number(min_value)
+
+    def check(master_name, groups) -> ValidationResult:
+        accumulator = groups[()]
+        is_err = accumulator.value is not None and accumulator.value < bound
+        return RowsResult(is_err,
+                          master_name=master_name,
+                          validator_name=min_validation.__name__,
+                          err_msg=f'{column}の最小値が{min_value}未満です。{accumulator.value}',
+                          err_rows=[accumulator.row] if is_err else [])
+
+    return Aggregate((), lambda: Min(column), check)
+
+
+@streamable
+@aggregate(_min)
+def min_validation(master_data: MasterDataManipulator, column: str, min_value: str) -> ValidationResult:
+    """
+    columnカラムの最小値がmin_value以上なら真
+    空の値は検証しない。エラーの場合は最小値の行を返す
+    :return:
+    """
+    return run_aggregates(master_data, [_min(column, min_value)])[0]
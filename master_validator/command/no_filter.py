@@ -1,6 +1,13 @@
+from master_validator.declaration import predicate, streamable
 from master_validator.master_data import MasterDataManipulator
 
 
+def _keep_all():
+    return lambda row: True
+
+
+@streamable
+@predicate(_keep_all)
 def no_filter(master_data: MasterDataManipulator):
     """
     何もしないフィルター
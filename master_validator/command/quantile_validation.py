@@ -0,0 +1,32 @@
+from master_validator.aggregate import ApproxQuantile, Aggregate, Quantile, parse_number, run_aggregates
+from master_validator.declaration import aggregate, streamable
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def _quantile(column: str, q: str, min_value: str, max_value: str) -> Aggregate:
+    rank = float(q)
+    if not 0 <= rank <= 1:
+        raise ValueError(f'q must be between 0 and 1. q=[{q}]')
+    low, high = parse_number(min_value), parse_number(max_value)
+
+    def check(master_name, groups) -> ValidationResult:
+        value = groups[()].value
+        return RowsResult(value is not None and not low <= value <= high,
+                          master_name=master_name,
+                          validator_name=quantile_validation.__name__,
+                          err_msg=f'{column}の{q}分位数が{min_value}以上{max_value}以下ではありません。{value}')
+
+    return Aggregate((), lambda: Quantile(column, rank), check, lambda: ApproxQuantile(column, rank))
+
+
+@streamable
+@aggregate(_quantile)
+def quantile_validation(master_data: MasterDataManipulator, column: str, q: str, min_value: str,
+                        max_value: str) -> ValidationResult:
+    """
+    columnカラムのq分位数(0 <= q <= 1)がmin_value以上max_value以下なら真
+    q分位数は値を昇順に並べたceil(q * 件数)番目の値とする。空の値は数えず、値が無ければ真
+    :return:
+    """
+    return run_aggregates(master_data, [_quantile(column, q, min_value, max_value)])[0]
@@ -0,0 +1,42 @@
+from master_validator.declaration import references, row_local, streamable
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+from master_validator.registry import normalize_key
+
+
+def _referenced_masters(column: str, target: str, target_column: str = 'id'):
+    return [target]
+
+
+@streamable
+@row_local
+@references(_referenced_masters)
+def reference_validation(master_data: MasterDataManipulator, column: str, target: str,
+                         target_column: str = 'id') -> ValidationResult:
+    """
+    columnカラムの値が全てtargetマスタのtarget_columnカラムに存在するなら真
+    空の値は参照なしとみなして検証しない
+    :param master_data:
+    :param column: 参照元のカラム名
+    :param target: 参照先のマスタ名
+    :param target_column: 参照先のカラム名
+    :return:
+    """
+    if master_data.registry is None:
+        raise ValueError('master registry is not set.')
+    keys = master_data.registry.key_set(target, target_column)
+
+    invalid_rows = []
+    for row in master_data.all():
+        key = normalize_key(row.row[column])
+        if key is not None and key not in keys:
+            invalid_rows.append(row)
+
+    is_err = len(invalid_rows) >= 1
+    result = RowsResult(is_err,
+                        master_data.master_name,
+                        reference_validation.__name__,
+                        f'{column}の値が{target}の{target_column}に存在しません。',
+                        invalid_rows,
+                        )
+    return result
@@ -0,0 +1,28 @@
+from master_validator.aggregate import Aggregate, Sum, parse_number, run_aggregates
+from master_validator.declaration import aggregate, streamable
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def _sum(column: str, min_sum: str, max_sum: str) -> Aggregate:
+    low, high = parse_number(min_sum), parse_number(max_sum)
+
+    def check(master_name, groups) -> ValidationResult:
+        total = groups[()].value
+        return RowsResult(not low <= total <= high,
+                          master_name=master_name,
+                          validator_name=sum_validation.__name__,
+                          err_msg=f'{column}の合計が{min_sum}以上{max_sum}以下ではありません。{total}')
+
+    return Aggregate((), lambda: Sum(column), check)
+
+
+@streamable
+@aggregate(_sum)
+def sum_validation(master_data: MasterDataManipulator, column: str, min_sum: str, max_sum: str) -> ValidationResult:
+    """
+    columnカラムの合計がmin_sum以上max_sum以下なら真
+    空の値は合計しない
+    :return:
+    """
+    return run_aggregates(master_data, [_sum(column, min_sum, max_sum)])[0]
@@ -1,7 +1,10 @@
+from master_validator.declaration import row_local, streamable
 from master_validator.master_data import MasterDataManipulator
 from master_validator.parser import ValidationResult, RowsResult
 
 
+@streamable
+@row_local
 def time_0sec_validation(master_data: MasterDataManipulator) -> ValidationResult:
     """
     :return:
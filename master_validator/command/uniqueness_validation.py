@@ -0,0 +1,44 @@
+from typing import Dict, List
+
+from master_validator.column_store import normalize_key
+from master_validator.master_data import MasterDataManipulator, MasterRow
+from master_validator.parser import ValidationResult, RowsResult
+
+
+def uniqueness_validation(master_data: MasterDataManipulator, *columns: str) -> ValidationResult:
+    """
+    columnsカラムの値の組が全ての行で異なるなら真
+    値の組をキーにした辞書への1回の走査で判定する。空の値を含む組は検証しない
+    :param master_data:
+    :param columns: 1つ以上のカラム名
+    :return: 重複した組の全ての行を、組毎にまとめて返す
+    """
+    if not columns:
+        raise ValueError('uniqueness_validation requires at least one column.')
+
+    # キー -> 最初に現れた行
+    first_rows: Dict[tuple, MasterRow] = {}
+    # キー -> 重複した行。最初の行を先頭に含む
+    duplicated: Dict[tuple, List[MasterRow]] = {}
+    for row in master_data.all():
+        key = tuple(normalize_key(row.row[column]) for column in columns)
+        if None in key:
+            continue
+        first = first_rows.setdefault(key, row)
+        if first is row:
+            continue
+        rows = duplicated.get(key)
+        if rows is None:
+            duplicated[key] = [first, row]
+        else:
+            rows.append(row)
+
+    invalid_rows = [row for rows in duplicated.values() for row in rows]
+    is_err = len(invalid_rows) >= 1
+    result = RowsResult(is_err,
+                        master_data.master_name,
+                        uniqueness_validation.__name__,
+                        f'{",".join(columns)}の値が重複しています。{len(duplicated)}組',
+                        invalid_rows,
+                        )
+    return result
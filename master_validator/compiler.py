@@ -0,0 +1,425 @@
+"""
+バリデーターファイルをコンパイルし、実行可能な形で再利用するためのモジュール
+コンパイル結果はバリデーターファイルの内容とコマンドモジュールのハッシュをキーにしてキャッシュする。
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from importlib import import_module
+from logging import debug, warning
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from master_validator.aggregate import run_aggregates
+from master_validator.csv_reader import iter_csv_rows, primary_key_of
+from master_validator.declaration import is_streamable
+from master_validator.master_data import DuplicateKeyError, MasterDataManipulator, MasterDataStream
+from master_validator.parser import APPROXIMATE_SAMPLE, Context, ValidationResult, Validator, parse_lines
+from master_validator.tracing import TraceHook, traced
+
+DEFAULT_MOD_PATH = 'master_validator.command'
+
+# キャッシュ形式を変更した場合はこの値を変える
+_CACHE_FORMAT_VERSION = '1'
+
+# キャッシュキー -> CompiledValidator
+_memory_cache: Dict[str, 'CompiledValidator'] = {}
+
+# モジュールパス -> (各ファイルの(名前, 更新時刻, サイズ), コマンドのハッシュ)
+_command_versions: Dict[str, Tuple[tuple, str]] = {}
+
+
+class ValidatorExecutionError(Exception):
+    """
+    バリデータの実行中にコマンドで例外が発生したことを表す例外
+    プロセスをまたいでも、どのマスタのどのバリデータで失敗したか分かるようにする
+    """
+
+    def __init__(self, master_name: str, validator: str, message: str):
+        super().__init__(master_name, validator, message)
+        self.master_name = master_name
+        self.validator = validator
+        self.message = message
+
+    def __str__(self):
+        return f'master=<{self.master_name}> validator=<{self.validator}> error=<{self.message}>'
+
+
+class CompiledValidator:
+    """
+    バリデーターファイル1つ分のコンパイル結果
+    各行の構文木はコマンドの関数が解決済みの状態で保持する。
+    """
+
+    def __init__(self, name: str, lines: List[str], validators: List[Validator], mod_path: str):
+        self.name = name
+        self.lines = lines
+        self.validators = validators
+        self.mod_path = mod_path
+        # 直前のexecute()でのフィルターの評価回数
+        self.stats: Dict[str, int] = {}
+
+    def execute(self, master_data: MasterDataManipulator, hooks: Optional[List[TraceHook]] = None,
+                on_result: Optional[Callable[[ValidationResult], None]] = None,
+                sampled: Optional[MasterDataManipulator] = None) -> List[ValidationResult]:
+        """
+        全ての行のバリデータを実行する
+        各行には全行を選択したビューを渡す
+        :param master_data:
+        :param hooks: 各ノードの実行の前後で呼ぶフック
+        :param on_result: 各行の結果が出る度に呼ぶ関数
+        :param sampled: master_dataから無作為に選んだ行のビュー。指定した場合は近似の実行になり、
+            結果が行毎に決まるバリデータはsampledで実行し、集計のバリデーションはスケッチで近似する
+        :return:
+        """
+        # サンプリングした行で実行する行番号。フィルターの評価結果はマスタ全体とサンプルで別に共有する
+        on_sample = {i for i, validator in enumerate(self.validators)
+                     if sampled is not None and validator.is_row_local()}
+        prefix_cache = _PrefixCache(self.validators, [i for i in range(len(self.validators)) if i not in on_sample])
+        sample_cache = _PrefixCache(self.validators, sorted(on_sample))
+        # 近似の実行では、スケッチを使うために1行だけの集計も_execute_aggregates()で実行する
+        aggregate_groups = _aggregate_groups(self.validators, 1 if sampled is not None else 2)
+        # 集計をまとめて実行した行の、まだ返していない結果
+        fused_results: Dict[int, ValidationResult] = {}
+        fused = 0
+        result_list = []
+        for i, validator in enumerate(self.validators):
+            line = Context(sampled if i in on_sample else master_data, [], self.mod_path, hooks, str(validator))
+            try:
+                with traced(line, 'validator', str(validator)):
+                    filtered = (sample_cache if i in on_sample else prefix_cache).evaluate(i, line)
+                    c = Context(filtered.view(), [], self.mod_path, hooks, str(validator))
+                    if i in aggregate_groups:
+                        results = self._execute_aggregates(aggregate_groups[i], filtered, hooks, sampled is not None)
+                        fused += len(results)
+                        fused_results.update(results)
+                    if i in fused_results:
+                        c.result_info = fused_results.pop(i)
+                    else:
+                        validator.validation.execute(c)
+                    if i in on_sample:
+                        c.result_info.mark_approximate(APPROXIMATE_SAMPLE, sampled.count(), master_data.count())
+            except Exception as e:
+                raise ValidatorExecutionError(master_data.master_name, str(validator), repr(e)) from e
+            result_list.append(c.result_info)
+            if on_result is not None:
+                on_result(c.result_info)
+
+        self.stats = {key: value + sample_cache.stats()[key] for key, value in prefix_cache.stats().items()}
+        self.stats['fused_aggregates'] = fused
+        debug(f'filter prefix sharing [{self.name}] {self.stats}')
+        return result_list
+
+    def _execute_aggregates(self, indices: List[int], filtered: MasterDataManipulator,
+                            hooks: Optional[List[TraceHook]], sketch: bool = False) -> Dict[int, ValidationResult]:
+        """
+        同じフィルター列の後にあるindicesの行の集計のバリデーションを、1回の走査でまとめて実行する
+        失敗した場合は、どの行で失敗したか分かるように空の結果を返して1行ずつ実行させる
+        :param indices: 行番号のリスト
+        :param filtered: フィルターを適用したビュー
+        :param hooks:
+        :param sketch: 真ならスケッチで近似できる集計を近似する
+        :return: 行番号 -> 結果
+        """
+        names = ', '.join(str(self.validators[i].validation) for i in indices)
+        c = Context(filtered.view(), [], self.mod_path, hooks, names)
+        try:
+            aggregates = [self.validators[i].validation.make_aggregate(c) for i in indices]
+            with traced(c, 'validation', f'aggregate[{names}]'):
+                results = run_aggregates(c.master_data, aggregates, sketch)
+        except Exception as e:
+            debug(f'fused aggregate error. validations=[{names}] error=[{e!r}]')
+            return {}
+        return dict(zip(indices, results))
+
+    def subset(self, indices: List[int]) -> 'CompiledValidator':
+        """
+        indicesで指定した行だけを持つCompiledValidatorを返す
+        :param indices: 行番号(0始まり)のリスト
+        :return:
+        """
+        return CompiledValidator(self.name,
+                                 [self.lines[i] for i in indices],
+                                 [self.validators[i] for i in indices],
+                                 self.mod_path)
+
+    def is_streamable(self) -> bool:
+        """
+        全ての行の全てのコマンドがストリーム実行できるならTrue
+        :return:
+        """
+        return all(is_streamable(command) for validator in self.validators for command in validator.commands())
+
+    def execute_stream(self, path: Path, master_name: str, hooks: Optional[List[TraceHook]] = None,
+                       registry=None,
+                       on_result: Optional[Callable[[ValidationResult], None]] = None) -> List[ValidationResult]:
+        """
+        マスタをメモリに読み込まずに全ての行のバリデータを実行する
+        行毎にcsvファイルを先頭から読み、フィルターとバリデーションへ1行ずつ流す。
+        フィルター列が同じ集計のバリデーションは、csvファイルを1回だけ読んでまとめて実行する。
+        最初の行ではcsvファイルを最後まで読んで同じpkの行が無いか調べ、あればDuplicateKeyErrorを送出する。
+        その場合はまだon_resultを呼んでいない。
+        :param path: マスタのcsvファイルのパス
+        :param master_name:
+        :param hooks: 各ノードの実行の前後で呼ぶフック
+        :param registry: 他のマスタを参照するためのMasterRegistry
+        :param on_result: 各行の結果が出る度に呼ぶ関数
+        :return:
+        """
+        key_columns = primary_key_of(master_name)
+        aggregate_groups = _aggregate_groups(self.validators)
+        # 集計をまとめて実行した行の、まだ返していない結果
+        fused_results: Dict[int, ValidationResult] = {}
+        fused = scans = 0
+        result_list = []
+        for i, validator in enumerate(self.validators):
+            if i in fused_results:
+                result = fused_results.pop(i)
+            else:
+                stream = MasterDataStream(iter_csv_rows(path), master_name, key_columns, check_duplicates=i == 0)
+                stream.registry = registry
+                scans += 1
+                c = Context(stream, [], self.mod_path, hooks, str(validator))
+                try:
+                    if i in aggregate_groups:
+                        results = self._execute_stream_aggregates(aggregate_groups[i], c)
+                        fused += len(results)
+                        fused_results.update(results)
+                        c.result_info = fused_results.pop(i)
+                    else:
+                        self._execute_one(validator, c)
+                    if i == 0:
+                        stream.drain()
+                finally:
+                    stream.close()
+                if stream.duplicate_pk is not None:
+                    raise DuplicateKeyError(master_name, stream.duplicate_pk)
+                result = c.result_info
+            result_list.append(result)
+            if on_result is not None:
+                on_result(result)
+
+        self.stats = {'csv_scans': scans, 'fused_aggregates': fused}
+        debug(f'stream execution [{self.name}] {self.stats}')
+        return result_list
+
+    def _execute_stream_aggregates(self, indices: List[int], c: Context) -> Dict[int, ValidationResult]:
+        """
+        同じフィルター列の後にあるindicesの行の集計のバリデーションを、ストリームを1回流してまとめて実行する
+        ストリームは流し直せないので、失敗した場合はまとめた行の名前でValidatorExecutionErrorを送出する
+        :param indices: 行番号のリスト
+        :param c: ストリームを持つContext
+        :return: 行番号 -> 結果
+        """
+        names = ', '.join(str(self.validators[i].validation) for i in indices)
+        try:
+            for node in self.validators[indices[0]].filters:
+                node.execute(c)
+            aggregates = [self.validators[i].validation.make_aggregate(c) for i in indices]
+            with traced(c, 'validation', f'aggregate[{names}]'):
+                results = run_aggregates(c.master_data, aggregates)
+        except Exception as e:
+            raise ValidatorExecutionError(c.master_name, names, repr(e)) from e
+        return dict(zip(indices, results))
+
+    def _execute_one(self, validator: Validator, c: Context):
+        try:
+            validator.execute(c)
+        except Exception as e:
+            raise ValidatorExecutionError(c.master_name, str(validator), repr(e)) from e
+
+
+def _aggregate_groups(validators: List[Validator], min_size: int = 2) -> Dict[int, List[int]]:
+    """
+    バリデーションが@aggregateで宣言された行を、フィルター列が同じもの毎にまとめる
+    :param validators:
+    :param min_size: まとめた行数がこれ以上のものだけを返す
+    :return: まとめた中で最初の行番号 -> まとめた行番号のリスト
+    """
+    groups: Dict[tuple, List[int]] = {}
+    for i, validator in enumerate(validators):
+        if validator.validation.is_aggregate():
+            groups.setdefault(tuple(node.key() for node in validator.filters), []).append(i)
+    return {indices[0]: indices for indices in groups.values() if len(indices) >= min_size}
+
+
+class _PrefixCache:
+    """
+    複数の行で共通する先頭からのフィルター列(プレフィックス)の評価結果を共有するためのクラス
+    行のフィルター列をキーの列とみなしたプレフィックス木の各ノードを、マスタ毎に1度だけ評価する。
+    評価結果は、そのプレフィックスを使う最後の行を実行した後で破棄する。
+    """
+
+    def __init__(self, validators: List[Validator], indices: Optional[List[int]] = None):
+        """
+        :param validators:
+        :param indices: evaluate()する行番号の昇順のリスト。省略時は全ての行
+        """
+        self._keys = [[node.key() for node in validator.filters] for validator in validators]
+        # プレフィックス -> そのプレフィックスを使う最後の行番号
+        self._last_use: Dict[tuple, int] = {}
+        for i in (range(len(validators)) if indices is None else indices):
+            keys = self._keys[i]
+            for k in range(1, len(keys) + 1):
+                self._last_use[tuple(keys[:k])] = i
+        # プレフィックス -> フィルター適用後のビュー
+        self._results: Dict[tuple, MasterDataManipulator] = {}
+        self._validators = validators
+        self.evaluations = 0
+        self.requested = 0
+
+    def evaluate(self, i: int, line: Context) -> MasterDataManipulator:
+        """
+        i行目のフィルターを全て適用したビューを返す
+        評価済みのプレフィックスは再利用する
+        :param i: 行番号
+        :param line: 全行を選択したマスタを持つ、i行目を実行するためのContext
+        :return:
+        """
+        current = line.master_data
+        keys = self._keys[i]
+        for k, node in enumerate(self._validators[i].filters):
+            self.requested += 1
+            prefix = tuple(keys[:k + 1])
+            result = self._results.get(prefix)
+            if result is None:
+                c = Context(current.view(), [], line._mod_path, line.hooks, line.validator_name)
+                node.execute(c)
+                result = c.master_data
+                self.evaluations += 1
+                self._results[prefix] = result
+            current = result
+
+        for k in range(1, len(keys) + 1):
+            prefix = tuple(keys[:k])
+            if self._last_use[prefix] == i:
+                self._results.pop(prefix, None)
+        return current
+
+    def stats(self) -> Dict[str, int]:
+        return {'filter_evaluations': self.evaluations, 'saved_filter_evaluations': self.requested - self.evaluations}
+
+
+def command_version(mod_path: str = DEFAULT_MOD_PATH) -> str:
+    """
+    コマンドパッケージ内の全てのモジュールのソースから作ったハッシュを返す
+    コマンドが変更されるとキャッシュキーが変わる
+    ファイルの更新時刻とサイズが変わらなければ、前回計算したハッシュを返してソースは読み直さない
+    :param mod_path:
+    :return:
+    """
+    paths = [path for directory in import_module(mod_path).__path__
+             for path in sorted(Path(directory).glob('*.py'))]
+    stats = [path.stat() for path in paths]
+    stamp = tuple((str(path), st.st_mtime_ns, st.st_size) for path, st in zip(paths, stats))
+    cached = _command_versions.get(mod_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.name.encode())
+        h.update(path.read_bytes())
+    version = h.hexdigest()
+    _command_versions[mod_path] = (stamp, version)
+    return version
+
+
+def cache_key(name: str, lines: List[str], mod_path: str = DEFAULT_MOD_PATH) -> str:
+    """
+    バリデーター名、バリデーターファイルの内容、コマンドのハッシュから作ったキャッシュキーを返す
+    内容が同じでもバリデーター名が異なれば別のCompiledValidatorにする
+    :param name:
+    :param lines:
+    :param mod_path:
+    :return:
+    """
+    h = hashlib.sha256()
+    h.update(_CACHE_FORMAT_VERSION.encode())
+    h.update(name.encode())
+    h.update(b'\0')
+    h.update(mod_path.encode())
+    h.update(command_version(mod_path).encode())
+    for line in lines:
+        h.update(line.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def compile_lines(name: str, lines: List[str], mod_path: str = DEFAULT_MOD_PATH,
+                  hooks: Optional[List[TraceHook]] = None) -> CompiledValidator:
+    """
+    バリデーターファイルの各行を字句解析、構文解析してCompiledValidatorを作る
+    構文エラーがある場合は、全ての行のエラーをまとめたValidatorSyntaxErrorを送出する
+    :param name: バリデーター名
+    :param lines: バリデーターファイルの各行
+    :param mod_path: コマンドを読み込むモジュールパス
+    :param hooks: 各行の解析の前後で呼ぶフック
+    :return:
+    """
+    return CompiledValidator(name, lines, parse_lines(name, lines, mod_path, hooks), mod_path)
+
+
+def load_compiled(name: str, lines: List[str], mod_path: str = DEFAULT_MOD_PATH,
+                  cache_dir: Optional[Path] = None, hooks: Optional[List[TraceHook]] = None) -> CompiledValidator:
+    """
+    コンパイル済みのバリデータを返す
+    メモリ上のキャッシュ、cache_dir内のキャッシュの順に探し、無ければコンパイルしてキャッシュに保存する。
+    :param name: バリデーター名
+    :param lines: バリデーターファイルの各行
+    :param mod_path: コマンドを読み込むモジュールパス
+    :param cache_dir: ディスクキャッシュの保存先。Noneならメモリ上にだけキャッシュする
+    :param hooks: コンパイルする場合に各行の解析の前後で呼ぶフック
+    :return:
+    """
+    key = cache_key(name, lines, mod_path)
+    compiled = _memory_cache.get(key)
+    if compiled is not None:
+        return compiled
+
+    if cache_dir is not None:
+        compiled = _load_from_disk(Path(cache_dir), key)
+
+    if compiled is None:
+        debug(f'compile validator [{name}]')
+        compiled = compile_lines(name, lines, mod_path, hooks)
+        if cache_dir is not None:
+            _save_to_disk(Path(cache_dir), key, compiled)
+
+    _memory_cache[key] = compiled
+    return compiled
+
+
+def clear_memory_cache():
+    _memory_cache.clear()
+
+
+def _cache_path(cache_dir: Path, key: str) -> Path:
+    return cache_dir.joinpath(key).with_suffix('.pickle')
+
+
+def _load_from_disk(cache_dir: Path, key: str) -> Optional[CompiledValidator]:
+    path = _cache_path(cache_dir, key)
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # 壊れたキャッシュは無視してコンパイルし直す
+        warning(f'invalid validator cache. path=[{path}] error=[{e}]')
+        return None
+
+
+def _save_to_disk(cache_dir: Path, key: str, compiled: CompiledValidator):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # 同時に実行されても壊れたファイルを読まないように、一時ファイルに書いてから置き換える
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _cache_path(cache_dir, key))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
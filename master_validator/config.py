@@ -0,0 +1,64 @@
+"""
+実行全体の設定を1つにまとめて保持するモジュール
+各モジュールのset_*()はこのモジュールの設定を書き換える。
+-jやparse_parallelで起動するワーカープロセスにはcurrent()をProcessPoolExecutorのinitializerで渡し、
+spawnで起動した場合も親プロセスと同じ設定で実行する。
+"""
+from dataclasses import dataclass, field, replace
+from typing import Dict, Optional, Tuple
+
+from master_validator.snapshot_cache import SnapshotCache
+
+# RowsResult.message()に表示するエラーの行数の既定値。超えた分は総数だけを表示する
+DEFAULT_MESSAGE_ROWS = 100
+# csvファイルを並列に解析する最小サイズの既定値
+DEFAULT_PARSE_MIN_BYTES = 64 * 1024 * 1024
+# ストリーム実行するcsvファイルの最小サイズの既定値
+DEFAULT_STREAM_MIN_BYTES = 1024 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    プロセス全体の設定。変更はupdate()で新しいインスタンスに置き換える
+    """
+    # read_csvでcsvファイルをメモリマップするか
+    mmap_enabled: bool = False
+    # 解析済みのマスタのスナップショットの保存先。Noneなら使わない
+    snapshot_cache: Optional[SnapshotCache] = None
+    # 1つのcsvファイルを並列に解析するプロセス数と、並列に解析する最小のファイルサイズ
+    parse_jobs: Optional[int] = None
+    parse_min_bytes: int = DEFAULT_PARSE_MIN_BYTES
+    # マスタ名 -> 主キーのカラム名。登録されていないマスタはidを主キーにする
+    primary_keys: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    # RowsResult.message()に表示するエラーの行数。Noneなら全ての行
+    message_rows: Optional[int] = DEFAULT_MESSAGE_ROWS
+    # ストリーム実行するcsvファイルの最小サイズ。Noneならストリーム実行しない
+    stream_min_bytes: Optional[int] = DEFAULT_STREAM_MIN_BYTES
+
+
+_config = Config()
+
+
+def current() -> Config:
+    return _config
+
+
+def update(**changes):
+    """
+    指定した項目だけを変えた設定にする
+    :param changes: Configの項目名 -> 値
+    :return:
+    """
+    global _config
+    _config = replace(_config, **changes)
+
+
+def apply(config: Config):
+    """
+    設定をconfigに置き換える。ProcessPoolExecutorのinitializerに渡してワーカープロセスで呼ぶ
+    :param config: 親プロセスのcurrent()
+    :return:
+    """
+    global _config
+    _config = config
@@ -0,0 +1,120 @@
+"""
+マスターデータのカラム値を型変換した結果をキャッシュするモジュール
+"""
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DATETIME_FORMAT = '%Y-%m-%d %X'
+
+
+def _to_datetime(value: str) -> datetime:
+    return datetime.strptime(value, DATETIME_FORMAT)
+
+
+# 型名 -> 変換関数
+CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    'int': int,
+    'float': float,
+    'datetime': _to_datetime,
+}
+
+# まだ変換していないことを表す番兵
+_MISSING = object()
+
+
+class _Failure:
+    """
+    変換に失敗したことを表す値。参照されたときに同じ例外を送出する
+    """
+    __slots__ = ('error',)
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def reraise(self):
+        raise type(self.error)(*self.error.args)
+
+
+class ConversionCache:
+    """
+    マスタ毎の型変換キャッシュ
+    (カラム, 型)毎に行位置の変換結果を保持し、同じ行の同じカラムは1度しか変換しない。
+    同じ文字列は1度だけ変換し、変換結果のオブジェクトを共有する。
+    """
+
+    def __init__(self, store):
+        self._store = store
+        # (カラム, 型) -> 行位置毎の変換結果
+        self._values: Dict[Tuple[str, str], List[Any]] = {}
+        # (カラム, 型) -> 文字列 -> 変換結果
+        self._memo: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+        # キャッシュから返した回数
+        self.hits = 0
+        # 実際に文字列を変換した回数
+        self.misses = 0
+
+    def get(self, column: str, kind: str, pos: int):
+        """
+        pos行目のcolumnカラムの値をkind型に変換して返す
+        :param column: カラム名
+        :param kind: CONVERTERSに登録された型名
+        :param pos: ColumnStore内の行位置
+        :return:
+        """
+        key = (column, kind)
+        values = self._values.get(key)
+        if values is None:
+            values = [_MISSING] * len(self._store)
+            self._values[key] = values
+            self._memo[key] = {}
+        elif len(values) < len(self._store):
+            # キャッシュ作成後に追加された行の分を広げる
+            values.extend([_MISSING] * (len(self._store) - len(values)))
+
+        value = values[pos]
+        if value is _MISSING:
+            value = self._convert(key, self._store.value(pos, column))
+            values[pos] = value
+        else:
+            self.hits += 1
+
+        if isinstance(value, _Failure):
+            value.reraise()
+        return value
+
+    def convert_all(self, column: str, kind: str) -> Optional[List[Any]]:
+        """
+        全ての行のcolumnカラムの値をkind型に変換したリストを返す
+        1行でも変換できない値がある場合はNoneを返す
+        :param column:
+        :param kind:
+        :return:
+        """
+        # 行単位で値を取り出すストアでも、カラム全体を1度にまとめて取り出させる
+        self._store.column(column)
+        get = self.get
+        try:
+            return [get(column, kind, pos) for pos in range(len(self._store))]
+        except (ValueError, TypeError):
+            return None
+
+    def _convert(self, key: Tuple[str, str], raw: str):
+        memo = self._memo[key]
+        try:
+            value = memo[raw]
+            self.hits += 1
+            return value
+        except KeyError:
+            pass
+
+        self.misses += 1
+        try:
+            value = CONVERTERS[key[1]](raw)
+        except (ValueError, TypeError) as e:
+            value = _Failure(e)
+        memo[raw] = value
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
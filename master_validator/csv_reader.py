@@ -2,10 +2,72 @@
 csvファイルからマスターデータを読み込むためのモジュール
 """
 import csv
-from logging import error
+from logging import error, warning
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
+from master_validator import config
+from master_validator.column_store import DEFAULT_KEY_COLUMNS, ColumnStore
+from master_validator.mapped_csv import MappedStore
 from master_validator.master_data import MasterDataManipulator
+from master_validator.parallel_csv import parse_parallel
+from master_validator.snapshot_cache import SnapshotCache
+
+
+def is_mmap_enabled() -> bool:
+    return config.current().mmap_enabled
+
+
+def set_mmap_enabled(enabled: bool):
+    """
+    read_csvでcsvファイルをメモリマップして、参照された行だけをデコードするか切り替える
+    メモリマップ中にcsvファイルを書き換えると読み込みに失敗するので、ファイルが変わらない実行でだけ使う。
+    :param enabled:
+    :return:
+    """
+    config.update(mmap_enabled=enabled)
+
+
+def get_snapshot_cache() -> Optional[SnapshotCache]:
+    return config.current().snapshot_cache
+
+
+def set_snapshot_cache(cache: Optional[SnapshotCache]):
+    """
+    read_csvで解析済みのマスタのスナップショットを使うか切り替える
+    :param cache: スナップショットの保存先。Noneなら使わない
+    :return:
+    """
+    config.update(snapshot_cache=cache)
+
+
+def set_parse_jobs(jobs: Optional[int], min_bytes: Optional[int] = None):
+    """
+    read_csvでmin_bytes以上のcsvファイルを、チャンクに分けてjobs個のプロセスで並列に解析するか切り替える
+    :param jobs: プロセス数。Noneか1以下なら並列に解析しない
+    :param min_bytes: 省略時は変更しない。小さいファイルはプロセスの起動と結果の受け渡しの方が遅くなる
+    :return:
+    """
+    if min_bytes is None:
+        config.update(parse_jobs=jobs)
+    else:
+        config.update(parse_jobs=jobs, parse_min_bytes=min_bytes)
+
+
+def primary_key_of(master_name: str) -> Tuple[str, ...]:
+    return config.current().primary_keys.get(master_name, DEFAULT_KEY_COLUMNS)
+
+
+def set_primary_keys(primary_keys: Dict[str, Sequence[str]]):
+    """
+    read_csvで使うマスタ毎の主キーを設定する。複数のカラムを指定したマスタは複合主キーになる
+    :param primary_keys: マスタ名 -> 主キーのカラム名のリスト
+    :return:
+    """
+    for name, columns in primary_keys.items():
+        if isinstance(columns, str) or not columns:
+            raise ValueError(f'primary key must be a non-empty list of columns. master=[{name}]')
+    config.update(primary_keys={name: tuple(columns) for name, columns in primary_keys.items()})
 
 
 def read_all(csv_path):
@@ -14,7 +76,15 @@ def read_all(csv_path):
     :param csv_path:
     :return:
     """
-    result = []
+    return [read_csv(path) for path in find_csv_paths(csv_path)]
+
+
+def find_csv_paths(csv_path) -> List[Path]:
+    """
+    csv_path内のcsvファイルのパスを全て返す
+    :param csv_path:
+    :return: 実行毎に結果の順序が変わらないようにパス順にソートして返す
+    """
     try:
         # csvファイルが存在するか確認する
         Path(csv_path).glob('**/*.csv').__next__()
@@ -22,22 +92,59 @@ def read_all(csv_path):
         error('not found csv files.', exc_info=True, stack_info=True)
         raise e
 
-    for path in Path(csv_path).glob('**/*.csv'):
-        result.append(read_csv(path))
-    return result
+    return sorted(Path(csv_path).glob('**/*.csv'))
 
 
-def read_csv(path: Path):
+def read_csv(path: Path, mapped: Optional[bool] = None):
     """
     csvファイルを読み込む
-    idカラムが存在する前提
+    set_primary_keys()で設定した主キーのカラム(既定はid)が存在する前提
+    重複したpkがあった場合は警告を出す。重複の内容はduplicate_key_validationで検証できる
+    :param path:
+    :param mapped: Trueならメモリマップして遅延デコードする。Noneならset_mmap_enabled()の設定に従う
+    :return: set_snapshot_cache()で保存先が設定されている場合は、内容が同じcsvファイルのスナップショットから復元する
+    """
+    settings = config.current()
+    if mapped is None:
+        mapped = settings.mmap_enabled
+    key_columns = primary_key_of(path.stem)
+    try:
+        if mapped:
+            store = MappedStore(path, key_columns=key_columns)
+        elif settings.snapshot_cache is not None:
+            # 既定の主キーの場合は、主キーを指定しないcontent_hash()と同じキーにする
+            salt = '' if key_columns == DEFAULT_KEY_COLUMNS else ','.join(key_columns)
+            store = settings.snapshot_cache.read(path, lambda: _parse_csv(path, key_columns), salt)
+        else:
+            store = _parse_csv(path, key_columns)
+    except FileNotFoundError as e:
+        error('file not found error.', exc_info=True, stack_info=True)
+        raise e
+    # MappedStoreはpkの索引を作るまで重複が分からないので、索引を作ったときに警告する
+    if not isinstance(store, MappedStore) and store.duplicates:
+        warning(f'duplicate primary key. master=[{path.stem}] key=[{",".join(key_columns)}] '
+                f'count=[{sum(store.duplicates.values())}]')
+    return MasterDataManipulator.from_store(store, path.stem)
+
+
+def _parse_csv(path: Path, key_columns: Sequence[str] = DEFAULT_KEY_COLUMNS) -> ColumnStore:
+    settings = config.current()
+    if settings.parse_jobs is not None and settings.parse_jobs > 1 and path.stat().st_size >= settings.parse_min_bytes:
+        return parse_parallel(path, settings.parse_jobs, key_columns)
+    with open(path, newline='') as f:
+        return ColumnStore.from_dicts(csv.DictReader(f, quoting=csv.QUOTE_ALL), key_columns=key_columns)
+
+
+def iter_csv_rows(path: Path) -> Iterator[Dict]:
+    """
+    csvファイルを1行ずつ辞書にして返すジェネレータ
+    ファイル全体をメモリに読み込まない
     :param path:
     :return:
     """
     try:
         with open(path, newline='') as f:
-            reader = csv.DictReader(f, quoting=csv.QUOTE_ALL)
-            return MasterDataManipulator(reader, path.stem)
+            yield from csv.DictReader(f, quoting=csv.QUOTE_ALL)
     except FileNotFoundError as e:
         error('file not found error.', exc_info=True, stack_info=True)
         raise e
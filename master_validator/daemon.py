@@ -0,0 +1,310 @@
+"""
+マスタとコンパイル済みバリデータをメモリに保持したまま、ファイルの変更を監視して再検証するデーモンのモジュール
+csvファイル、バリデーターファイル、コマンドモジュールの更新日時とサイズをポーリングで監視し、
+変更の影響を受けるバリデータの行だけを再実行する。結果はHTTPかUnixソケットでJSONとして返す。
+"""
+import importlib
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from master_validator import compiler
+from master_validator.compiler import CompiledValidator, load_compiled
+from master_validator.csv_reader import read_csv
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult
+from master_validator.registry import MasterRegistry
+from master_validator.validator import VALIDATOR_DIR, read_validator_file, validator_file_path
+
+DEFAULT_INTERVAL = 0.5
+
+
+class ValidationDaemon:
+    """
+    監視対象のファイルの状態と、読み込み済みのマスタ、バリデータの行毎の結果を保持するクラス
+    refresh()を呼ぶ度に変更を調べて再検証する。状態の参照と更新はスレッドセーフ
+    """
+
+    def __init__(self, csv_dir_path, validator_dir=VALIDATOR_DIR, mod_path: str = compiler.DEFAULT_MOD_PATH):
+        """
+        :param csv_dir_path: マスタのcsvファイルのディレクトリ
+        :param validator_dir: バリデーターファイルのディレクトリ
+        :param mod_path: コマンドを読み込むモジュールパス
+        """
+        self._csv_dir = Path(csv_dir_path)
+        self._validator_dir = Path(validator_dir)
+        self._mod_path = mod_path
+        self._lock = threading.Lock()
+        # 監視中のファイル -> (更新日時, サイズ)
+        self._stats: Dict[Path, Tuple[int, int]] = {}
+        self._paths: Dict[str, Path] = {}
+        self._masters: Dict[str, MasterDataManipulator] = {}
+        self._compiled: Dict[str, CompiledValidator] = {}
+        # マスタ名 -> バリデータの行 -> 結果
+        self._line_results: Dict[str, Dict[str, ValidationResult]] = {}
+        # マスタ名 -> 読み込みや実行に失敗した理由
+        self._failures: Dict[str, str] = {}
+        # 読み込んだマスタは全て保持しているので、参照先は登録済みのマスタから引く
+        self.registry = MasterRegistry()
+        # refresh()で再検証した回数
+        self.generation = 0
+        self.last_refresh: Dict = {}
+
+    def _command_dirs(self) -> List[Path]:
+        return [Path(directory) for directory in importlib.import_module(self._mod_path).__path__]
+
+    def _snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        files = list(self._csv_dir.glob('**/*.csv')) + list(self._validator_dir.glob('*.txt'))
+        for directory in self._command_dirs():
+            files += directory.glob('*.py')
+
+        result = {}
+        for path in files:
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                # 保存中に消えた場合は次回のポーリングで扱う
+                continue
+            result[path] = (st.st_mtime_ns, st.st_size)
+        return result
+
+    def refresh(self) -> List[str]:
+        """
+        前回から変更されたファイルを調べ、影響を受けるマスタのバリデータを再実行する
+        :return: 再検証したマスタ名のリスト
+        """
+        with self._lock:
+            start = time.perf_counter()
+            snapshot = self._snapshot()
+            changed = {path for path in snapshot.keys() | self._stats.keys()
+                       if snapshot.get(path) != self._stats.get(path)}
+            self._stats = snapshot
+            if not changed:
+                return []
+
+            command_dirs = self._command_dirs()
+            changed_commands = [path for path in changed if path.parent in command_dirs]
+            changed_csv = {path.stem for path in changed if path.suffix == '.csv'}
+            changed_validators = {path.stem for path in changed if path.parent == self._validator_dir}
+
+            if changed_commands:
+                self._reload_commands(changed_commands)
+            for name in changed_csv:
+                self._load_master(name, snapshot)
+
+            targets = set(changed_validators) | changed_csv
+            # 変更されたマスタを参照するバリデータの行も再実行する
+            for name, compiled in self._compiled.items():
+                stale_lines = [line for line, validator in zip(compiled.lines, compiled.validators)
+                               if changed_csv.intersection(validator.references())]
+                for line in stale_lines:
+                    self._line_results.get(name, {}).pop(line, None)
+                if stale_lines:
+                    targets.add(name)
+            if changed_commands:
+                targets |= self._masters.keys()
+
+            validated = sorted(name for name in targets if name in self._masters)
+            for name in validated:
+                self._validate_master(name)
+
+            self.generation += 1
+            self.last_refresh = {'validated': validated, 'changed_files': sorted(str(path) for path in changed),
+                                 'elapsed_ms': (time.perf_counter() - start) * 1000}
+            logging.info(f'revalidated {validated} in {self.last_refresh["elapsed_ms"]:.1f} ms')
+            return validated
+
+    def _reload_commands(self, paths: List[Path]):
+        """
+        変更されたコマンドのモジュールを読み込み直す
+        コマンドが変わると全ての行の結果が変わり得るので、行毎の結果とコンパイル結果を全て破棄する
+        """
+        for path in paths:
+            mod_name = f'{self._mod_path}.{path.stem}'
+            module = sys.modules.get(mod_name)
+            if module is None:
+                continue
+            if not path.exists():
+                del sys.modules[mod_name]
+                continue
+            try:
+                importlib.reload(module)
+            except Exception as e:
+                logging.warning(f'reload command error. module=[{mod_name}] error=[{e}]')
+        importlib.invalidate_caches()
+        compiler.clear_memory_cache()
+        self._line_results.clear()
+
+    def _load_master(self, name: str, snapshot: Dict[Path, Tuple[int, int]]):
+        """
+        変更されたcsvファイルのマスタを読み込み直す。削除された場合は結果も破棄する
+        """
+        self.registry.invalidate(name)
+        self._line_results.pop(name, None)
+        self._failures.pop(name, None)
+        path = next((path for path in snapshot if path.suffix == '.csv' and path.stem == name), None)
+        if path is None:
+            for state in (self._paths, self._masters, self._compiled):
+                state.pop(name, None)
+            return
+
+        self._paths[name] = path
+        try:
+            # 保存中に書き換えられるファイルをメモリマップしないようにする
+            master_data = read_csv(path, mapped=False)
+        except Exception as e:
+            # 保存途中のファイルなどは次の変更まで結果を返さない
+            self._masters.pop(name, None)
+            self._compiled.pop(name, None)
+            self._failures[name] = repr(e)
+            logging.warning(f'load master error. master=[{name}] error=[{e}]')
+            return
+        master_data.registry = self.registry
+        self.registry.register(master_data)
+        self._masters[name] = master_data
+
+    def _validate_master(self, name: str):
+        """
+        nameマスタのバリデータのうち、結果を持っていない行だけを実行する
+        """
+        self._failures.pop(name, None)
+        if not validator_file_path(name, self._validator_dir).exists():
+            self._compiled.pop(name, None)
+            self._line_results[name] = {}
+            return
+
+        previous = self._line_results.get(name, {})
+        try:
+            compiled = load_compiled(name, read_validator_file(name, self._validator_dir), self._mod_path)
+            stale = [i for i, line in enumerate(compiled.lines) if line not in previous]
+            if stale:
+                for i, result in zip(stale, compiled.subset(stale).execute(self._masters[name])):
+                    previous[compiled.lines[i]] = result
+        except Exception as e:
+            self._compiled.pop(name, None)
+            self._line_results.pop(name, None)
+            self._failures[name] = repr(e)
+            logging.warning(f'validation error. master=[{name}] error=[{e}]')
+            return
+
+        self._compiled[name] = compiled
+        self._line_results[name] = {line: previous[line] for line in compiled.lines}
+
+    def results(self, errors_only: bool = False) -> List[ValidationResult]:
+        """
+        マスタ名順、バリデーターファイルの行順に並べた最新の結果を返す
+        """
+        with self._lock:
+            result_list = []
+            for name in sorted(self._compiled):
+                compiled = self._compiled[name]
+                result_list += [self._line_results[name][line] for line in compiled.lines]
+        return [r for r in result_list if r.is_err or not errors_only]
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                'generation': self.generation,
+                'masters': sorted(self._masters),
+                'failures': dict(self._failures),
+                'last_refresh': self.last_refresh,
+            }
+
+
+def make_handler(daemon: ValidationDaemon):
+    """
+    daemonの結果を返すHTTPのリクエストハンドラーのクラスを返す
+    GET /results[?errors_only=1] : 最新の結果
+    GET /status                   : 読み込み済みのマスタと直前の再検証の情報
+    POST /refresh                 : ポーリングを待たずに変更を調べて再検証する
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, obj, status=200):
+            body = json.dumps(obj, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/results':
+                errors_only = parse_qs(url.query).get('errors_only', ['0'])[0] not in ('0', '')
+                status = daemon.status()
+                self._send_json({'generation': status['generation'], 'failures': status['failures'],
+                                 'results': [r.to_dict() for r in daemon.results(errors_only)]})
+            elif url.path == '/status':
+                self._send_json(daemon.status())
+            else:
+                self._send_json({'error': f'not found. path=[{url.path}]'}, 404)
+
+        def do_POST(self):
+            if urlparse(self.path).path == '/refresh':
+                self._send_json({'validated': daemon.refresh()})
+            else:
+                self._send_json({'error': f'not found. path=[{self.path}]'}, 404)
+
+        def address_string(self):
+            # Unixソケットの場合はクライアントのアドレスが無い
+            return self.client_address[0] if self.client_address else 'local'
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(daemon: ValidationDaemon, host: str = '127.0.0.1', port: int = 8765,
+                  socket_path: Optional[str] = None):
+    """
+    daemonの結果を返すサーバーを作る
+    :param daemon:
+    :param host:
+    :param port:
+    :param socket_path: 指定した場合はhostとportの代わりにこのUnixソケットで待ち受ける
+    :return:
+    """
+    handler = make_handler(daemon)
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def run(csv_dir_path, host: str = '127.0.0.1', port: int = 8765, socket_path: Optional[str] = None,
+        interval: float = DEFAULT_INTERVAL):
+    """
+    デーモンを起動し、interval秒毎に変更を調べる。Ctrl+Cで終了する
+    """
+    daemon = ValidationDaemon(csv_dir_path)
+    daemon.refresh()
+    server = create_server(daemon, host, port, socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info(f'watching {csv_dir_path}. serving on {socket_path or f"http://{host}:{server.server_address[1]}"}')
+    try:
+        while True:
+            time.sleep(interval)
+            daemon.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
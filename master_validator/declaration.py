@@ -0,0 +1,109 @@
+"""
+コマンドの性質を宣言するためのデコレータを定義するモジュール
+宣言はコマンドの関数の属性として保持し、実行方法の選択に使う。
+"""
+
+
+def streamable(func):
+    """
+    コマンドがストリーム実行できることを宣言する
+    ストリーム実行できるコマンドは以下だけを使うものとする
+    * master_data.master_name
+    * master_data.all() の1回だけの反復
+    * master_data.count()
+    * master_data.remove_* による絞り込み
+    :param func: filterコマンドかvalidationコマンドの関数
+    :return:
+    """
+    func.streamable = True
+    return func
+
+
+def is_streamable(func) -> bool:
+    return getattr(func, 'streamable', False)
+
+
+def predicate(make_predicate):
+    """
+    filterコマンドが行毎の純粋な条件で表せることを宣言する
+    連続するこのようなフィルターは1つの条件に融合され、1回の走査でまとめて評価される。
+    :param make_predicate: コマンドの第2引数以降を受け取り、行を残すならTrueを返す関数を返す関数。
+        行の値と引数だけから結果が決まり、副作用が無いものとする。
+    :return:
+    """
+
+    def decorator(func):
+        func.predicate = make_predicate
+        return func
+
+    return decorator
+
+
+def get_predicate(func):
+    """
+    @predicateで宣言された条件を作る関数を返す。宣言されていない場合はNone
+    """
+    return getattr(func, 'predicate', None)
+
+
+def references(get_masters):
+    """
+    コマンドが他のマスタを参照することを宣言する
+    参照先のマスタが変わった場合もインクリメンタル実行で再実行されるようにするために使う。
+    :param get_masters: コマンドの第2引数以降を受け取り、参照するマスタ名のリストを返す関数
+    :return:
+    """
+
+    def decorator(func):
+        func.references = get_masters
+        return func
+
+    return decorator
+
+
+def get_references(func):
+    """
+    @referencesで宣言された参照先を返す関数を返す。宣言されていない場合はNone
+    """
+    return getattr(func, 'references', None)
+
+
+def aggregate(make_aggregate):
+    """
+    validationコマンドが集計で表せることを宣言する
+    同じフィルター列の後にある集計のバリデーションは、1回の走査でまとめて集計される。
+    :param make_aggregate: コマンドの第2引数以降を受け取り、aggregate.Aggregateを返す関数
+    :return:
+    """
+
+    def decorator(func):
+        func.aggregate = make_aggregate
+        return func
+
+    return decorator
+
+
+def get_aggregate(func):
+    """
+    @aggregateで宣言された集計を作る関数を返す。宣言されていない場合はNone
+    """
+    return getattr(func, 'aggregate', None)
+
+
+def row_local(func):
+    """
+    validationコマンドの結果が行毎に決まることを宣言する
+    各行がエラーになるかがその行の値(と他のマスタ)だけで決まり、エラーの行を集めた結果を返すものとする。
+    このようなバリデーションはサンプリングした行で実行して、エラーの割合を推定できる。
+    :param func: validationコマンドの関数
+    :return:
+    """
+    func.row_local = True
+    return func
+
+
+def is_row_local(func) -> bool:
+    """
+    @row_localで宣言されたvalidationコマンドか、@predicateで宣言されたfilterコマンドならTrue
+    """
+    return getattr(func, 'row_local', False) or get_predicate(func) is not None
@@ -0,0 +1,191 @@
+"""
+ベースラインのマスタとの行単位の差分を求め、変更された行だけを検証するためのモジュール
+行毎に全カラムの値のハッシュを作り、pkで突き合わせて追加、変更、削除された行を求める。
+結果が行毎に決まるバリデータは変更された行だけで、それ以外はマスタ全体で実行し、
+同じバリデータをベースラインでも実行して、エラーが新しいものか以前からあったものかを記録する。
+他のマスタを参照するバリデータは、参照先が変わると変更されていない行の結果も変わるのでマスタ全体で実行し、
+ベースラインではベースラインの参照先のマスタを参照する。
+"""
+import logging
+import sys
+from pathlib import Path
+from typing import AbstractSet, Dict, Hashable, List, NamedTuple, Optional
+
+from master_validator.column_store import ColumnStore
+from master_validator.compiler import CompiledValidator
+from master_validator.csv_reader import find_csv_paths, read_csv
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import ValidationResult
+from master_validator.registry import MasterRegistry
+from master_validator.snapshot_cache import SUFFIX, SnapshotCache
+
+
+class RowDiff(NamedTuple):
+    """
+    ベースラインとの行の差分。それぞれpkのリスト
+    """
+    added: List[Hashable]
+    changed: List[Hashable]
+    removed: List[Hashable]
+
+
+def row_hashes(store: ColumnStore, int_columns: AbstractSet[str] = frozenset()) -> Dict[Hashable, int]:
+    """
+    行毎の全カラムの値のハッシュを返す
+    同じpkの行のハッシュを同じプロセスの中で比べるだけなので、値のタプルの組み込みのhash()を使う
+    :param store: ColumnStoreかMappedStore
+    :param int_columns: 整数の配列のまま比べるカラム。比べる両方のストアで整数の配列になっているものを指定する
+    :return: pk -> ハッシュ
+    """
+    n = len(store)
+    values = []
+    for name in store.header:
+        column = store.column(name)
+        values.append(column.ints if name in int_columns else [column[pos] for pos in range(n)])
+    return dict(zip(map(store.pk_at, range(n)), map(hash, zip(*values))))
+
+
+def diff_rows(baseline: ColumnStore, store: ColumnStore) -> RowDiff:
+    """
+    baselineからstoreへの行の差分を求める
+    ヘッダーか主キーのカラムが異なる場合は、全ての行が削除されて追加されたものとみなす
+    :param baseline: ベースラインのマスタ
+    :param store: 現在のマスタ
+    :return:
+    """
+    if baseline.header != store.header or baseline.key_columns != store.key_columns:
+        return RowDiff([store.pk_at(pos) for pos in range(len(store))], [],
+                       [baseline.pk_at(pos) for pos in range(len(baseline))])
+    int_columns = {name for name in store.header if store.column(name).is_int and baseline.column(name).is_int}
+    before = row_hashes(baseline, int_columns)
+    after = row_hashes(store, int_columns)
+    added, changed = [], []
+    for pk, digest in after.items():
+        old = before.get(pk)
+        if old is None:
+            added.append(pk)
+        elif old != digest:
+            changed.append(pk)
+    removed = [pk for pk in before if pk not in after]
+    return RowDiff(added, changed, removed)
+
+
+def _baseline_cache(baseline_dir) -> SnapshotCache:
+    # ベースラインは追い出さない
+    return SnapshotCache(baseline_dir, max_bytes=sys.maxsize)
+
+
+def load_baseline(baseline_dir, master_name: str) -> Optional[ColumnStore]:
+    """
+    baseline_dirからmaster_nameマスタのベースラインを読み込む
+    save_baseline()で保存したスナップショット(<マスタ名>.snapshot)があればそれを、無ければ同じ名前のcsvファイルを読み込む
+    :param baseline_dir: スナップショットかcsvファイルを置いたディレクトリ
+    :param master_name:
+    :return: どちらも無い場合はNone
+    """
+    baseline_dir = Path(baseline_dir)
+    if baseline_dir.joinpath(master_name + SUFFIX).exists():
+        store = _baseline_cache(baseline_dir).load(master_name)
+        if store is not None:
+            return store
+    for path in baseline_dir.glob(f'**/{master_name}.csv'):
+        return read_csv(path, mapped=False)._store
+    return None
+
+
+def save_baseline(csv_dir_path, baseline_dir):
+    """
+    csv_dir_pathにある全てのマスタを、次回の差分の実行のベースラインとしてbaseline_dirに保存する
+    :param csv_dir_path:
+    :param baseline_dir:
+    :return:
+    """
+    cache = _baseline_cache(baseline_dir)
+    for path in find_csv_paths(csv_dir_path):
+        cache.save(path.stem, read_csv(path, mapped=False)._store)
+
+
+class _BaselineRegistry(MasterRegistry):
+    """
+    ベースラインのマスタを参照するMasterRegistry。ベースラインに無いマスタは現在のマスタを参照する
+    """
+
+    def __init__(self, baseline_dir, current: MasterRegistry):
+        super().__init__()
+        self._baseline_dir = baseline_dir
+        self._current = current
+
+    def _store(self, name: str) -> ColumnStore:
+        store = self._loaded.get(name)
+        if store is None:
+            store = self._registered.get(name)
+        if store is not None:
+            return store
+        store = load_baseline(self._baseline_dir, name)
+        if store is None:
+            return self._current._store(name)
+        self._loaded[name] = store
+        return store
+
+
+def execute_diff(compiled: CompiledValidator, path: Path, master_name: str, hooks, registry, on_result,
+                 baseline_dir) -> List[ValidationResult]:
+    """
+    コンパイル済みのバリデータを、ベースラインとの差分について実行する
+    結果が行毎に決まり、他のマスタを参照しないバリデータは追加と変更された行だけで、それ以外はマスタ全体で実行する。
+    ベースラインでも同じ範囲で実行し、各結果にmark_diff()で以前からのエラーを記録する。
+    マスタ全体で実行した行は、エラーになった場合だけベースラインでも実行する。
+    ベースラインのバリデータはベースラインの他のマスタを参照し、ベースラインに無いマスタは現在のものを参照する。
+    ベースラインに無いマスタは全ての行が追加されたものとして扱う
+    :param compiled:
+    :param path: マスタのcsvファイルのパス
+    :param master_name:
+    :param hooks: 各ノードの実行の前後で呼ぶフック
+    :param registry: 他のマスタを参照するためのMasterRegistry
+    :param on_result: 各行の結果が出る度に呼ぶ関数。結果は行の順に渡す
+    :param baseline_dir: load_baseline()で読み込むディレクトリ
+    :return:
+    """
+    master_data = read_csv(path, mapped=False)
+    master_data.registry = registry
+    registry.register(master_data)
+    baseline_store = load_baseline(baseline_dir, master_name)
+    if baseline_store is None:
+        logging.info(f'baseline not found. master=[{master_name}]')
+        baseline_store = ColumnStore(master_data._store.header, master_data._store.key_columns)
+    baseline = MasterDataManipulator.from_store(baseline_store, master_name)
+    baseline.registry = _BaselineRegistry(baseline_dir, registry)
+    baseline.registry.register(baseline)
+
+    diff = diff_rows(baseline_store, master_data._store)
+    logging.debug(f'row diff {master_name} added={len(diff.added)} changed={len(diff.changed)} '
+                  f'removed={len(diff.removed)}')
+    changed = master_data.view()
+    changed.keep_pks(diff.added + diff.changed)
+    baseline_changed = baseline.view()
+    baseline_changed.keep_pks(diff.changed + diff.removed)
+
+    # 参照先のマスタが変わると変更されていない行の結果も変わるので、他のマスタを参照する行はマスタ全体で実行する
+    row_local = [i for i, validator in enumerate(compiled.validators)
+                 if validator.is_row_local() and not validator.references()]
+    others = sorted(set(range(len(compiled.validators))) - set(row_local))
+    results: Dict[int, ValidationResult] = {}
+    if row_local:
+        subset = compiled.subset(row_local)
+        for i, result, baseline_result in zip(row_local, subset.execute(changed, hooks),
+                                              subset.execute(baseline_changed, hooks)):
+            result.mark_diff(baseline_result, changed.count(), master_data.count())
+            results[i] = result
+    if others:
+        results.update(zip(others, compiled.subset(others).execute(master_data, hooks)))
+        # マスタ全体で実行した行は、エラーだった行だけをベースラインでも実行して以前からのエラーか調べる
+        errors = [i for i in others if results[i].is_err]
+        if errors:
+            for i, baseline_result in zip(errors, compiled.subset(errors).execute(baseline, hooks)):
+                results[i].mark_diff(baseline_result)
+
+    result_list = [results[i] for i in range(len(compiled.validators))]
+    if on_result is not None:
+        for result in result_list:
+            on_result(result)
+    return result_list
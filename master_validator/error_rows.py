@@ -0,0 +1,144 @@
+"""
+バリデーションでエラーになった行をコンパクトに保持するモジュール
+エラーの行のpkをarrayに、値をカラム毎のタプルにコピーし、マスタのストアへの参照は持たない。
+結果を最後まで保持してもマスタ全体がメモリに残らないようにし、MasterRowは参照されたときに生成する。
+"""
+from abc import ABCMeta, abstractmethod
+from array import array
+from typing import Hashable, Iterable, Iterator, List, Optional, Sequence
+
+from master_validator.master_data import MasterRow
+
+
+class ErrorRows(metaclass=ABCMeta):
+    """
+    エラーの行の列の基底クラス
+    """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> List[MasterRow]:
+        """
+        start番目からstop番目の前までの行を生成して返す
+        """
+        pass
+
+    @abstractmethod
+    def pks(self) -> Iterator[Hashable]:
+        """
+        全ての行のpkを順に返す。行は生成しない
+        """
+        pass
+
+    @abstractmethod
+    def head(self, size: int) -> 'ErrorRows':
+        """
+        先頭のsize行だけを持つErrorRowsを返す
+        """
+        pass
+
+
+def _pk_array(pks: List[Hashable]) -> Sequence[Hashable]:
+    # 整数のpkはarray('q')で持ち、複合主キー(タプル)や64ビットに収まらないpkはリストのまま持つ
+    try:
+        return array('q', pks)
+    except (TypeError, OverflowError):
+        return pks
+
+
+class TableRows(ErrorRows):
+    """
+    ヘッダーとカラム毎の値のタプル、pkの列で保持するエラーの行
+    """
+    __slots__ = ('header', 'columns', '_pks')
+
+    def __init__(self, header: Sequence[str], columns: Sequence[tuple], pks: Sequence[Hashable]):
+        self.header = list(header)
+        self.columns = list(columns)
+        self._pks = pks
+
+    def __len__(self):
+        return len(self._pks)
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> List[MasterRow]:
+        header = self.header
+        columns = [column[start:stop] for column in self.columns]
+        return [MasterRow(dict(zip(header, values)), None, -1, pk)
+                for values, pk in zip(zip(*columns), self._pks[start:stop])]
+
+    def pks(self) -> Iterator[Hashable]:
+        return iter(self._pks)
+
+    def head(self, size: int) -> 'TableRows':
+        return TableRows(self.header, [column[:size] for column in self.columns], self._pks[:size])
+
+    def __reduce__(self):
+        return TableRows, (self.header, self.columns, self._pks)
+
+
+class ListRows(ErrorRows):
+    """
+    ストアを持たないMasterRowのリストで保持するエラーの行。カラムの異なる行が混ざっている場合に使う
+    """
+    __slots__ = ('_rows',)
+
+    def __init__(self, rows: List[MasterRow]):
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> List[MasterRow]:
+        return self._rows[start:stop]
+
+    def pks(self) -> Iterator[Hashable]:
+        return (row.get_pk() for row in self._rows)
+
+    def head(self, size: int) -> 'ListRows':
+        return ListRows(self._rows[:size])
+
+    def __reduce__(self):
+        return ListRows, (self._rows,)
+
+
+def _column_of(rows: List[MasterRow], name: str) -> tuple:
+    return tuple(row._store.value(row._pos, name) if row._store is not None else row.row[name] for row in rows)
+
+
+def _detach(row: MasterRow) -> MasterRow:
+    # pickleする場合と同じく、値を辞書にコピーしてストアへの参照を外す
+    if row._store is None:
+        return row
+    return MasterRow(dict(row.row), None, -1, row.get_pk())
+
+
+def compact(rows: Iterable[MasterRow]) -> ErrorRows:
+    """
+    MasterRowの列を、ストアへの参照を持たないコンパクトなErrorRowsにする
+    全ての行のカラムが同じならカラム毎の値とpkの列に、異なる場合はストアを外したMasterRowのリストにする
+    :param rows:
+    :return:
+    """
+    rows = list(rows)
+    if not rows:
+        return TableRows((), [], array('q'))
+    # id(ストア) -> ヘッダー。同じストアの行のヘッダーを行毎に作らないようにする
+    headers = {}
+
+    def header_of(row: MasterRow) -> tuple:
+        if row._store is None:
+            return tuple(row.row)
+        header = headers.get(id(row._store))
+        if header is None:
+            header = headers[id(row._store)] = tuple(row._store.header)
+        return header
+
+    header = header_of(rows[0])
+    if all(header_of(row) == header for row in rows):
+        # メッセージと出力には全てのカラムを表示するので、全てのカラムの値をカラム毎にコピーする
+        return TableRows(header, [_column_of(rows, name) for name in header],
+                         _pk_array([row.get_pk() for row in rows]))
+    return ListRows([_detach(row) for row in rows])
@@ -0,0 +1,182 @@
+"""
+前回の実行から入力が変わった(マスタ, バリデータの行)の組だけを再実行するためのモジュール
+csvファイル、バリデーターファイル、コマンドモジュールの内容のハッシュをマニフェストに保存し、
+入力が変わっていない組は前回の結果を再利用する。
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from master_validator.compiler import load_compiled
+from master_validator.csv_reader import find_csv_paths, primary_key_of
+from master_validator.parser import ValidationResult
+from master_validator.registry import MasterRegistry
+from master_validator.result_sink import FailFast, ResultCollector
+from master_validator.validator import execute_compiled, read_validator_file, validator_file_path
+
+MANIFEST_FILE = 'manifest.json'
+RESULTS_FILE = 'results.pickle'
+
+# マニフェストの形式を変更した場合はこの値を変える
+_MANIFEST_VERSION = 1
+
+
+def file_hash(path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class IncrementalState:
+    """
+    マニフェストと、入力のハッシュ -> 前回の結果 の対応を保持するクラス
+    """
+
+    def __init__(self, state_dir):
+        self._state_dir = Path(state_dir)
+        self.manifest = {'version': _MANIFEST_VERSION, 'csv': {}, 'validator': {}, 'command': {}, 'pairs': {}}
+        self.results: Dict[str, ValidationResult] = {}
+
+    @classmethod
+    def load(cls, state_dir) -> 'IncrementalState':
+        """
+        state_dirから前回の状態を読み込む。無い場合や壊れている場合は空の状態を返す
+        """
+        state = cls(state_dir)
+        try:
+            with open(state._state_dir.joinpath(MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+            with open(state._state_dir.joinpath(RESULTS_FILE), 'rb') as f:
+                results = pickle.load(f)
+        except FileNotFoundError:
+            return state
+        except Exception as e:
+            logging.warning(f'invalid incremental state. dir=[{state._state_dir}] error=[{e}]')
+            return state
+
+        if manifest.get('version') == _MANIFEST_VERSION:
+            state.manifest = manifest
+            state.results = results
+        return state
+
+    def save(self):
+        self._state_dir.mkdir(parents=True, exist_ok=True)
+        _write_atomic(self._state_dir.joinpath(RESULTS_FILE),
+                      pickle.dumps(self.results, protocol=pickle.HIGHEST_PROTOCOL))
+        _write_atomic(self._state_dir.joinpath(MANIFEST_FILE),
+                      json.dumps(self.manifest, ensure_ascii=False, indent=2).encode())
+
+
+def _write_atomic(path: Path, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _command_hashes(commands, hashes: Dict[str, str]) -> List[str]:
+    """
+    コマンドの関数が定義されたモジュールのハッシュを返す
+    :param commands: コマンドの関数のリスト
+    :param hashes: モジュール名 -> ハッシュ。計算済みのものは再利用し、新たに計算したものを追加する
+    :return:
+    """
+    result = []
+    for command in commands:
+        mod_name = command.__module__
+        if mod_name not in hashes:
+            hashes[mod_name] = file_hash(sys.modules[mod_name].__file__)
+        result.append(hashes[mod_name])
+    return result
+
+
+def _reference_hashes(validator, csv_hashes: Dict[str, str]) -> List[str]:
+    """
+    バリデータが参照する他のマスタのcsvファイルのハッシュを返す
+    :param validator:
+    :param csv_hashes: マスタ名 -> csvファイルのハッシュ
+    :return: 存在しないマスタは空文字にする
+    """
+    return [csv_hashes.get(name, '') for name in validator.references()]
+
+
+def _pair_key(csv_hash: str, primary_key: str, line: str, command_hashes: List[str],
+              reference_hashes: List[str] = ()) -> str:
+    h = hashlib.sha256()
+    # 主キーが変わると重複の検出や行の上書きが変わるので、設定した主キーもキーに含める
+    for part in [csv_hash, primary_key, line, *command_hashes, *reference_hashes]:
+        h.update(part.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def validate_incremental(csv_dir_path, state_dir, cache_dir=None,
+                         collector: Optional[ResultCollector] = None) -> List[ValidationResult]:
+    """
+    validate_allと同じ結果を、入力が変わった(マスタ, バリデータの行)の組だけを実行して返す
+    :param csv_dir_path:
+    :param state_dir: マニフェストと前回の結果を保存するディレクトリ
+    :param cache_dir: コンパイル済みバリデータのディスクキャッシュの保存先
+    :param collector: 結果をマスタ毎に渡すResultCollector。fail_afterに達した場合は残りのマスタを実行しない
+    :return:
+    """
+    previous = IncrementalState.load(state_dir)
+    current = IncrementalState(state_dir)
+    command_hashes: Dict[str, str] = {}
+    executed = reused = 0
+    registry = MasterRegistry(csv_dir_path)
+
+    paths = find_csv_paths(csv_dir_path)
+    # 参照先のマスタが変わった場合も再実行するため、先に全てのcsvファイルのハッシュを求める
+    csv_hashes = {path.stem: file_hash(path) for path in paths}
+
+    result_list: List[ValidationResult] = []
+    try:
+        for path in paths:
+            master_name = path.stem
+            csv_hash = csv_hashes[master_name]
+            current.manifest['csv'][str(path)] = csv_hash
+            current.manifest['validator'][master_name] = file_hash(validator_file_path(master_name))
+
+            compiled = load_compiled(master_name, read_validator_file(master_name), cache_dir=cache_dir)
+            primary_key = ','.join(primary_key_of(master_name))
+            keys = [_pair_key(csv_hash, primary_key, line, _command_hashes(validator.commands(), command_hashes),
+                              _reference_hashes(validator, csv_hashes))
+                    for line, validator in zip(compiled.lines, compiled.validators)]
+            current.manifest['pairs'][master_name] = keys
+
+            stale = [i for i, key in enumerate(keys) if key not in previous.results]
+            if stale:
+                results = execute_compiled(compiled.subset(stale), path, master_name, registry=registry)
+                for i, result in zip(stale, results):
+                    previous.results[keys[i]] = result
+            executed += len(stale)
+            reused += len(keys) - len(stale)
+
+            for key in keys:
+                current.results[key] = previous.results[key]
+                result_list.append(current.results[key])
+                if collector is not None:
+                    # 保存する結果のエラーの行が減らないように複製を渡す
+                    collector.add(copy.copy(current.results[key]))
+    except FailFast as e:
+        logging.debug(str(e))
+
+    current.manifest['command'] = command_hashes
+    # 今回の入力に対応しない古い結果は保存しない
+    current.save()
+    logging.info(f'incremental validation. executed={executed} reused={reused}')
+    return result_list
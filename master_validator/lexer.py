@@ -1,39 +1,125 @@
-from shlex import shlex
+import re
+from typing import List, NamedTuple
 
-from typing import List
+# 空白、コメント、識別子や値、引用符で囲んだ値、記号を1つの正規表現で切り出す
+# どれにも当てはまらない文字の並びと閉じていない引用符は無効なトークンにする
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<word>[\w.\-]+)
+  | (?P<quoted>"[^"\n]*"|'[^'\n]*')
+  | (?P<symbol>[(),>])
+  | (?P<unterminated>["'][^\n]*)
+  | (?P<invalid>[^\s\w.\-"'\#(),>]+)
+""", re.VERBOSE)
+
+# 無効なトークンの種類
+INVALID_KINDS = ('unterminated', 'invalid')
+
+
+class Token(NamedTuple):
+    """
+    字句解析したトークン
+    kindはword(識別子や値。引用符で囲んだ値も含む)、symbol、unterminated、invalidのいずれか
+    """
+    kind: str
+    value: str
+    # 1始まりの行番号と列番号
+    line: int
+    column: int
+
+
+class SyntaxErrorInfo(NamedTuple):
+    """
+    バリデーターファイルの構文エラー1つ分
+    """
+    line: int
+    column: int
+    message: str
+
+    def __str__(self):
+        return f'{self.line}:{self.column}: {self.message}'
+
+
+class ValidatorSyntaxError(ValueError):
+    """
+    バリデーターファイルの構文エラーを全てまとめて表す例外
+    """
+
+    def __init__(self, name: str, errors: List[SyntaxErrorInfo]):
+        super().__init__(name, errors)
+        self.name = name
+        self.errors = errors
+
+    def __str__(self):
+        return '\n'.join([f'syntax error in validator [{self.name}]. {len(self.errors)} errors.'] +
+                         [f'{self.name}:{e}' for e in self.errors])
+
+
+def tokenize(text: str) -> List[Token]:
+    """
+    textを1回の走査でトークンに分割する。複数行でもよい
+    空白とコメントは含めない。無効なトークンも例外にせず、kindで区別して返す
+    """
+    tokens = []
+    line = 1
+    line_start = 0
+    for m in _TOKEN_PATTERN.finditer(text):
+        kind = m.lastgroup
+        if kind == 'space':
+            newlines = m.group().count('\n')
+            if newlines:
+                line += newlines
+                line_start = m.start() + m.group().rindex('\n') + 1
+            continue
+        if kind == 'comment':
+            continue
+        value = m.group()
+        if kind == 'quoted':
+            kind, value = 'word', value[1:-1]
+        tokens.append(Token(kind, value, line, m.start() - line_start + 1))
+    return tokens
 
 
 def lexer(cmd: str) -> List[str]:
     """
     cmdを有効なトークンに分割する
     """
-    result = analyze(cmd)
-    if invalid_tokens(result):
-        raise ValueError('ERROR: invalid tokens.')
-        pass
-    return result
+    tokens = _tokenize_line(cmd)
+    invalid = invalid_tokens(tokens)
+    if invalid:
+        raise ValidatorSyntaxError(cmd.strip(), [token_error(token) for token in invalid])
+    return [token.value for token in tokens]
 
 
 def analyze(cmd: str) -> List[str]:
     """
     cmdを字句解析する
     """
+    tokens = _tokenize_line(cmd)
+    if any(token.kind == 'unterminated' for token in tokens):
+        raise ValueError('ERROR: no closing quotation.')
+    return [token.value for token in tokens]
+
+
+def _tokenize_line(cmd: str) -> List[Token]:
     if cmd.isspace() or not cmd:
         raise ValueError('ERROR: cmd is empty.')
-
-    sh_lexer = shlex(cmd, posix=True, punctuation_chars=False)
-    sh_lexer.wordchars += '.'
-    result = []
-    while (token := sh_lexer.get_token()) != sh_lexer.eof:
-        result.append(token)
-    return result
+    return tokenize(cmd)
 
 
-def invalid_tokens(tokens: List[str]) -> List[str]:
+def invalid_tokens(tokens: List[Token]) -> List[Token]:
     """
-    TODO: 有効なトークンか確認する
     無効なトークンのリストを返す
+    許可されている記号は ()>, だけで、識別子と値は英数字、_、.、- か引用符で囲んだ値だけにする
+    """
+    return [token for token in tokens if token.kind in INVALID_KINDS]
+
+
+def token_error(token: Token) -> SyntaxErrorInfo:
+    """
+    無効なトークンの構文エラーを返す
     """
-    # 記号のチェック 許可されている記号 ()>.,
-    # 識別子を正規表現でチェック
-    return []
+    if token.kind == 'unterminated':
+        return SyntaxErrorInfo(token.line, token.column, f'no closing quotation. token=<{token.value}>')
+    return SyntaxErrorInfo(token.line, token.column, f'invalid token. token=<{token.value}>')
@@ -1,16 +1,122 @@
+import argparse
+import json
 import logging
 import os
 import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from master_validator.validator import validate_all
+from master_validator import csv_reader, daemon
+from master_validator.diff import save_baseline
+from master_validator.incremental import validate_incremental
+from master_validator.parser import DEFAULT_MESSAGE_ROWS, set_message_rows
+from master_validator.result_sink import JsonLinesSink, LoggingSink, ResultCollector
+from master_validator.snapshot_cache import DEFAULT_MAX_BYTES, SnapshotCache
+from master_validator.tracing import TraceRecorder
+from master_validator.validator import DEFAULT_STREAM_MIN_BYTES, set_stream_min_bytes, validate_all
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='master data validator')
+    parser.add_argument('--cache-dir', default=None,
+                        help='コンパイル済みバリデータをキャッシュするディレクトリ')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='マスタ毎に並列で実行するプロセス数')
+    parser.add_argument('--incremental', default=None, metavar='STATE_DIR',
+                        help='前回から入力が変わったバリデータだけを実行する。状態はSTATE_DIRに保存する')
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help='各コマンドの実行時間をChrome trace形式のJSONでFILEに出力し、遅いコマンドを表示する')
+    parser.add_argument('--output', default=None, metavar='FILE',
+                        help='結果を出る度にJSON Lines形式でFILEに書き出す。-なら標準出力')
+    parser.add_argument('--errors-only', action='store_true',
+                        help='--outputにエラーの結果だけを書き出す')
+    parser.add_argument('--max-error-rows', type=int, default=None, metavar='N',
+                        help='1つのバリデーションで保持・表示するエラーの行をN件までにする。総数は表示する')
+    parser.add_argument('--message-rows', type=int, default=DEFAULT_MESSAGE_ROWS, metavar='N',
+                        help='1つのバリデーションのメッセージに表示するエラーの行をN件までにする。総数は表示する')
+    parser.add_argument('--fail-fast', type=int, nargs='?', const=1, default=None, metavar='N',
+                        help='エラーがN件(省略時は1件)になったら実行を打ち切る')
+    parser.add_argument('--mmap', action='store_true',
+                        help='csvファイルをメモリマップし、参照された行だけをデコードする')
+    parser.add_argument('--snapshot-dir', default=None, metavar='DIR',
+                        help='解析済みのマスタをDIRに保存し、内容が変わっていないcsvファイルは解析せずに読み込む')
+    parser.add_argument('--snapshot-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), metavar='MB',
+                        help='--snapshot-dirの合計サイズの上限。超えた分は最後に使われたのが古いものから削除する')
+    parser.add_argument('--parse-jobs', type=int, default=None, metavar='N',
+                        help='大きなcsvファイルをチャンクに分け、N個のプロセスで並列に解析する')
+    parser.add_argument('--parse-min-mb', type=int, default=64, metavar='MB',
+                        help='--parse-jobsで並列に解析する最小のファイルサイズ')
+    parser.add_argument('--stream-min-mb', type=int, default=DEFAULT_STREAM_MIN_BYTES // (1024 * 1024), metavar='MB',
+                        help='全てのコマンドがストリーム実行できるバリデータを、MB以上のcsvファイルでだけメモリに読み込まずに実行する')
+    parser.add_argument('--primary-keys', default=None, metavar='FILE',
+                        help='マスタ名 -> 主キーのカラム名のリストを書いたJSONファイル。指定しないマスタはidを主キーにする')
+    parser.add_argument('--sample', type=int, default=None, metavar='N',
+                        help='近似の結果を速く求める。行毎のバリデーションはN行のサンプルで、種類数や分位数はスケッチで求める')
+    parser.add_argument('--sample-seed', default=None, metavar='SEED',
+                        help='--sampleで行を選ぶ乱数のシード')
+    parser.add_argument('--baseline', default=None, metavar='DIR',
+                        help='DIRのベースラインと行を比べ、行毎のバリデーションは追加と変更された行だけを検証する。'
+                             'エラーが新しいものか以前からあったものかを表示する')
+    parser.add_argument('--save-baseline', default=None, metavar='DIR',
+                        help='実行後に現在のマスタを--baselineで使うスナップショットとしてDIRに保存する')
+    parser.add_argument('--watch', action='store_true',
+                        help='マスタとバリデータをメモリに保持したまま変更を監視して再検証し、結果をHTTPで返す')
+    parser.add_argument('--port', type=int, default=8765, help='--watchで待ち受けるポート')
+    parser.add_argument('--socket', default=None, metavar='PATH',
+                        help='--watchでポートの代わりにこのUnixソケットで待ち受ける')
+    parser.add_argument('--interval', type=float, default=daemon.DEFAULT_INTERVAL,
+                        help='--watchで変更を調べる間隔(秒)')
+    args = parser.parse_args(argv)
+    if args.incremental is not None:
+        # インクリメンタル実行はマスタ毎に前回の結果を使い回すので、実行方法を変えるオプションとは組み合わせられない
+        conflicts = [option for option, value in [('--jobs', args.jobs), ('--trace', args.trace),
+                                                  ('--sample', args.sample), ('--baseline', args.baseline)]
+                     if value is not None]
+        if conflicts:
+            parser.error(f'--incremental can not be used with {", ".join(conflicts)}.')
+    if args.sample is not None and args.baseline is not None:
+        parser.error('--sample and --baseline can not be specified together.')
+    return args
+
+
+def main(argv=None):
     CSV_DIR_PATH = './../master_data'
-    result_list = validate_all(CSV_DIR_PATH)
-    [logging.info(r.message()) for r in result_list if r.is_err]
+    args = parse_args(argv)
+    csv_reader.set_mmap_enabled(args.mmap)
+    set_message_rows(args.message_rows)
+    set_stream_min_bytes(args.stream_min_mb * 1024 * 1024)
+    csv_reader.set_parse_jobs(args.parse_jobs, args.parse_min_mb * 1024 * 1024)
+    if args.primary_keys is not None:
+        with open(args.primary_keys, encoding='utf-8') as f:
+            csv_reader.set_primary_keys(json.load(f))
+    if args.snapshot_dir is not None:
+        csv_reader.set_snapshot_cache(SnapshotCache(args.snapshot_dir, args.snapshot_max_mb * 1024 * 1024))
+    if args.watch:
+        daemon.run(CSV_DIR_PATH, port=args.port, socket_path=args.socket, interval=args.interval)
+        return
+
+    recorder = TraceRecorder() if args.trace is not None else None
+    hooks = [recorder] if recorder is not None else None
+    sinks = [LoggingSink()]
+    if args.output is not None:
+        sinks.append(JsonLinesSink.open(args.output, args.errors_only))
+    collector = ResultCollector(sinks, max_error_rows=args.max_error_rows, fail_after=args.fail_fast)
+    try:
+        if args.incremental is not None:
+            validate_incremental(CSV_DIR_PATH, args.incremental, cache_dir=args.cache_dir, collector=collector)
+        else:
+            validate_all(CSV_DIR_PATH, cache_dir=args.cache_dir, jobs=args.jobs, hooks=hooks, collector=collector,
+                         sample_rows=args.sample, sample_seed=args.sample_seed, baseline_dir=args.baseline)
+    finally:
+        collector.close()
+    if collector.stopped:
+        logging.info(f'stopped after {collector.errors} errors.')
+    if args.save_baseline is not None:
+        save_baseline(CSV_DIR_PATH, args.save_baseline)
+
+    if recorder is not None:
+        recorder.write_chrome_trace(args.trace)
+        logging.info('slowest commands\n' + recorder.summary_table())
     return
 
 
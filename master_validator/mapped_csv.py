@@ -0,0 +1,270 @@
+"""
+csvファイルをメモリマップし、参照された行だけをデコードするColumnStoreを扱うモジュール
+読み込み時は行の開始位置の索引だけを作り、値の文字列やpkの索引は初めて必要になったときに作る。
+"""
+import csv
+import locale
+import mmap
+import re
+from array import array
+from logging import warning
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from master_validator import vectorized
+from master_validator.column_store import DEFAULT_KEY_COLUMNS, Column, StoreRow, normalize_key
+from master_validator.conversion_cache import ConversionCache
+
+# 1行分のバイト列。引用符で囲まれた部分は改行を含んでもよい
+_ROW_PATTERN = re.compile(rb'[^"\n]*(?:"[^"]*"[^"\n]*)*(?:\n|\Z)')
+
+
+def scan_row_offsets(buffer, start: int = 0) -> array:
+    """
+    bufferのstart以降にある行の開始位置と終了位置を返す
+    引用符で囲まれた改行は行の区切りとみなさない。空行は含めない
+    :param buffer: bytesやmmap
+    :param start:
+    :return: 開始位置と終了位置を交互に並べた配列
+    """
+    if vectorized.is_enabled() and start == 0:
+        return vectorized.row_offsets(buffer)
+
+    offsets = array('q')
+    size = len(buffer)
+    pos = start
+    for m in _ROW_PATTERN.finditer(buffer, start):
+        if m.start() != pos:
+            raise ValueError(f'unterminated quoted field. offset=[{pos}]')
+        begin, end = m.span()
+        pos = end
+        if begin == end:
+            break
+        if end - begin > 2 or buffer[begin:end].rstrip(b'\r\n'):
+            offsets.append(begin)
+            offsets.append(end)
+        if end >= size:
+            break
+    if pos < size:
+        raise ValueError(f'unterminated quoted field. offset=[{pos}]')
+    return offsets
+
+
+def _select(values: Column, rows: array) -> Column:
+    """
+    valuesのrowsの位置の値だけを順に持つColumnを返す
+    """
+    selected = Column()
+    for pos in rows:
+        selected.append(values[pos])
+    return selected
+
+
+class MappedStore:
+    """
+    メモリマップしたcsvファイルを行の開始位置の索引で参照するストア
+    ColumnStoreと同じインタフェースを持ち、MasterDataManipulatorやConversionCacheからそのまま使える。
+    同じpkの行はColumnStoreと同じく、最初の行の位置に最後の行の値を残して1行にする。
+    重複を除くと行の位置が変わるので、行数、行の位置、pkのいずれかが初めて必要になったときにpkの索引を作る。
+    """
+
+    def __init__(self, path: Path, encoding: Optional[str] = None, key_columns: Sequence[str] = DEFAULT_KEY_COLUMNS):
+        """
+        :param path: csvファイルのパス
+        :param encoding: 省略時はopen()と同じ既定のエンコーディング
+        :param key_columns: 主キーのカラム名
+        """
+        self.path = Path(path)
+        self.key_columns = tuple(key_columns)
+        self._encoding = encoding or locale.getpreferredencoding(False)
+        # mmapはファイル記述子を複製して持つので、ファイルはマップした後すぐに閉じる
+        with open(self.path, 'rb') as f:
+            size = self.path.stat().st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+        offsets = scan_row_offsets(self._mm)
+        if offsets:
+            self.header: List[str] = self._parse(offsets[0], offsets[1])
+        else:
+            self.header = []
+        missing = [column for column in self.key_columns if column not in self.header]
+        if self.header and missing:
+            self.close()
+            if self.key_columns == DEFAULT_KEY_COLUMNS:
+                raise KeyError('not exist id column error.')
+            raise KeyError(f'not exist key column error. columns=[{missing}]')
+        self._field_positions: Dict[str, int] = {name: i for i, name in enumerate(self.header)}
+        # ヘッダーを除いた各行の開始位置と終了位置
+        self._offsets = offsets[2:]
+        # csvファイルの行数と、同じpkの行がある場合の各行がcsvファイルの何行目か。重複が無ければNone
+        self._file_rows = len(self._offsets) // 2
+        self._rows: Optional[array] = None
+
+        # カラム名 -> 全行の値。カラム単位で参照されたときに作る
+        self._columns: Dict[str, Column] = {}
+        # 直前にデコードした行。同じ行の複数のカラムを続けて参照する場合に使い回す
+        self._last_pos = -1
+        self._last_fields: List[str] = []
+
+        self._pks = None
+        self._pk_index: Optional[Dict] = None
+        self._duplicates: Optional[Dict] = None
+
+        self.conversions = ConversionCache(self)
+        self.vector_cache: Dict = {}
+        self.indexes: Dict = {}
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+
+    def _parse(self, begin: int, end: int) -> List[str]:
+        return next(csv.reader([self._mm[begin:end].decode(self._encoding)]), [])
+
+    def fields(self, pos: int) -> List[str]:
+        """
+        pos行目をデコードしてフィールドのリストを返す
+        """
+        if pos != self._last_pos:
+            if not 0 <= pos < len(self):
+                raise IndexError(pos)
+            self._last_fields = self._parse(self._offsets[2 * pos], self._offsets[2 * pos + 1])
+            self._last_pos = pos
+        return self._last_fields
+
+    def __len__(self):
+        if self._pk_index is None:
+            self._build_pk_index()
+        return len(self._offsets) // 2
+
+    def has_column(self, column: str) -> bool:
+        return column in self._field_positions
+
+    def value(self, pos: int, column: str) -> Optional[str]:
+        values = self._columns.get(column)
+        if values is not None:
+            return values[pos]
+        i = self._field_positions[column]
+        fields = self.fields(pos)
+        # csv.DictReaderと同じく、足りないフィールドはNoneにする
+        return fields[i] if i < len(fields) else None
+
+    def column(self, column: str) -> Column:
+        """
+        columnカラムの全行の値を返す。初回の呼び出しで全行を1度だけ走査して作る
+        """
+        values = self._columns.get(column)
+        if values is None:
+            if self._pk_index is None:
+                self._build_pk_index()
+            i = self._field_positions[column]
+            values = Column()
+            with open(self.path, newline='', encoding=self._encoding) as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                for fields in reader:
+                    if not fields:
+                        continue
+                    values.append(fields[i] if i < len(fields) else None)
+            if len(values) != self._file_rows:
+                raise ValueError(f'csv file was changed while reading. path=[{self.path}]')
+            if self._rows is not None:
+                values = _select(values, self._rows)
+            self._columns[column] = values
+        return values
+
+    def _key_fields(self) -> List:
+        """
+        主キーのカラムの値だけを、各行の開始位置と終了位置からデコードして返す
+        :return: 主キーが1カラムなら値のリスト、複数ならカラムの順の値のタプルのリスト
+        """
+        get_key = itemgetter(*(self._field_positions[column] for column in self.key_columns))
+        try:
+            return list(map(get_key, self._reader()))
+        except IndexError:
+            # フィールドが足りない行がある場合は、csv.DictReaderと同じくNoneにする
+            width = len(self.header)
+            return [get_key(fields + [None] * (width - len(fields))) for fields in self._reader()]
+
+    def _reader(self):
+        """
+        各行の開始位置と終了位置からデコードした行をcsv.readerで読む
+        """
+        offsets = iter(self._offsets)
+        mm = self._mm
+        encoding = self._encoding
+        return csv.reader(mm[begin:end].decode(encoding) for begin, end in zip(offsets, offsets))
+
+    def _build_pk_index(self):
+        """
+        主キーのカラムだけをデコードしてpkの索引を作る
+        同じpkの行がある場合は、最初の行の位置に最後の行の開始位置と終了位置を置いた索引に作り直す
+        """
+        self._pk_index = {}
+        self._duplicates = {}
+        if not self.header:
+            self._pks = array('q')
+            return
+        keys = self._key_fields()
+        if self.key_columns == DEFAULT_KEY_COLUMNS:
+            pks = array('q', map(int, keys))
+        elif len(self.key_columns) == 1:
+            pks = [(normalize_key(key),) for key in keys]
+        else:
+            pks = [tuple(map(normalize_key, key)) for key in keys]
+        self._pk_index = dict(zip(pks, range(len(pks))))
+        if len(self._pk_index) == len(pks):
+            self._pks = pks
+            return
+
+        # 重複がある場合だけ、1行ずつ最初の行の位置を求め直す
+        self._pk_index = {}
+        rows = array('q')
+        for pos, pk in enumerate(pks):
+            i = self._pk_index.get(pk)
+            if i is None:
+                self._pk_index[pk] = len(rows)
+                rows.append(pos)
+            else:
+                self._duplicates[pk] = self._duplicates.get(pk, 0) + 1
+                rows[i] = pos
+        warning(f'duplicate primary key. master=[{self.path.stem}] key=[{",".join(self.key_columns)}] '
+                f'count=[{sum(self._duplicates.values())}]')
+        self._rows = rows
+        self._pks = array('q', (pks[pos] for pos in rows)) if isinstance(pks, array) else [pks[pos] for pos in rows]
+        offsets = array('q')
+        for pos in rows:
+            offsets.append(self._offsets[2 * pos])
+            offsets.append(self._offsets[2 * pos + 1])
+        self._offsets = offsets
+        self._last_pos = -1
+
+    @property
+    def pk_index(self) -> Dict:
+        if self._pk_index is None:
+            self._build_pk_index()
+        return self._pk_index
+
+    @property
+    def duplicates(self) -> Dict:
+        """
+        重複したpk -> 上書きされた行数。ColumnStoreと同じ形式で、pkの索引と一緒に作る
+        """
+        if self._duplicates is None:
+            self._build_pk_index()
+        return self._duplicates
+
+    def pk_at(self, pos: int):
+        if self._pks is None:
+            self._build_pk_index()
+        return self._pks[pos]
+
+    def position_of(self, pk) -> int:
+        return self.pk_index[pk]
+
+    def row(self, pos: int) -> StoreRow:
+        return StoreRow(self, pos)
+
+    def row_dict(self, pos: int) -> Dict[str, Optional[str]]:
+        return {name: self.value(pos, name) for name in self.header}
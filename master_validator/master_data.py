@@ -1,6 +1,13 @@
-from dataclasses import dataclass
+import random
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Dict, Protocol
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Protocol
+
+from master_validator import vectorized
+from master_validator.column_index import get_index
+from master_validator.column_store import DEFAULT_KEY_COLUMNS, ColumnStore, key_of
+from master_validator.conversion_cache import CONVERTERS, ConversionCache, DATETIME_FORMAT
+from master_validator.sketch import reservoir_sample
 
 
 @dataclass(frozen=True)
@@ -8,40 +15,60 @@ class MasterRow:
     """
     マスタデータの1行を表すクラス。
     カラムの値の参照を扱う。
-    idカラムは必須。
+    ColumnStoreから生成されていない場合はidカラムが必須。
+    ColumnStoreから生成された場合は、型変換にマスタ毎のConversionCacheを使う。
     """
     # INFO: マスターデータのレコードの方を変更したい場合はこの属性の型を変える。
-    row: Dict
+    # ColumnStoreから生成された場合は、値を参照したときに取り出すStoreRowになる。
+    row: Mapping
+    _store: Optional[ColumnStore] = field(default=None, compare=False, repr=False)
+    _pos: int = field(default=-1, compare=False, repr=False)
+    # pickleから復元した行のpk。複合主キーのマスタでもストア無しでget_pk()できるようにする
+    _pk: Any = field(default=None, compare=False, repr=False)
 
     def __post_init__(self):
-        if 'id' not in self.row:
+        if self._store is None and self._pk is None and 'id' not in self.row:
             raise KeyError('not exist id column error.')
 
+    def __reduce__(self):
+        # pickle時はストアへの参照を持たせず、値を辞書にして渡す
+        return MasterRow, (dict(self.row), None, -1, self.get_pk())
+
     def get_pk(self):
         """
-        INFO: 現在、主キーはidだけに対応している。
+        ColumnStoreから生成された場合はストアの主キー(複合主キーならタプル)を、それ以外はidカラムの値を返す
         :return:
         """
+        if self._store is not None:
+            return self._store.pk_at(self._pos)
+        if self._pk is not None:
+            return self._pk
         try:
             return int(self.row['id'])
         except ValueError as e:
             raise e
 
     def get_column_int(self, column: str) -> int:
+        if self._store is not None:
+            return self._store.conversions.get(column, 'int', self._pos)
         try:
             return int(self.row[column])
         except ValueError as e:
             raise e
 
     def get_column_float(self, column: str) -> float:
+        if self._store is not None:
+            return self._store.conversions.get(column, 'float', self._pos)
         try:
             return float(self.row[column])
         except ValueError as e:
             raise e
 
     def get_column_datetime(self, column: str) -> datetime:
+        if self._store is not None:
+            return self._store.conversions.get(column, 'datetime', self._pos)
         try:
-            return datetime.strptime(self.row[column], '%Y-%m-%d %X')
+            return datetime.strptime(self.row[column], DATETIME_FORMAT)
         except ValueError as e:
             raise e
 
@@ -80,6 +107,9 @@ class ValueComparisonProto(Protocol):
 
 
 class ComparisonInt:
+    # ConversionCacheの型名。型が分かる比較はベクトル化などの高速な経路で評価できる
+    kind = 'int'
+
     def __init__(self, value):
         self.value = int(value)
 
@@ -94,41 +124,345 @@ class ComparisonInt:
 
 
 class ComparisonFloat:
+    kind = 'float'
+
     def __init__(self, value):
         self.value = float(value)
 
+    def eq(self, row: MasterRow, column: str) -> bool:
+        return row.get_column_float(column) == self.value
+
+    def gt(self, row: MasterRow, column: str) -> bool:
+        return self.value > row.get_column_float(column)
+
+    def lt(self, row: MasterRow, column: str) -> bool:
+        return self.value < row.get_column_float(column)
+
+
+class ComparisonDatetime:
+    kind = 'datetime'
+
+    def __init__(self, value):
+        self.value = datetime.strptime(value, DATETIME_FORMAT)
+
+    def eq(self, row: MasterRow, column: str) -> bool:
+        return row.get_column_datetime(column) == self.value
+
+    def gt(self, row: MasterRow, column: str) -> bool:
+        return self.value > row.get_column_datetime(column)
+
+    def lt(self, row: MasterRow, column: str) -> bool:
+        return self.value < row.get_column_datetime(column)
+
+
+class ComparisonPredicate:
+    """
+    「columnカラムの値 op value」なら行を残す条件
+    フィルターの融合で使う。型の分かる比較はカラムの索引で評価できる。
+    """
+    # op -> 行を削除するメソッド名。残す条件の否定で削除する
+    _REMOVE_METHODS = {
+        'eq': 'remove_not_eq',
+        'gt': 'remove_le',
+        'lt': 'remove_ge',
+    }
+
+    def __init__(self, column: str, value: ValueComparisonProto, op: str):
+        """
+        :param column:
+        :param value:
+        :param op: 'eq', 'gt', 'lt' のいずれか
+        """
+        self.column = column
+        self.value = value
+        self.op = op
+
+    def __call__(self, row: MasterRow) -> bool:
+        # ValueComparisonProtoは「value op カラムの値」なので、gtとltを入れ替えて評価する
+        if self.op == 'eq':
+            return self.value.eq(row, self.column)
+        if self.op == 'gt':
+            return self.value.lt(row, self.column)
+        return self.value.gt(row, self.column)
+
+    def apply(self, master_data):
+        """
+        条件を満たさない行をremove_*で削除する
+        """
+        getattr(master_data, self._REMOVE_METHODS[self.op])(self.column, self.value)
+
+
+class MasterRowsView:
+    """
+    MasterDataManipulator.all()の戻り値
+    反復したときに初めてMasterRowを生成する読み取り専用のビュー
+    """
+
+    def __init__(self, master_data: 'MasterDataManipulator'):
+        self._master_data = master_data
+
+    def __iter__(self) -> Iterator[MasterRow]:
+        materialize = self._master_data._materialize
+        for pos in self._master_data._positions():
+            yield materialize(pos)
+
+    def __len__(self):
+        return self._master_data.count()
+
+    def __repr__(self):
+        return repr(list(self))
+
 
 class MasterDataManipulator:
     """
     マスタをレコード単位で操作する責務を持つ
+    レコードはColumnStoreに列単位で保持し、MasterRowは参照されたときに生成する。
+    インスタンスはColumnStore上の選択(ビュー)を表す。view()で作った別のビューは
+    同じColumnStoreを共有し、remove_*による絞り込みは互いに影響しない。
     """
 
-    def __init__(self, master_data, master_name):
+    def __init__(self, master_data, master_name, key_columns: Iterable[str] = DEFAULT_KEY_COLUMNS):
         self.master_name = master_name
 
-        self._rows: Dict[int, MasterRow] = {}
-        for row in master_data:
-            master_row = MasterRow(row)
-            self._rows[master_row.get_pk()] = master_row
+        self._store = ColumnStore.from_dicts(master_data, key_columns=tuple(key_columns))
+        # 選択中の行のビットマップ。1バイトが1行に対応する。Noneは全行選択を表す
+        self._mask: Optional[bytearray] = None
+        # _maskを他のビューと共有しているか。共有中は変更前に複製する
+        self._mask_shared = False
+        self._count = len(self._store)
+        # 他のマスタを参照するためのMasterRegistry。ビューは作成元と共有する
+        self.registry = None
+
+    @classmethod
+    def from_store(cls, store: ColumnStore, master_name: str) -> 'MasterDataManipulator':
+        """
+        読み込み済みのColumnStoreから全行を選択したインスタンスを作る
+        """
+        master_data = cls.__new__(cls)
+        master_data.master_name = master_name
+        master_data._store = store
+        master_data._mask = None
+        master_data._mask_shared = False
+        # 行数は初めて必要になったときにストアから求める。MappedStoreでは重複したpkを除いた行数を求めるのにpkの索引が要る
+        master_data._row_count = None
+        master_data.registry = None
+        return master_data
+
+    @property
+    def _count(self) -> int:
+        if self._row_count is None:
+            self._row_count = len(self._store)
+        return self._row_count
+
+    @_count.setter
+    def _count(self, count: int):
+        self._row_count = count
+
+    def view(self) -> 'MasterDataManipulator':
+        """
+        現在の選択と同じ行を持つ別のビューを返す
+        ColumnStoreもビットマップも複製しないので、作成のコストは行数に依存しない
+        :return:
+        """
+        other = self.from_store(self._store, self.master_name)
+        other.registry = self.registry
+        if self._mask is not None:
+            other._mask = self._mask
+            other._mask_shared = self._mask_shared = True
+        other._row_count = self._row_count
+        return other
+
+    def sample(self, size: int, rng: Optional[random.Random] = None) -> 'MasterDataManipulator':
+        """
+        選択中の行から無作為にsize行を選んだビューを返す。size行以下なら同じ行を持つビューを返す
+        行はリザーバーサンプリングで選ぶので、選択中の行を1度走査するだけで済む
+        :param size: 選ぶ行数
+        :param rng: 省略時はrandomモジュールの乱数
+        :return:
+        """
+        other = self.view()
+        if self._count > size:
+            other._keep_positions(sorted(reservoir_sample(self._positions(), size, rng)))
+        return other
+
+    def intersection(self, other: 'MasterDataManipulator') -> 'MasterDataManipulator':
+        """
+        selfとotherのどちらにも選択されている行を持つビューを返す
+        :param other: 同じColumnStoreから作られたビュー
+        :return:
+        """
+        if other._store is not self._store:
+            raise ValueError('views of different master data can not be composed.')
+        if other._mask is None:
+            return self.view()
+        if self._mask is None:
+            return other.view()
+
+        n = len(self._store)
+        mask = (int.from_bytes(self._mask, 'little') & int.from_bytes(other._mask, 'little')).to_bytes(n, 'little')
+        result = self.from_store(self._store, self.master_name)
+        result.registry = self.registry
+        result._mask = bytearray(mask)
+        result._count = result._mask.count(1)
+        return result
+
+    def _writable_mask(self) -> bytearray:
+        if self._mask is None:
+            self._mask = bytearray(b'\x01') * len(self._store)
+        elif self._mask_shared:
+            self._mask = bytearray(self._mask)
+            self._mask_shared = False
+        return self._mask
+
+    def _positions(self) -> Iterator[int]:
+        """
+        選択中の行位置を昇順に返す
+        """
+        mask = self._mask
+        if mask is None:
+            yield from range(len(self._store))
+            return
+        pos = mask.find(1)
+        while pos != -1:
+            yield pos
+            pos = mask.find(1, pos + 1)
+
+    def _is_selected(self, pos: int) -> bool:
+        return self._mask is None or self._mask[pos] == 1
+
+    def _materialize(self, pos: int) -> MasterRow:
+        return MasterRow(self._store.row(pos), self._store, pos)
+
+    @property
+    def conversion_cache(self) -> ConversionCache:
+        """
+        このマスタの型変換キャッシュ。hits/missesで効果を確認できる
+        """
+        return self._store.conversions
 
     def all(self):
         """
-        呼び出し元で変更出来ないようにvalues()の戻り値を返す
+        呼び出し元で変更出来ないように読み取り専用のビューを返す
         :return:
         """
-        return self._rows.values()
+        return MasterRowsView(self)
 
     def count(self):
-        return len(self._rows)
+        return self._count
+
+    def duplicate_keys(self) -> Dict:
+        """
+        読み込み時に重複していたpkのうち、選択中の行のpk -> 重複して現れた行数(最初の行を除く)を返す
+        """
+        duplicates = self._store.duplicates
+        if not duplicates:
+            return {}
+        index = self._store.pk_index
+        return {pk: count for pk, count in duplicates.items() if self._is_selected(index[pk])}
 
     def find_by_pk(self, pk):
-        return self._rows[pk]
+        pos = self._store.position_of(pk)
+        if not self._is_selected(pos):
+            raise KeyError(pk)
+        return self._materialize(pos)
 
     def remove_by_pk(self, pk):
-        try:
-            del self._rows[pk]
-        except KeyError as e:
-            raise e
+        pos = self._store.position_of(pk)
+        if not self._is_selected(pos):
+            raise KeyError(pk)
+        self._writable_mask()[pos] = 0
+        self._count -= 1
+
+    def _remove_positions(self, positions):
+        """
+        positionsの行を選択から外す。選択されていない行は無視する
+        """
+        if not len(positions):
+            return
+        mask = self._writable_mask()
+        if vectorized.is_array(positions):
+            self._count = vectorized.clear_positions(mask, positions)
+            return
+
+        removed = 0
+        for pos in positions:
+            if mask[pos]:
+                mask[pos] = 0
+                removed += 1
+        self._count -= removed
+
+    def _keep_positions(self, positions):
+        """
+        選択中の行のうちpositionsの行だけを残す
+        """
+        new_mask = bytearray(len(self._store))
+        if vectorized.is_array(positions):
+            self._count = vectorized.keep_positions(new_mask, self._mask, positions)
+        else:
+            mask = self._mask
+            count = 0
+            for pos in positions:
+                if mask is None or mask[pos]:
+                    new_mask[pos] = 1
+                    count += 1
+            self._count = count
+        self._mask = new_mask
+        self._mask_shared = False
+
+    def keep_pks(self, pks: Iterable):
+        """
+        選択中の行のうちpksの行だけを残す。存在しないpkは無視する
+        """
+        index = self._store.pk_index
+        self._keep_positions(sorted(index[pk] for pk in pks if pk in index))
+
+    def _remove_if(self, cond):
+        """
+        cond(row)が真になるレコードを削除する
+        """
+        materialize = self._materialize
+        self._remove_positions([pos for pos in self._positions() if cond(materialize(pos))])
+
+    def _remove_compare(self, column: str, value: ValueComparisonProto, op: str, cond):
+        """
+        「columnカラムの値 op value」が真になるレコードを削除する
+        valueの型が分かるときはカラムの索引を使い、全行を走査せずに対象の行を求める。
+        それ以外はcond(row)で1行ずつ比較する。
+        :param column:
+        :param value:
+        :param op: 'eq', 'ne', 'gt', 'lt', 'ge', 'le' のいずれか
+        :param cond: 1行ずつ比較する場合の条件
+        :return:
+        """
+        kind = getattr(value, 'kind', None)
+        if self._count and kind in CONVERTERS:
+            index = get_index(self._store, column, kind)
+            if index is not None:
+                positions = index.positions('eq' if op == 'ne' else op, value.value)
+                if positions is not None:
+                    if op == 'ne':
+                        self._keep_positions(positions)
+                    else:
+                        self._remove_positions(positions)
+                    return
+        self._remove_if(cond)
+
+    def keep_if(self, predicates: List[Callable[[MasterRow], bool]]):
+        """
+        全てのpredicatesを満たすレコードだけを残す
+        索引で評価できるComparisonPredicateを先に適用して行を絞り、
+        残りの条件は1回の走査でまとめて評価する。条件を満たさなかった時点で以降の条件は評価しない。
+        :param predicates: 行を残すならTrueを返す関数のリスト
+        :return:
+        """
+        rest = []
+        for predicate in predicates:
+            if isinstance(predicate, ComparisonPredicate) and getattr(predicate.value, 'kind', None) in CONVERTERS:
+                predicate.apply(self)
+            else:
+                rest.append(predicate)
+        if rest:
+            self._remove_if(lambda row: not all(predicate(row) for predicate in rest))
 
     def remove_eq(self, column: str, value: ValueComparisonProto):
         """
@@ -137,12 +471,7 @@ class MasterDataManipulator:
         :param value: 比較対象の値
         :return:
         """
-        remove_row_pks = []
-        for row in self._rows.values():
-            if value.eq(row, column):
-                remove_row_pks.append(row.get_pk())
-        for pk in remove_row_pks:
-            self.remove_by_pk(pk)
+        self._remove_compare(column, value, 'eq', lambda row: value.eq(row, column))
 
     def remove_not_eq(self, column: str, value: ValueComparisonProto):
         """
@@ -151,12 +480,7 @@ class MasterDataManipulator:
         :param value: 比較対象の値
         :return:
         """
-        remove_row_pks = []
-        for row in self._rows.values():
-            if not value.eq(row, column):
-                remove_row_pks.append(row.get_pk())
-        for pk in remove_row_pks:
-            self.remove_by_pk(pk)
+        self._remove_compare(column, value, 'ne', lambda row: not value.eq(row, column))
 
     def remove_gt(self, column: str, value: ValueComparisonProto):
         """
@@ -165,13 +489,7 @@ class MasterDataManipulator:
         :param value:
         :return:
         """
-        remove_row_pks = []
-        for row in self._rows.values():
-            if value.lt(row, column):
-                remove_row_pks.append(row.get_pk())
-
-        for pk in remove_row_pks:
-            self.remove_by_pk(pk)
+        self._remove_compare(column, value, 'gt', lambda row: value.lt(row, column))
 
     def remove_lt(self, column: str, value: ValueComparisonProto):
         """
@@ -180,13 +498,7 @@ class MasterDataManipulator:
         :param value:
         :return:
         """
-        remove_row_pks = []
-        for row in self._rows.values():
-            if value.gt(row, column):
-                remove_row_pks.append(row.get_pk())
-
-        for pk in remove_row_pks:
-            self.remove_by_pk(pk)
+        self._remove_compare(column, value, 'lt', lambda row: value.gt(row, column))
 
     def remove_ge(self, column: str, value: ValueComparisonProto):
         """
@@ -195,8 +507,7 @@ class MasterDataManipulator:
         :param value:
         :return:
         """
-        self.remove_eq(column, value)
-        self.remove_gt(column, value)
+        self._remove_compare(column, value, 'ge', lambda row: value.eq(row, column) or value.lt(row, column))
 
     def remove_le(self, column: str, value: ValueComparisonProto):
         """
@@ -205,5 +516,114 @@ class MasterDataManipulator:
         :param value:
         :return:
         """
-        self.remove_eq(column, value)
-        self.remove_lt(column, value)
+        self._remove_compare(column, value, 'le', lambda row: value.eq(row, column) or value.gt(row, column))
+
+
+class DuplicateKeyError(Exception):
+    """
+    MasterDataStreamで同じpkの行が見つかったことを表す例外
+    同じpkの行を上書きして1行にするMasterDataManipulatorと結果を揃えるには、マスタをメモリに読み込んで実行する
+    """
+
+    def __init__(self, master_name: str, pk):
+        super().__init__(master_name, pk)
+        self.master_name = master_name
+        self.pk = pk
+
+    def __str__(self):
+        return f'duplicate primary key in stream. master=[{self.master_name}] key=[{self.pk}]'
+
+
+class MasterDataStream:
+    """
+    マスタの行を1度だけ先頭から流すためのクラス
+    MasterDataManipulatorと同じ操作のうち、ストリーム実行できるコマンドが使うものだけを持つ。
+    remove_*は行を読み込まずに絞り込みの条件を積み重ね、all()で反復したときに評価する。
+    """
+
+    def __init__(self, rows: Iterable[Dict], master_name: str, key_columns: Iterable[str] = DEFAULT_KEY_COLUMNS,
+                 check_duplicates: bool = False):
+        """
+        :param rows: csv.DictReaderなどの辞書のイテラブル
+        :param master_name:
+        :param key_columns: 主キーのカラム名
+        :param check_duplicates: Trueなら流した行のpkを記録し、最初に見つかった同じpkをduplicate_pkに記録する
+        """
+        self.master_name = master_name
+        self._source = rows
+        self._key_columns = tuple(key_columns)
+        self._seen = set() if check_duplicates else None
+        self.duplicate_pk = None
+        self._keyed: Iterator[MasterRow] = self._read(rows)
+        self._rows: Iterator[MasterRow] = self._keyed
+        self._count: Optional[int] = None
+        self.registry = None
+
+    def _read(self, rows: Iterable[Dict]) -> Iterator[MasterRow]:
+        key_columns = self._key_columns
+        seen = self._seen
+        for row in rows:
+            pk = key_of(row, key_columns)
+            if seen is not None:
+                if pk in seen and self.duplicate_pk is None:
+                    self.duplicate_pk = pk
+                seen.add(pk)
+            yield MasterRow(row, None, -1, pk)
+
+    def all(self) -> Iterator[MasterRow]:
+        """
+        絞り込み後の行を返すジェネレータ。反復できるのは1度だけ
+        :return:
+        """
+        return self._rows
+
+    def count(self):
+        """
+        絞り込み後の行数を返す。初回の呼び出しで残りの行を全て読み進める
+        :return:
+        """
+        if self._count is None:
+            self._count = sum(1 for _ in self._rows)
+        return self._count
+
+    def drain(self):
+        """
+        まだ流していない行を読み進める。check_duplicatesの場合に、最後の行まで重複を調べるために使う
+        """
+        for _ in self._keyed:
+            pass
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+    def find_by_pk(self, pk):
+        raise TypeError('find_by_pk is not supported on a stream.')
+
+    def _remove_if(self, cond):
+        self._rows = (row for row in self._rows if not cond(row))
+
+    def keep_if(self, predicates: List[Callable[[MasterRow], bool]]):
+        self._remove_if(lambda row: not all(predicate(row) for predicate in predicates))
+
+    def remove_by_pk(self, pk):
+        self._remove_if(lambda row: row.get_pk() == pk)
+
+    def remove_eq(self, column: str, value: ValueComparisonProto):
+        self._remove_if(lambda row: value.eq(row, column))
+
+    def remove_not_eq(self, column: str, value: ValueComparisonProto):
+        self._remove_if(lambda row: not value.eq(row, column))
+
+    def remove_gt(self, column: str, value: ValueComparisonProto):
+        self._remove_if(lambda row: value.lt(row, column))
+
+    def remove_lt(self, column: str, value: ValueComparisonProto):
+        self._remove_if(lambda row: value.gt(row, column))
+
+    def remove_ge(self, column: str, value: ValueComparisonProto):
+        self._remove_if(lambda row: value.eq(row, column) or value.lt(row, column))
+
+    def remove_le(self, column: str, value: ValueComparisonProto):
+        self._remove_if(lambda row: value.eq(row, column) or value.gt(row, column))
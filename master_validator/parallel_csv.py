@@ -0,0 +1,117 @@
+"""
+1つの大きなcsvファイルをバイト範囲のチャンクに分け、プロセスプールで並列に解析するモジュール
+チャンクの境界は引用符の外にある改行の直後に合わせるので、引用符で囲まれた改行を含む行も分割されない。
+各チャンクの解析結果はColumnStoreのスナップショットとして受け取り、ファイルの順に結合する。
+"""
+import csv
+import io
+import locale
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from master_validator import config
+from master_validator.column_store import DEFAULT_KEY_COLUMNS, ColumnStore
+
+# 引用符を数えるときに1度に切り出す大きさ
+_BLOCK_SIZE = 1 << 20
+
+
+def _count_quotes(buffer, begin: int, end: int) -> int:
+    count = 0
+    for block in range(begin, end, _BLOCK_SIZE):
+        count += buffer[block:min(block + _BLOCK_SIZE, end)].count(b'"')
+    return count
+
+
+def chunk_ranges(buffer, chunks: int) -> Tuple[Tuple[int, int], List[Tuple[int, int]]]:
+    """
+    bufferをヘッダー行と、ほぼ同じ大きさのchunks個以下のバイト範囲に分ける
+    範囲の境界は引用符の数が偶数になる位置の改行の直後にする。
+    "を含む値は""とエスケープされるので、行頭からの引用符の数の偶奇で引用符の内外が分かる
+    :param buffer: bytesやmmap
+    :param chunks: 分割数
+    :return: (ヘッダー行の範囲, 本体の範囲のリスト)
+    """
+    size = len(buffer)
+    # 引用符を数え終わった位置と、そこまでの引用符の数
+    counted = 0
+    quotes = 0
+
+    def record_end(pos: int) -> int:
+        """
+        pos以降で最初の、引用符の外にある改行の直後の位置を返す。無ければファイルの末尾
+        """
+        nonlocal counted, quotes
+        newline = buffer.find(b'\n', max(pos, counted))
+        while newline != -1:
+            quotes += _count_quotes(buffer, counted, newline)
+            counted = newline
+            if quotes % 2 == 0:
+                return newline + 1
+            newline = buffer.find(b'\n', newline + 1)
+        return size
+
+    header_end = record_end(0)
+    step = max((size - header_end) // max(chunks, 1), 1)
+    bounds = [header_end]
+    for i in range(1, chunks):
+        target = header_end + step * i
+        if target <= bounds[-1]:
+            continue
+        end = record_end(target)
+        if end >= size:
+            break
+        bounds.append(end)
+    bounds.append(size)
+    return (0, header_end), [(begin, end) for begin, end in zip(bounds, bounds[1:]) if begin < end]
+
+
+def _parse_chunk(path: Path, begin: int, end: int, header: List[str], encoding: str,
+                 key_columns: Tuple[str, ...]):
+    """
+    プロセスプールで実行する。pathのbeginからendまでを解析し、ColumnStoreのスナップショットを返す
+    """
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        text = f.read(end - begin).decode(encoding)
+    # open(newline='')と同じく改行を変換せずにcsvモジュールに渡す
+    rows = csv.DictReader(io.StringIO(text, newline=''), fieldnames=header, quoting=csv.QUOTE_ALL)
+    return ColumnStore.from_dicts(rows, header, key_columns).to_snapshot()
+
+
+def parse_parallel(path: Path, jobs: int, key_columns: Sequence[str] = DEFAULT_KEY_COLUMNS,
+                   encoding: Optional[str] = None) -> ColumnStore:
+    """
+    pathのcsvファイルをjobs個のチャンクに分け、jobs個のプロセスで解析して1つのColumnStoreにする
+    結果はcsv.DictReaderで先頭から読み込んだ場合と同じになる。
+    チャンクをまたいで重複したpkも、ファイルの順に結合するときに上書きしてduplicatesに記録する
+    :param path: csvファイルのパス
+    :param jobs: プロセス数
+    :param key_columns: 主キーのカラム名
+    :param encoding: 省略時はopen()と同じ既定のエンコーディング
+    :return:
+    """
+    path = Path(path)
+    encoding = encoding or locale.getpreferredencoding(False)
+    key_columns = tuple(key_columns)
+    with open(path, 'rb') as f:
+        if path.stat().st_size == 0:
+            return ColumnStore([], key_columns)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            (header_begin, header_end), ranges = chunk_ranges(mm, jobs)
+            header = next(csv.reader(io.StringIO(mm[header_begin:header_end].decode(encoding), newline='')), [])
+
+    store = ColumnStore(header, key_columns)
+    args = [(path, begin, end, header, encoding, key_columns) for begin, end in ranges]
+    if len(args) <= 1:
+        for arg in args:
+            store.extend(ColumnStore.from_snapshot(_parse_chunk(*arg)))
+        return store
+    with ProcessPoolExecutor(max_workers=min(jobs, len(args)), initializer=config.apply,
+                             initargs=(config.current(),)) as executor:
+        # 結果はチャンクの順に返るので、解析の終わったものから順に結合する
+        for snapshot in executor.map(_parse_chunk, *zip(*args)):
+            store.extend(ColumnStore.from_snapshot(snapshot))
+    return store
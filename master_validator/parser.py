@@ -1,16 +1,55 @@
 from abc import ABCMeta, abstractmethod
 from importlib import import_module
 from logging import error
-from re import match
-from typing import List
-
+import re
+from typing import Dict, FrozenSet, List, Optional
+
+from master_validator import config
+from master_validator.config import DEFAULT_MESSAGE_ROWS
+from master_validator.declaration import get_aggregate, get_predicate, get_references, is_row_local
+from master_validator.error_rows import ErrorRows, compact
+from master_validator.lexer import SyntaxErrorInfo, ValidatorSyntaxError, invalid_tokens, token_error, tokenize
 from master_validator.master_data import MasterDataManipulator
+from master_validator.tracing import TraceHook, traced
+
+
+# 近似の結果の求め方。サンプリングした行での実行と、スケッチによる集計
+APPROXIMATE_SAMPLE = 'sample'
+APPROXIMATE_SKETCH = 'sketch'
+
+# コマンド名と引数の値の形式。トークン毎に使うのでコンパイルしておく
+_VALIDATION_NAME = re.compile(r'[\S|\d]+validation')
+_FILTER_NAME = re.compile(r'[\S|\d]+filter')
+_ARG_VALUE = re.compile(r'[\S|\d]+')
+
+
+def set_message_rows(rows: Optional[int]):
+    """
+    RowsResult.message()に表示するエラーの行数を設定する
+    :param rows: Noneなら全ての行を表示する
+    :return:
+    """
+    config.update(message_rows=rows)
+
+
+def _matches(pattern: re.Pattern, token: Optional[str]) -> bool:
+    return token is not None and pattern.match(token) is not None
 
 
 class ValidationResult(metaclass=ABCMeta):
     """
     バリデーションの結果を表示するための抽象基底クラス
     """
+    # 近似の結果ならその求め方(APPROXIMATE_SAMPLEかAPPROXIMATE_SKETCH)。Noneなら厳密な結果
+    # この属性を持たない古いpickleでも使えるようにクラス属性にする
+    approximation: Optional[str] = None
+    # APPROXIMATE_SAMPLEの場合の、実行した行数とマスタの行数
+    sampled_rows: Optional[int] = None
+    total_rows: Optional[int] = None
+    # 差分の実行の場合に、ベースラインでもエラーだったか。Noneなら差分の実行ではない
+    baseline_err: Optional[bool] = None
+    # 差分の実行で、追加と変更された行だけを検証した場合のその行数
+    changed_rows: Optional[int] = None
 
     def __init__(self, is_err=False, master_name='', validator_name='', err_msg=''):
         # エラーになったバリデータ名
@@ -35,7 +74,9 @@ class ValidationResult(metaclass=ABCMeta):
             f'master=<{self._master_name}> ' \
             f'validation=<{self._validator_name}> ' \
             f'error_message=<{self._err_msg}> ' \
-            f'{self.additional_msg()}'
+            f'{self.additional_msg()}' \
+            f'{self.approximate_msg()}' \
+            f'{self.diff_msg()}'
 
     @abstractmethod
     def additional_msg(self) -> str:
@@ -45,51 +86,252 @@ class ValidationResult(metaclass=ABCMeta):
     def get_error_data(self):
         raise NotImplementedError
 
+    @property
+    def is_approximate(self) -> bool:
+        return self.approximation is not None
+
+    def mark_approximate(self, approximation: str, sampled_rows: Optional[int] = None,
+                         total_rows: Optional[int] = None):
+        """
+        近似の結果であることを記録する
+        :param approximation: APPROXIMATE_SAMPLEかAPPROXIMATE_SKETCH
+        :param sampled_rows: APPROXIMATE_SAMPLEの場合に実行した行数
+        :param total_rows: APPROXIMATE_SAMPLEの場合のマスタの行数
+        :return:
+        """
+        self.approximation = approximation
+        self.sampled_rows = sampled_rows
+        self.total_rows = total_rows
+
+    def approximate_msg(self) -> str:
+        """
+        近似の結果なら、そのことを表す文字列を先頭に空白を付けて返す。厳密な結果なら空文字
+        :return:
+        """
+        if self.approximation == APPROXIMATE_SAMPLE:
+            return f' approximate=<sample {self.sampled_rows}/{self.total_rows} rows>'
+        if self.approximation is not None:
+            return f' approximate=<{self.approximation}>'
+        return ''
+
+    def mark_diff(self, baseline: 'ValidationResult', changed_rows: Optional[int] = None,
+                  total_rows: Optional[int] = None):
+        """
+        差分の実行で、同じバリデータをベースラインで実行した結果を記録する
+        :param baseline: ベースラインでの結果
+        :param changed_rows: 追加と変更された行だけを検証した場合のその行数。マスタ全体を検証した場合はNone
+        :param total_rows: マスタの行数
+        :return:
+        """
+        self.baseline_err = baseline.is_err
+        self.changed_rows = changed_rows
+        self.total_rows = total_rows
+
+    def diff_msg(self) -> str:
+        """
+        差分の実行なら、エラーが新しいものかを表す文字列を先頭に空白を付けて返す。それ以外は空文字
+        :return:
+        """
+        if self.baseline_err is None:
+            return ''
+        msg = ' diff=<existing>' if self.baseline_err else ' diff=<new>'
+        if self.changed_rows is not None:
+            msg += f' changed_rows=<{self.changed_rows}/{self.total_rows}>'
+        return msg
+
+    def truncate(self, max_rows: int):
+        """
+        保持するエラーデータをmax_rows件までに減らす。エラーの総数は保持する
+        エラーデータを持たない結果では何もしない
+        :param max_rows:
+        :return:
+        """
+        pass
+
+    def to_dict(self) -> Dict:
+        """
+        JSONに変換できる辞書にして返す
+        :return:
+        """
+        result = {
+            'master': self._master_name,
+            'validation': self._validator_name,
+            'is_err': self.is_err,
+            'error_message': self._err_msg,
+        }
+        if self.approximation is not None:
+            result['approximate'] = self.approximation
+        if self.approximation == APPROXIMATE_SAMPLE:
+            result['sampled_rows'] = self.sampled_rows
+            result['total_rows'] = self.total_rows
+        if self.baseline_err is not None:
+            result['baseline_err'] = self.baseline_err
+            if self.changed_rows is not None:
+                result['changed_rows'] = self.changed_rows
+                result['total_rows'] = self.total_rows
+        return result
+
 
 class RowsResult(ValidationResult):
     """
     バリデーションの結果をマスターデータの行について表示するためのクラス
     """
+    # truncate()する前のエラーの行数。Noneの場合はerr_rowsの件数。この属性を持たない古いpickleでも使えるようにクラス属性にする
+    _error_count: Optional[int] = None
+    # 差分の実行で、ベースラインでも同じバリデータでエラーだった行のpk
+    existing_error_pks: FrozenSet = frozenset()
+    # 差分の実行で、ベースラインではエラーだったがエラーではなくなった行数
+    fixed_error_count = 0
 
     def __init__(self, is_err=False, master_name='', validator_name='', err_msg='', err_rows=None):
         super().__init__(is_err, master_name, validator_name, err_msg)
 
         # バリデータでエラーになったレコードを格納する
-        if err_rows is None:
-            err_rows = []
-        self.err_rows = err_rows
+        self.err_rows = err_rows or []
+
+    @property
+    def err_rows(self) -> List:
+        """
+        保持しているエラーの行。参照する度にMasterRowを生成する
+        """
+        return self._err_rows.rows()
+
+    @err_rows.setter
+    def err_rows(self, rows):
+        # マスタ全体を保持し続けないように、エラーの行の値だけをストアへの参照を持たない表にコピーして持つ
+        self._err_rows: ErrorRows = compact(rows)
+
+    def __setstate__(self, state):
+        # err_rowsをMasterRowのリストで持っていた古いpickleも読み込めるようにする
+        if 'err_rows' in state:
+            state['_err_rows'] = compact(state.pop('err_rows'))
+        self.__dict__.update(state)
+
+    @property
+    def error_count(self) -> int:
+        """
+        エラーになった行の総数。truncate()で減らした行も数える
+        """
+        return len(self._err_rows) if self._error_count is None else self._error_count
+
+    def error_rows_page(self, start: int = 0, size: Optional[int] = None) -> List:
+        """
+        保持しているエラーの行のうち、start番目からsize行だけを生成して返す
+        :param start:
+        :param size: Noneなら最後まで
+        :return:
+        """
+        return self._err_rows.rows(start, None if size is None else start + size)
+
+    @property
+    def estimated_error_count(self) -> int:
+        """
+        マスタ全体でエラーになる行数の推定値。サンプリングした結果ではエラーの行数を行数の比で拡大する
+        それ以外ではerror_countと同じ
+        """
+        if self.approximation == APPROXIMATE_SAMPLE and self.sampled_rows:
+            return round(self.error_count * self.total_rows / self.sampled_rows)
+        return self.error_count
+
+    def truncate(self, max_rows: int):
+        if len(self._err_rows) > max_rows:
+            self._error_count = self.error_count
+            self._err_rows = self._err_rows.head(max_rows)
 
     def additional_msg(self):
         """
         追加のエラー表示用の文字列を返す
+        set_message_rows()で設定した行数だけを表示し、それより多い場合はエラーの総数を付ける
         :return:
         """
-        return f'error_master_data=<{self.err_rows}>'
+        rows = self.error_rows_page(0, config.current().message_rows)
+        msg = f'error_master_data=<{rows}>'
+        if self.error_count > len(rows):
+            msg += f' error_count=<{self.error_count}>'
+        return msg
+
+    def mark_diff(self, baseline: ValidationResult, changed_rows: Optional[int] = None,
+                  total_rows: Optional[int] = None):
+        """
+        ValidationResult.mark_diff()に加えて、エラーの行をベースラインのエラーの行とpkで突き合わせる
+        truncate()する前に呼ぶものとする
+        """
+        super().mark_diff(baseline, changed_rows, total_rows)
+        baseline_pks = {row.get_pk() for row in baseline.get_error_data()}
+        pks = set(self._err_rows.pks())
+        self.existing_error_pks = frozenset(pks & baseline_pks)
+        self.fixed_error_count = len(baseline_pks - pks)
+
+    def new_error_rows(self) -> List:
+        """
+        保持しているエラーの行のうち、ベースラインではエラーではなかった行を返す
+        """
+        return [row for row in self.err_rows if row.get_pk() not in self.existing_error_pks]
+
+    def new_error_pks(self) -> List:
+        """
+        new_error_rows()のpkを、行を生成せずに返す
+        """
+        return [pk for pk in self._err_rows.pks() if pk not in self.existing_error_pks]
+
+    def diff_msg(self) -> str:
+        if self.baseline_err is None or self.error_count == 0:
+            return super().diff_msg()
+        existing = len(self.existing_error_pks)
+        msg = f' diff=<new {self.error_count - existing}, existing {existing}, fixed {self.fixed_error_count}>'
+        msg += f' new_error_pks=<{self.new_error_pks()[:config.current().message_rows]}>'
+        if self.changed_rows is not None:
+            msg += f' changed_rows=<{self.changed_rows}/{self.total_rows}>'
+        return msg
+
+    def approximate_msg(self) -> str:
+        msg = super().approximate_msg()
+        if self.approximation == APPROXIMATE_SAMPLE:
+            msg += f' estimated_error_count=<{self.estimated_error_count}>'
+        return msg
 
     def get_error_data(self):
         return self.err_rows
 
+    def to_dict(self) -> Dict:
+        result = super().to_dict()
+        result['error_count'] = self.error_count
+        result['error_rows'] = [dict(row.row) for row in self.err_rows]
+        if self.approximation == APPROXIMATE_SAMPLE:
+            result['estimated_error_count'] = self.estimated_error_count
+        if self.baseline_err is not None:
+            result['new_error_pks'] = self.new_error_pks()
+            result['existing_error_count'] = len(self.existing_error_pks)
+            result['fixed_error_count'] = self.fixed_error_count
+        return result
+
 
 class Context:
     """
     構文解析の状態を管理するクラス
     """
 
-    def __init__(self, master_data: MasterDataManipulator, token_list: List[str], mod_path: str):
+    def __init__(self, master_data: Optional[MasterDataManipulator], token_list: List[str], mod_path: str,
+                 hooks: Optional[List[TraceHook]] = None, validator_name: str = ''):
         """
         コンストラクタ
-        :param master_data:
-        :param token_list: トークンリスト
+        :param master_data: 構文解析だけを行う場合はNone
+        :param token_list: トークンリスト。実行だけを行う場合は空でよい
         :param mod_path: コマンドを読み込むモジュールパス
+        :param hooks: 各ノードの解析と実行の前後で呼ぶフック
+        :param validator_name: 実行中のバリデータの文字列。フックの記録に使う
         """
+        self.hooks: List[TraceHook] = list(hooks or [])
+        self.validator_name = validator_name
         self._token_list = token_list
-        self._it = iter(self._token_list)
+        # 現在のトークンの位置。構文エラーの列番号を求めるのに使う
+        self.index = 0
         self._mod_path = mod_path
 
         # 初期値を先頭のトークンに進めておく
-        self.current = next(self._it)
+        self.current = token_list[0] if token_list else None
         self.master_data = master_data
-        self.master_name = master_data.master_name
+        self.master_name = master_data.master_name if master_data is not None else ''
         self.result_info: ValidationResult = self.create_result()
 
     def nextToken(self):
@@ -98,7 +340,8 @@ class Context:
         次のトークンが無い場合はNoneを返す
         :return:
         """
-        self.current = next(self._it, None)
+        self.index += 1
+        self.current = self._token_list[self.index] if self.index < len(self._token_list) else None
         return self.current
 
     def skipToken(self, token: str):
@@ -170,7 +413,11 @@ class Validation(Node):
         self._command = None
 
     def parse(self, c: Context):
-        if not match(r'[\S|\d]+validation', c.current):
+        with traced(c, 'parse', c.current):
+            self._parse(c)
+
+    def _parse(self, c: Context):
+        if not _matches(_VALIDATION_NAME, c.current):
             raise ValueError(c.current)
         self._validation_name = c.current
         self._command = c.create_command(self._validation_name)
@@ -180,13 +427,32 @@ class Validation(Node):
         self._argNode.parse(c)
 
     def execute(self, c: Context):
+        args = None
         try:
             args = self._argNode.execute(c)
-            c.result_info = self._command(c.master_data, *args)
+            with traced(c, 'validation', self._validation_name):
+                c.result_info = self._command(c.master_data, *args)
         except Exception as e:
             error(f'call {self._command.__name__} error. args=[{args}]', exc_info=True, stack_info=True)
             raise e
 
+    def make_aggregate(self, c: Context):
+        """
+        @aggregateで宣言されたコマンドなら、引数を評価してAggregateを作って返す
+        :param c:
+        :return: 宣言されていない場合はNone
+        """
+        make = get_aggregate(self._command)
+        if make is None:
+            return None
+        return make(*self._argNode.execute(c))
+
+    def is_aggregate(self) -> bool:
+        return get_aggregate(self._command) is not None
+
+    def references(self) -> List[str]:
+        return _references(self._command, self._argNode)
+
     def __str__(self):
         return self._validation_name + str(self._argNode)
 
@@ -202,7 +468,7 @@ class ArgValue(Node):
         self._value = None
 
     def parse(self, c: Context):
-        if not match(r'[\S|\d]+', c.current):
+        if not _matches(_ARG_VALUE, c.current):
             raise ValueError(c.current)
 
         self._value = c.current
@@ -248,6 +514,12 @@ class Args(Node):
     def execute(self, c: Context):
         return [value.execute(c) for value in self._arg_value_list]
 
+    def values(self) -> List[str]:
+        """
+        実行せずに引数の値を返す
+        """
+        return [str(x) for x in self._arg_value_list]
+
     def __str__(self):
         return f'({", ".join(str(x) for x in self._arg_value_list)})'
 
@@ -265,7 +537,11 @@ class Filter(Node):
         self._command = None
 
     def parse(self, c: Context):
-        if not match(r'[\S|\d]+filter', c.current):
+        with traced(c, 'parse', c.current):
+            self._parse(c)
+
+    def _parse(self, c: Context):
+        if not _matches(_FILTER_NAME, c.current):
             raise ValueError(c.current)
         self._fileterName = c.current
         self._command = c.create_command(self._fileterName)
@@ -278,15 +554,99 @@ class Filter(Node):
         args = None
         try:
             args = self._argNode.execute(c)
-            c.master_data = self._command(c.master_data, *args)
+            with traced(c, 'filter', self._fileterName):
+                c.master_data = self._command(c.master_data, *args)
         except Exception as e:
             error(f'call {self._command.__name__} error. args=[{args}]', exc_info=True, stack_info=True)
             raise e
 
+    def commands(self) -> List:
+        return [self._command]
+
+    def references(self) -> List[str]:
+        return _references(self._command, self._argNode)
+
+    def key(self):
+        """
+        同じ引数で同じフィルターを実行するノードを同一視するためのキー
+        :return:
+        """
+        return self._fileterName, tuple(str(x) for x in self._argNode._arg_value_list)
+
     def __str__(self):
         return self._fileterName + str(self._argNode)
 
 
+class FusedFilter(Node):
+    """
+    @predicateで宣言された連続するフィルターを1つにまとめたノード
+    構文解析では作られず、Validatorの解析後にfuse_filters()で作られる。
+    """
+
+    def __init__(self, filters: List[Filter]):
+        self._filters = filters
+
+    def parse(self, c: Context):
+        raise NotImplementedError
+
+    def execute(self, c: Context):
+        predicates = []
+        for node in self._filters:
+            args = None
+            try:
+                args = node._argNode.execute(c)
+                predicates.append(get_predicate(node._command)(*args))
+            except Exception as e:
+                error(f'call {node._command.__name__} error. args=[{args}]', exc_info=True, stack_info=True)
+                raise e
+        with traced(c, 'filter', str(self)):
+            c.master_data.keep_if(predicates)
+
+    def key(self):
+        return tuple(node.key() for node in self._filters)
+
+    def commands(self) -> List:
+        return [node._command for node in self._filters]
+
+    def references(self) -> List[str]:
+        return [name for node in self._filters for name in node.references()]
+
+    def __str__(self):
+        return ' > '.join(str(x) for x in self._filters)
+
+
+def _references(command, arg_node: Args) -> List[str]:
+    """
+    @referencesで宣言されたコマンドが参照するマスタ名を返す
+    """
+    get_masters = get_references(command)
+    if get_masters is None:
+        return []
+    return list(get_masters(*arg_node.values()))
+
+
+def fuse_filters(filters: List[Filter]) -> List[Node]:
+    """
+    @predicateで宣言された連続する2つ以上のフィルターをFusedFilterにまとめる
+    :param filters:
+    :return:
+    """
+    result: List[Node] = []
+    run: List[Filter] = []
+    for node in filters + [None]:
+        if node is not None and get_predicate(node._command) is not None:
+            run.append(node)
+            continue
+        if len(run) >= 2:
+            result.append(FusedFilter(run))
+        else:
+            result += run
+        run = []
+        if node is not None:
+            result.append(node)
+    return result
+
+
 class Validator(Node):
     """
     フィルターとバリデーションを合わせたものをバリデータと呼ぶ
@@ -298,10 +658,14 @@ class Validator(Node):
         self._validation = None
 
     def parse(self, c: Context):
+        with traced(c, 'parse', c.validator_name or ' '.join(c._token_list)):
+            self._parse(c)
+
+    def _parse(self, c: Context):
         if not c.isParsable():
             raise Exception('current context is invalid error.')
 
-        while match(r'[\S|\d]+filter', c.current):
+        while _matches(_FILTER_NAME, c.current):
             filterNode = Filter()
             filterNode.parse(c)
             self._filterListNode.append(filterNode)
@@ -314,20 +678,112 @@ class Validator(Node):
             # 最後まできてもまだ解析可能な場合はエラー
             raise ValueError(f'Current token is {c.current}.')
 
+        self._filterListNode = fuse_filters(self._filterListNode)
+
+    @property
+    def filters(self) -> List[Node]:
+        return self._filterListNode
+
+    @property
+    def validation(self) -> Node:
+        return self._validation
+
+    def commands(self) -> List:
+        """
+        このバリデータで実行するコマンドの関数を実行順に返す
+        :return:
+        """
+        return [command for node in self._filterListNode for command in node.commands()] + [self._validation._command]
+
+    def is_row_local(self) -> bool:
+        """
+        全てのコマンドの結果が行毎に決まり、サンプリングした行で実行してエラーの割合を推定できるならTrue
+        :return:
+        """
+        return all(is_row_local(command) for command in self.commands())
+
+    def references(self) -> List[str]:
+        """
+        このバリデータのコマンドが参照する他のマスタ名を返す
+        :return:
+        """
+        return [name for node in self._filterListNode for name in node.references()] + self._validation.references()
+
     def execute(self, c: Context):
         """
         ノードに対応する処理を実行する
         :param c:
         :return:
         """
-        for node in self._filterListNode:
-            node.execute(c)
-        self._validation.execute(c)
+        with traced(c, 'validator', str(self)):
+            for node in self._filterListNode:
+                node.execute(c)
+            self._validation.execute(c)
 
     def __str__(self):
         return f'{" > ".join(str(x) for x in self._filterListNode)} > {self._validation}'
 
 
+def parse_lines(name: str, lines: List[str], mod_path: str,
+                hooks: Optional[List[TraceHook]] = None) -> List[Validator]:
+    """
+    バリデーターファイルの全ての行をまとめて字句解析、構文解析する
+    ファイル全体を1回の走査でトークンに分割し、構文エラーがあっても最後の行まで解析を続ける。
+    :param name: バリデーター名
+    :param lines: バリデーターファイルの各行
+    :param mod_path: コマンドを読み込むモジュールパス
+    :param hooks: 各行の解析の前後で呼ぶフック
+    :return: 各行のValidator
+    :raises ValidatorSyntaxError: 全ての構文エラーを行番号と列番号付きで持つ
+    """
+    # 各行の中に改行は無いので、改行で繋いで1度に分割し、行番号で各行に振り分ける
+    texts = [line.rstrip('\r\n') for line in lines]
+    line_tokens = [[] for _ in texts]
+    for token in tokenize('\n'.join(texts)):
+        line_tokens[token.line - 1].append(token)
+
+    validators = []
+    errors: List[SyntaxErrorInfo] = []
+    for number, (text, tokens) in enumerate(zip(texts, line_tokens), start=1):
+        invalid = invalid_tokens(tokens)
+        if invalid:
+            errors += [token_error(token) for token in invalid]
+            continue
+        if not tokens:
+            errors.append(SyntaxErrorInfo(number, 1, 'validator is empty.'))
+            continue
+
+        c = Context(None, [token.value for token in tokens], mod_path, hooks, text.strip())
+        c.master_name = name
+        validator = Validator()
+        try:
+            validator.parse(c)
+        except Exception as e:
+            errors.append(_parse_error(number, text, tokens, c.index, e))
+            continue
+        validators.append(validator)
+
+    if errors:
+        raise ValidatorSyntaxError(name, errors)
+    return validators
+
+
+def _parse_error(number: int, text: str, tokens, index: int, e: Exception) -> SyntaxErrorInfo:
+    """
+    index番目のトークンで構文解析に失敗したときの構文エラーを返す
+    """
+    if index < len(tokens):
+        column = tokens[index].column
+        found = f'token=<{tokens[index].value}>'
+    else:
+        column = len(text.rstrip()) + 1
+        found = 'end of line'
+    if isinstance(e, (ImportError, AttributeError, TypeError)) and index < len(tokens):
+        # コマンドの読み込みに失敗した
+        return SyntaxErrorInfo(number, column, f'unknown command. {found}')
+    return SyntaxErrorInfo(number, column, f'unexpected {found}.')
+
+
 def get_cmd(mod_name, command_name):
     """
     mod_nameモジュールからcommand_nameオブジェクトを取り出す
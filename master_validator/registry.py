@@ -0,0 +1,94 @@
+"""
+1回の実行で他のマスタを参照するためのレジストリを扱うモジュール
+マスタは参照されたときに読み込み、pkやカラムの値の集合は初めて必要になったときに1度だけ作る。
+集合は同じマスタを参照する全てのバリデータで共有し、参照の検証は集合への所属判定(ハッシュ結合)で行う。
+"""
+import weakref
+from pathlib import Path
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from master_validator.column_store import DEFAULT_KEY_COLUMNS, ColumnStore, normalize_key
+from master_validator.csv_reader import find_csv_paths, read_csv
+from master_validator.master_data import MasterDataManipulator
+
+
+class MasterRegistry:
+    """
+    マスタ名からマスタを引くためのクラス
+    """
+
+    def __init__(self, csv_dir_path=None):
+        """
+        :param csv_dir_path: 参照されたマスタを読み込むcsvファイルのディレクトリ。Noneの場合は登録されたマスタだけを引ける
+        """
+        self._paths: Dict[str, Path] = {}
+        if csv_dir_path is not None:
+            self._paths = {path.stem: path for path in find_csv_paths(csv_dir_path)}
+        # 参照されたために読み込んだマスタ
+        self._loaded: Dict[str, ColumnStore] = {}
+        # 検証のために読み込まれたマスタ。参照されなければ検証後に解放されるように弱参照で持つ
+        self._registered: 'weakref.WeakValueDictionary[str, ColumnStore]' = weakref.WeakValueDictionary()
+        # (マスタ名, カラム名) -> キーの集合
+        self._key_sets: Dict[Tuple[str, str], FrozenSet] = {}
+
+    def register(self, master_data: MasterDataManipulator):
+        """
+        読み込み済みのマスタを登録し、参照されたときに読み直さないようにする
+        """
+        self._registered[master_data.master_name] = master_data._store
+
+    def invalidate(self, name: str):
+        """
+        nameマスタが変更されたときに、読み込んだマスタと作った集合を破棄する
+        """
+        self._loaded.pop(name, None)
+        self._registered.pop(name, None)
+        for key in [key for key in self._key_sets if key[0] == name]:
+            del self._key_sets[key]
+
+    def path_of(self, name: str) -> Optional[Path]:
+        return self._paths.get(name)
+
+    def _store(self, name: str) -> ColumnStore:
+        store = self._loaded.get(name)
+        if store is None:
+            store = self._registered.get(name)
+        if store is not None:
+            return store
+        path = self._paths.get(name)
+        if path is None:
+            raise ValueError(f'unknown master. master=[{name}]')
+        store = self._loaded[name] = read_csv(path)._store
+        return store
+
+    def get(self, name: str) -> MasterDataManipulator:
+        """
+        nameマスタの全行を選択したビューを返す
+        """
+        master_data = MasterDataManipulator.from_store(self._store(name), name)
+        master_data.registry = self
+        return master_data
+
+    def key_set(self, name: str, column: str = 'id') -> FrozenSet:
+        """
+        nameマスタのcolumnカラムの値をnormalize_key()したものの集合を返す
+        :param name: 参照先のマスタ名
+        :param column: 参照先のカラム名
+        :return: 空の値は含まない
+        """
+        key = (name, column)
+        keys = self._key_sets.get(key)
+        if keys is not None:
+            return keys
+
+        store = self._store(name)
+        if column == 'id' and store.key_columns == DEFAULT_KEY_COLUMNS:
+            keys = frozenset(store.pk_index)
+        else:
+            values = store.column(column)
+            if values.is_int:
+                keys = frozenset(values.ints)
+            else:
+                keys = frozenset(normalize_key(values[pos]) for pos in range(len(values))) - {None}
+        self._key_sets[key] = keys
+        return keys
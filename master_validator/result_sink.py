@@ -0,0 +1,119 @@
+"""
+バリデーションの結果を、全ての実行が終わるのを待たずに出力するためのモジュール
+結果はバリデータの行毎にResultCollectorへ渡され、エラーの行数の上限を適用してから各シンクに書き出される。
+"""
+import json
+import logging
+import sys
+from typing import IO, List, Optional
+
+from master_validator.parser import ValidationResult
+
+
+class FailFast(Exception):
+    """
+    エラーの件数がResultCollectorのfail_afterに達したため実行を打ち切ることを表す例外
+    """
+    pass
+
+
+class ResultSink:
+    """
+    結果の出力先の基底クラス
+    """
+
+    def write(self, result: ValidationResult):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LoggingSink(ResultSink):
+    """
+    エラーの結果をログに出力するシンク
+    """
+
+    def __init__(self, level=logging.INFO):
+        self._level = level
+
+    def write(self, result: ValidationResult):
+        if result.is_err:
+            logging.log(self._level, result.message())
+
+
+class JsonLinesSink(ResultSink):
+    """
+    結果を1行1件のJSON(JSON Lines)で書き出すシンク
+    """
+
+    def __init__(self, file: IO[str], errors_only: bool = False):
+        """
+        :param file: 書き込み先。書き込む度にflushする
+        :param errors_only: Trueならエラーの結果だけを書き出す
+        """
+        self._file = file
+        self._errors_only = errors_only
+
+    @classmethod
+    def open(cls, path: str, errors_only: bool = False) -> 'JsonLinesSink':
+        """
+        pathに書き出すシンクを返す。pathが '-' の場合は標準出力に書き出す
+        """
+        if path == '-':
+            return cls(sys.stdout, errors_only)
+        return _ClosingJsonLinesSink(open(path, 'w', encoding='utf-8'), errors_only)
+
+    def write(self, result: ValidationResult):
+        if self._errors_only and not result.is_err:
+            return
+        self._file.write(json.dumps(result.to_dict(), ensure_ascii=False) + '\n')
+        self._file.flush()
+
+
+class _ClosingJsonLinesSink(JsonLinesSink):
+    def close(self):
+        self._file.close()
+
+
+class ResultCollector:
+    """
+    結果を受け取り、エラーの行数の上限を適用してシンクに書き出すクラス
+    """
+
+    def __init__(self, sinks: Optional[List[ResultSink]] = None, max_error_rows: Optional[int] = None,
+                 fail_after: Optional[int] = None):
+        """
+        :param sinks: 結果の出力先
+        :param max_error_rows: 1つの結果が保持するエラーの行数の上限。Noneなら上限なし。エラーの総数は保持する
+        :param fail_after: エラーの結果がこの件数に達したら実行を打ち切る。Noneなら打ち切らない
+        """
+        self.sinks: List[ResultSink] = list(sinks or [])
+        self.max_error_rows = max_error_rows
+        self.fail_after = fail_after
+        self.results = 0
+        self.errors = 0
+        # fail_afterにより実行を打ち切ったか
+        self.stopped = False
+
+    def add(self, result: ValidationResult):
+        """
+        結果を1件受け取ってシンクに書き出す
+        エラーの件数がfail_afterに達した場合はFailFastを送出する
+        :param result:
+        :return:
+        """
+        if self.max_error_rows is not None:
+            result.truncate(self.max_error_rows)
+        for sink in self.sinks:
+            sink.write(result)
+        self.results += 1
+        if result.is_err:
+            self.errors += 1
+            if self.fail_after is not None and self.errors >= self.fail_after:
+                self.stopped = True
+                raise FailFast(f'stopped after {self.errors} errors.')
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
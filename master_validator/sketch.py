@@ -0,0 +1,171 @@
+"""
+少ないメモリで近似の集計値を求めるスケッチを扱うモジュール
+どのスケッチも同じ種類のスケッチとmerge()でき、チャンク毎やプロセス毎に作ったものをまとめられる。
+"""
+import math
+import random
+import zlib
+from itertools import islice
+from typing import Any, Iterable, List, Optional
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def stable_hash(value: Any) -> int:
+    """
+    プロセスによらず同じになる64ビットのハッシュ値を返す
+    hash()は文字列のハッシュ値がプロセス毎に変わるので、別のプロセスで作ったスケッチとmergeできない
+    整数は下位64ビットを、それ以外は文字列のcrc32を、splitmix64の最後の混ぜ合わせで64ビット全体に広げる
+    """
+    x = value & _MASK64 if type(value) is int else zlib.crc32(str(value).encode())
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & _MASK64
+    return x ^ (x >> 31)
+
+
+def reservoir_sample(items: Iterable, size: int, rng: Optional[random.Random] = None) -> List:
+    """
+    itemsから無作為にsize個を選んで返す。size個以下なら全て返す
+    件数が分からなくても1回の走査で選べるリザーバーサンプリング(Algorithm L)で、
+    次に入れ替える要素までを乱数で読み飛ばすので、乱数を使う回数はおおよそsize * log(n / size)になる。
+    :param items:
+    :param size: 選ぶ件数
+    :param rng: 省略時はrandomモジュールの乱数
+    :return: itemsでの順序は保たない
+    """
+    rng = rng or random
+    it = iter(items)
+    reservoir = list(islice(it, size))
+    if len(reservoir) < size or size == 0:
+        return reservoir
+
+    def uniform() -> float:
+        # logを取るので0を除いた(0, 1)の乱数にする
+        while True:
+            u = rng.random()
+            if u > 0.0:
+                return u
+
+    w = math.exp(math.log(uniform()) / size)
+    missing = object()
+    while True:
+        skip = math.floor(math.log(uniform()) / math.log1p(-w))
+        item = next(islice(it, skip, None), missing)
+        if item is missing:
+            return reservoir
+        reservoir[rng.randrange(size)] = item
+        w *= math.exp(math.log(uniform()) / size)
+
+
+class HyperLogLog:
+    """
+    値の種類数を近似するHyperLogLog
+    precisionが12なら4096バイトで、標準誤差は約1.6%になる
+    """
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError(f'precision must be between 4 and 16. precision=[{precision}]')
+        self.precision = precision
+        self._registers = bytearray(1 << precision)
+        # 先頭のprecisionビットをレジスタの番号に、残りのビットを順位に使う
+        self._rest_bits = 64 - precision
+        self._rest_mask = (1 << self._rest_bits) - 1
+
+    def add(self, value: Any):
+        x = stable_hash(value)
+        # 残りのビットで先頭から最初に1が現れる位置
+        rank = self._rest_bits - (x & self._rest_mask).bit_length() + 1
+        index = x >> self._rest_bits
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.precision != self.precision:
+            raise ValueError('can not merge HyperLogLog with different precision.')
+        self._registers = bytearray(max(a, b) for a, b in zip(self._registers, other._registers))
+
+    def count(self) -> int:
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 少ない場合は空のレジスタの数から求める(Linear Counting)
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class QuantileSketch:
+    """
+    分位数を近似するスケッチ(KLLと同じ、重みが2倍ずつのコンパクタを重ねたもの)
+    各段がk個を超えたら整列して1つおきに上の段へ送るので、保持する値の数はおおよそk * log2(n / k)になる。
+    最小値と最大値は厳密に保持する。
+    """
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None):
+        self.k = k
+        # 段 -> 値のリスト。h段目の値はそれぞれ2^h個分の値を表す
+        self._levels: List[List] = [[]]
+        self._rng = random.Random(seed)
+        self.n = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if self.n == 0 or value < self.min:
+            self.min = value
+        if self.n == 0 or value > self.max:
+            self.max = value
+        self.n += 1
+        self._levels[0].append(value)
+        if len(self._levels[0]) > self.k:
+            self._compress()
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.n == 0:
+            return
+        for h, items in enumerate(other._levels):
+            if h >= len(self._levels):
+                self._levels.append([])
+            self._levels[h].extend(items)
+        self.min = other.min if self.n == 0 else min(self.min, other.min)
+        self.max = other.max if self.n == 0 else max(self.max, other.max)
+        self.n += other.n
+        self._compress()
+
+    def _compress(self):
+        for h in range(len(self._levels)):
+            items = self._levels[h]
+            if len(items) <= self.k:
+                continue
+            items.sort()
+            # 奇数個なら最後の1個はこの段に残す
+            keep = [items.pop()] if len(items) % 2 else []
+            offset = self._rng.randrange(2)
+            if h + 1 == len(self._levels):
+                self._levels.append([])
+            self._levels[h + 1].extend(items[offset::2])
+            self._levels[h] = keep
+
+    def quantile(self, q: float):
+        """
+        q分位数(0 <= q <= 1)の近似値を返す。値が無い場合はNone
+        厳密な場合と同じく、整列したn個の値のceil(q * n)番目(1始まり)を返す
+        """
+        if self.n == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        weighted = sorted((value, 1 << h) for h, items in enumerate(self._levels) for value in items)
+        total = sum(weight for _, weight in weighted)
+        rank = math.ceil(q * total)
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= rank:
+                return value
+        return self.max
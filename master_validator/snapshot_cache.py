@@ -0,0 +1,144 @@
+"""
+解析済みのマスタをcsvファイルの内容のハッシュをキーにしてディスクに保存し、次回以降の読み込みで再利用するモジュール
+スナップショットはColumnStoreの列をそのままpickleしたもので、csvの解析を行わずに復元できる。
+書き込みは一時ファイルからのリネームで行い、同時に実行される他のプロセスが壊れたファイルを読むことはない。
+保存先の合計サイズが上限を超えた場合は、最後に使われたのが古いものから削除する。
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from logging import debug, warning
+from pathlib import Path
+from typing import Optional
+
+from master_validator.column_store import ColumnStore
+
+# スナップショットの形式を変更した場合はこの値を変える
+_SNAPSHOT_FORMAT_VERSION = '2'
+SUFFIX = '.snapshot'
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def content_hash(path: Path, salt: str = '') -> str:
+    """
+    pathのファイルの内容のハッシュを返す
+    :param path:
+    :param salt: 同じ内容でも解析方法が異なる場合に、別のキーにするための文字列
+    :return:
+    """
+    h = hashlib.sha256()
+    h.update(_SNAPSHOT_FORMAT_VERSION.encode())
+    h.update(b'\0')
+    h.update(salt.encode())
+    h.update(b'\0')
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SnapshotCache:
+    """
+    スナップショットを保存するディレクトリを扱うクラス
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        :param cache_dir: スナップショットの保存先
+        :param max_bytes: 保存先の合計サイズの上限
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(key + SUFFIX)
+
+    def load(self, key: str) -> Optional[ColumnStore]:
+        """
+        keyのスナップショットを読み込む。無い場合や壊れている場合はNoneを返す
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+            store = ColumnStore.from_snapshot(snapshot)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            warning(f'invalid snapshot. path=[{path}] error=[{e}]')
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            # 更新日時を最後に使われた日時として追い出しの順序に使う
+            os.utime(path)
+        except OSError:
+            pass
+        return store
+
+    def save(self, key: str, store: ColumnStore):
+        """
+        storeをkeyのスナップショットとして保存し、上限を超えた分を追い出す
+        保存に失敗しても読み込みには影響しないので、警告だけを出す
+        """
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(store.to_snapshot(), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self._path(key))
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            warning(f'failed to save snapshot. dir=[{self.cache_dir}] error=[{e}]')
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        合計サイズがmax_bytes以下になるまで、最後に使われたのが古いスナップショットから削除する
+        他のプロセスが先に削除したファイルは無視する
+        """
+        entries = []
+        for path in self.cache_dir.glob('*' + SUFFIX):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                debug(f'evicted snapshot. path=[{path}]')
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def read(self, path: Path, parse, salt: str = '') -> ColumnStore:
+        """
+        pathのcsvファイルのスナップショットがあれば復元し、無ければparse()で解析して保存する
+        :param path: csvファイルのパス
+        :param parse: csvファイルを解析してColumnStoreを返す関数
+        :param salt: content_hash()に渡す。主キーの指定などparseの結果を変える設定を渡す
+        :return:
+        """
+        key = content_hash(path, salt)
+        store = self.load(key)
+        if store is None:
+            store = parse()
+            self.save(key, store)
+        return store
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,162 @@
+"""
+構文木の各ノードの解析と実行にフックを差し込み、実行時間や行数を記録するためのモジュール
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+
+@dataclass
+class TraceRecord:
+    """
+    1ノードの解析か実行の記録
+    """
+    # 'parse', 'validator', 'filter', 'validation' のいずれか
+    category: str
+    # コマンド名。parseとvalidatorの場合はバリデータの文字列
+    name: str
+    master_name: str
+    # ノードを含むバリデータの文字列
+    validator: str
+    # time.perf_counter()の値(秒)
+    start: float
+    # 経過時間(秒)
+    duration: float = 0.0
+    # フィルターの入力行数。validationの場合は検証した行数。ストリーム実行では分からないのでNone
+    rows_in: Optional[int] = None
+    # フィルターの出力行数
+    rows_out: Optional[int] = None
+    pid: int = 0
+
+
+class TraceHook:
+    """
+    解析と実行の前後で呼ばれるフックの基底クラス
+    必要なメソッドだけをオーバーライドする。
+    """
+
+    def before(self, record: TraceRecord):
+        """
+        ノードの解析か実行の直前に呼ばれる。durationやrows_outはまだ設定されていない
+        """
+        pass
+
+    def after(self, record: TraceRecord):
+        """
+        ノードの解析か実行の直後に呼ばれる。例外が発生した場合も呼ばれる
+        """
+        pass
+
+
+class TraceRecorder(TraceHook):
+    """
+    記録を全て保持し、Chrome trace形式のJSONや遅いコマンドの集計を出力するフック
+    """
+
+    def __init__(self):
+        self.records: List[TraceRecord] = []
+
+    def after(self, record: TraceRecord):
+        self.records.append(record)
+
+    def merge(self, other: 'TraceRecorder'):
+        """
+        他のプロセスで記録したotherの記録を取り込む
+        """
+        self.records += other.records
+
+    def to_chrome_trace(self) -> Dict:
+        """
+        chrome://tracing や Perfetto で読み込めるJSONオブジェクトを返す
+        """
+        events = []
+        for r in self.records:
+            args = {'master': r.master_name, 'validator': r.validator}
+            if r.rows_in is not None:
+                args['rows_in'] = r.rows_in
+            if r.rows_out is not None:
+                args['rows_out'] = r.rows_out
+            events.append({
+                'name': r.name,
+                'cat': r.category,
+                'ph': 'X',
+                'ts': r.start * 1e6,
+                'dur': r.duration * 1e6,
+                'pid': r.pid,
+                'tid': r.pid,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+
+    def to_json(self) -> List[Dict]:
+        return [asdict(r) for r in self.records]
+
+    def slowest_commands(self, n: int = 10) -> List[Dict]:
+        """
+        フィルターとバリデーションのコマンドを合計時間の長い順にn件返す
+        :param n:
+        :return: command, category, calls, total, max, rows_in
+        """
+        summary: Dict[tuple, Dict] = {}
+        for r in self.records:
+            if r.category not in ('filter', 'validation'):
+                continue
+            s = summary.setdefault((r.category, r.name), {
+                'command': r.name, 'category': r.category, 'calls': 0, 'total': 0.0, 'max': 0.0, 'rows_in': 0})
+            s['calls'] += 1
+            s['total'] += r.duration
+            s['max'] = max(s['max'], r.duration)
+            s['rows_in'] += r.rows_in or 0
+        return sorted(summary.values(), key=lambda s: s['total'], reverse=True)[:n]
+
+    def summary_table(self, n: int = 10) -> str:
+        lines = [f'{"command":<40}{"category":<12}{"calls":>8}{"total ms":>12}{"max ms":>12}{"rows in":>12}']
+        for s in self.slowest_commands(n):
+            lines.append(f'{s["command"]:<40}{s["category"]:<12}{s["calls"]:>8}'
+                         f'{s["total"] * 1000:>12.3f}{s["max"] * 1000:>12.3f}{s["rows_in"]:>12}')
+        return '\n'.join(lines)
+
+
+def _count(master_data) -> Optional[int]:
+    """
+    ストリームを読み進めずに行数が分かる場合だけ行数を返す
+    """
+    if master_data is None or not hasattr(master_data, 'view'):
+        return None
+    return master_data.count()
+
+
+@contextmanager
+def traced(c, category: str, name: str):
+    """
+    withブロックの処理をcのフックで記録する
+    フックが無い場合は何もしない
+    :param c: Context
+    :param category: 'parse', 'validator', 'filter', 'validation' のいずれか
+    :param name:
+    :return:
+    """
+    if not c.hooks:
+        yield
+        return
+
+    record = TraceRecord(category, name, c.master_name, c.validator_name, time.perf_counter(), pid=os.getpid())
+    if category in ('filter', 'validation'):
+        record.rows_in = _count(c.master_data)
+    for hook in c.hooks:
+        hook.before(record)
+    try:
+        yield
+    finally:
+        record.duration = time.perf_counter() - record.start
+        if category == 'filter':
+            record.rows_out = _count(c.master_data)
+        for hook in c.hooks:
+            hook.after(record)
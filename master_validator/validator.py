@@ -1,23 +1,57 @@
 import logging
+import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 
-from master_validator.csv_reader import read_all
+from master_validator import config
+from master_validator.compiler import CompiledValidator, load_compiled
+from master_validator.config import DEFAULT_STREAM_MIN_BYTES
+from master_validator.csv_reader import find_csv_paths, read_csv
+from master_validator.diff import execute_diff
 from master_validator.lexer import lexer
-from master_validator.master_data import MasterDataManipulator
+from master_validator.master_data import DuplicateKeyError, MasterDataManipulator
 from master_validator.parser import Context, Validator, ValidationResult
+from master_validator.registry import MasterRegistry
+from master_validator.result_sink import FailFast, ResultCollector
 
+# バリデーターファイルを置くディレクトリ
+VALIDATOR_DIR = Path('./validator')
 
-def read_validator_file(name):
+# ワーカープロセス内で使い回すMasterRegistry。csvディレクトリ -> MasterRegistry
+_worker_registries: Dict[str, MasterRegistry] = {}
+
+
+def set_stream_min_bytes(min_bytes: Optional[int]):
+    """
+    全てのコマンドがストリーム実行できるバリデータを、min_bytes以上のcsvファイルでだけストリーム実行するように設定する
+    ストリーム実行はバリデータの行毎にcsvファイルを読み直すので、メモリに収まるマスタは読み込んで実行した方が速い
+    :param min_bytes: Noneならストリーム実行しない
+    :return:
+    """
+    config.update(stream_min_bytes=min_bytes)
+
+
+def validator_file_path(name, validator_dir=VALIDATOR_DIR) -> Path:
+    """
+    バリデーターファイルのパスを返す
+    :param name: validatorフォルダ内の拡張子なしファイル名を指定
+    :param validator_dir: バリデーターファイルを置くディレクトリ
+    :return:
+    """
+    return Path(validator_dir).joinpath(name).with_suffix('.txt')
+
+
+def read_validator_file(name, validator_dir=VALIDATOR_DIR):
     """
     バリデータの内容をファイルから読み込む
     :param name: validatorフォルダ内の拡張子なしファイル名を指定
+    :param validator_dir: バリデーターファイルを置くディレクトリ
     :return: ファイルの中身の文字列
     """
     try:
-        path = Path('./validator')
-        path = path.joinpath(name)
-        path = path.with_suffix('.txt')
+        path = validator_file_path(name, validator_dir)
         with open(path, newline='') as f:
             result = f.readlines()
     except Exception as e:
@@ -38,7 +72,8 @@ def exec_validator(master_data: MasterDataManipulator, validator_str) -> Validat
     logging.debug(master_data.all())
 
     token_list = lexer(validator_str)
-    c = Context(master_data, token_list, 'master_validator.command')
+    # フィルターで絞り込んでも他の行に影響しないように、行毎に全行を選択したビューを渡す
+    c = Context(master_data.view(), token_list, 'master_validator.command')
     validator = Validator()
     validator.parse(c)
     validator.execute(c)
@@ -48,32 +83,187 @@ def exec_validator(master_data: MasterDataManipulator, validator_str) -> Validat
     return c.result_info
 
 
-def validate(master_data: MasterDataManipulator) -> List[ValidationResult]:
+def validate(master_data: MasterDataManipulator, cache_dir=None, hooks=None, registry=None) -> List[ValidationResult]:
     """
     マスタに対応するバリデータを実行する。
+    バリデータはコンパイル済みのものがあれば再利用する。
     :param master_data:
+    :param cache_dir: コンパイル済みバリデータのディスクキャッシュの保存先
+    :param hooks: 各ノードの解析と実行の前後で呼ぶフック(tracing.TraceHook)のリスト
+    :param registry: 他のマスタを参照するためのMasterRegistry。Noneの場合はmaster_dataだけを参照できる
     :return:
     """
-    result_list = []
+    if registry is None:
+        registry = MasterRegistry()
+    registry.register(master_data)
+    master_data.registry = registry
     validator_str_list = read_validator_file(master_data.master_name)
-    for validator_str in validator_str_list:
-        result = exec_validator(master_data, validator_str)
-        result_list.append(result)
+    compiled = load_compiled(master_data.master_name, validator_str_list, cache_dir=cache_dir, hooks=hooks)
+    result_list = compiled.execute(master_data, hooks)
+    logging.debug(f'conversion cache {master_data.master_name} {master_data.conversion_cache.stats()}')
     return result_list
 
 
-def validate_all(csv_dir_path) -> List[ValidationResult]:
+def validate_all(csv_dir_path, cache_dir=None, jobs=None, hooks=None,
+                 collector: Optional[ResultCollector] = None, sample_rows: Optional[int] = None,
+                 sample_seed=None, baseline_dir=None) -> List[ValidationResult]:
     """
     全てのバリデータを実行する。
     csv_dir_pathディレクトリにあるcsvフォーマットのマスターデータを読み込み、validatorディレクトリ内のバリデータファイルを実行する。
     csvファイル名と同じバリデータファイルが実行される。
     :param csv_dir_path:
-    :return:
+    :param cache_dir: コンパイル済みバリデータのディスクキャッシュの保存先
+    :param jobs: 並列に実行するプロセス数。Noneか1以下なら1プロセスで順に実行する
+    :param hooks: 各ノードの解析と実行の前後で呼ぶフック(tracing.TraceHook)のリスト。
+        並列に実行する場合、フックは各プロセスに複製され、mergeメソッドを持つフックには実行後に各プロセスの記録を取り込む。
+    :param collector: 結果を出る度に渡すResultCollector。指定した場合は結果を保持せず、空のリストを返す。
+        fail_afterに達した場合はそこで実行を打ち切る
+    :param sample_rows: 指定した場合は近似の実行にする。マスタをメモリマップして読み込み、
+        結果が行毎に決まるバリデータはsample_rows行のサンプルで、集計はスケッチで実行する。
+        近似の結果はValidationResult.approximationで分かる。sample_rows行以下のマスタは厳密に実行する
+    :param sample_seed: サンプリングの乱数のシード。指定するとjobsによらず同じ行を選ぶ
+    :param baseline_dir: 指定した場合は差分の実行にする。diff.load_baseline()で読み込んだベースラインと行を比べ、
+        結果が行毎に決まるバリデータは追加と変更された行だけで実行し、各結果にベースラインでもエラーだったかを記録する
+    :return: 結果の順序はjobsによらず同じ。collectorを指定した場合は空のリスト
     """
+    if sample_rows is not None and baseline_dir is not None:
+        raise ValueError('sample_rows and baseline_dir can not be specified together.')
     result_list: List[ValidationResult] = []
-    for master_data in read_all(csv_dir_path):
-        logging.debug('csv file = ' + master_data.master_name)
-        # CSVファイル名 == マスター名としている
-        result_list += validate(master_data)
 
+    # collectorを指定した場合は、シンクに書き出した結果を保持しないことでメモリの使用量を抑える
+    on_result = result_list.append if collector is None else collector.add
+
+    try:
+        if jobs is not None and jobs > 1:
+            max_error_rows = collector.max_error_rows if collector is not None else None
+            _validate_all_parallel(csv_dir_path, cache_dir, jobs, hooks, on_result, max_error_rows,
+                                   sample_rows, sample_seed, baseline_dir)
+        else:
+            # 参照先のマスタと索引は全てのマスタのバリデータで共有する
+            registry = MasterRegistry(csv_dir_path)
+            for path in find_csv_paths(csv_dir_path):
+                _validate_path(path, cache_dir, hooks, registry, on_result, sample_rows, sample_seed, baseline_dir)
+    except FailFast as e:
+        logging.debug(str(e))
+
+    return result_list
+
+
+def _validate_all_parallel(csv_dir_path, cache_dir, jobs, hooks, on_result, max_error_rows=None,
+                           sample_rows=None, sample_seed=None, baseline_dir=None):
+    """
+    マスタ毎にcsvの読み込みとバリデータの実行をプロセスプールで行う
+    結果はマスタ毎にまとめてon_resultに渡す
+    """
+    paths = find_csv_paths(csv_dir_path)
+    # spawnで起動したワーカーにもset_*()の設定を引き継ぐ
+    with ProcessPoolExecutor(max_workers=jobs, initializer=config.apply, initargs=(config.current(),)) as executor:
+        worker = partial(_validate_path_in_worker, csv_dir_path=str(csv_dir_path), cache_dir=cache_dir, hooks=hooks,
+                         max_error_rows=max_error_rows, sample_rows=sample_rows, sample_seed=sample_seed,
+                         baseline_dir=baseline_dir)
+        futures = [executor.submit(worker, path) for path in paths]
+        try:
+            # 投入した順に結果を受け取るので、順に実行した場合と同じ順序になる
+            for future in futures:
+                results, worker_hooks = future.result()
+                for hook, worker_hook in zip(hooks or [], worker_hooks or []):
+                    if hasattr(hook, 'merge'):
+                        hook.merge(worker_hook)
+                for result in results:
+                    on_result(result)
+        except FailFast:
+            # まだ始まっていないマスタは実行しない。cancel_futuresはPython 3.9以降なので使わない
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+            raise
+
+
+def _validate_path_in_worker(path: Path, csv_dir_path: str, cache_dir=None, hooks=None, max_error_rows=None,
+                             sample_rows=None, sample_seed=None, baseline_dir=None):
+    """
+    ワーカープロセスで実行する処理
+    MasterRegistryはプロセス毎に作り、同じプロセスで実行するマスタの間で共有する。
+    親プロセスに送るデータを減らすため、エラーの行はmax_error_rows件までにしてから返す。
+    フックの記録を親プロセスに返すため、結果と一緒にフックも返す
+    """
+    registry = _worker_registries.get(csv_dir_path)
+    if registry is None:
+        registry = _worker_registries[csv_dir_path] = MasterRegistry(csv_dir_path)
+    results = _validate_path(path, cache_dir, hooks, registry, sample_rows=sample_rows, sample_seed=sample_seed,
+                             baseline_dir=baseline_dir)
+    if max_error_rows is not None:
+        for result in results:
+            result.truncate(max_error_rows)
+    return results, hooks
+
+
+def _validate_path(path: Path, cache_dir=None, hooks=None, registry=None, on_result=None,
+                   sample_rows=None, sample_seed=None, baseline_dir=None) -> List[ValidationResult]:
+    """
+    1つのcsvファイルのマスタに対応するバリデータを実行する
+    """
+    # CSVファイル名 == マスター名としている
+    master_name = path.stem
+    logging.debug('csv file = ' + master_name)
+    compiled = load_compiled(master_name, read_validator_file(master_name), cache_dir=cache_dir, hooks=hooks)
+    return execute_compiled(compiled, path, master_name, hooks, registry, on_result, sample_rows, sample_seed,
+                            baseline_dir)
+
+
+def execute_compiled(compiled: CompiledValidator, path: Path, master_name: str, hooks=None,
+                     registry=None, on_result=None, sample_rows=None, sample_seed=None,
+                     baseline_dir=None) -> List[ValidationResult]:
+    """
+    コンパイル済みのバリデータをcsvファイルのマスタに対して実行する
+    全てのコマンドがストリーム実行でき、csvファイルがset_stream_min_bytes()で設定したサイズ以上の場合は
+    マスタをメモリに読み込まずに実行する。
+    :param compiled:
+    :param path: マスタのcsvファイルのパス
+    :param master_name:
+    :param hooks: 各ノードの実行の前後で呼ぶフック
+    :param registry: 他のマスタを参照するためのMasterRegistry
+    :param on_result: 各行の結果が出る度に呼ぶ関数
+    :param sample_rows: 指定した場合は近似の実行にする。validate_all()を参照
+    :param sample_seed: サンプリングの乱数のシード
+    :param baseline_dir: 指定した場合は差分の実行にする。validate_all()を参照
+    :return:
+    """
+    if registry is None:
+        registry = MasterRegistry(path.parent)
+    if baseline_dir is not None:
+        return execute_diff(compiled, path, master_name, hooks, registry, on_result, baseline_dir)
+    if sample_rows is not None:
+        return _execute_sampled(compiled, path, master_name, hooks, registry, on_result, sample_rows, sample_seed)
+    min_bytes = config.current().stream_min_bytes
+    if min_bytes is not None and compiled.is_streamable() and path.stat().st_size >= min_bytes:
+        try:
+            return compiled.execute_stream(path, master_name, hooks, registry, on_result)
+        except DuplicateKeyError as e:
+            # 同じpkの行を1行にまとめた結果にするため、メモリに読み込んで実行し直す
+            logging.debug(f'{e}. fall back to in-memory execution.')
+
+    master_data = read_csv(path)
+    master_data.registry = registry
+    registry.register(master_data)
+    result_list = compiled.execute(master_data, hooks, on_result)
+    logging.debug(f'conversion cache {master_name} {master_data.conversion_cache.stats()}')
     return result_list
+
+
+def _execute_sampled(compiled: CompiledValidator, path: Path, master_name: str, hooks, registry, on_result,
+                     sample_rows: int, sample_seed=None) -> List[ValidationResult]:
+    """
+    コンパイル済みのバリデータを近似で実行する
+    マスタはメモリマップして行の位置だけを求め、サンプルの行と集計で参照する値だけをデコードする。
+    """
+    master_data = read_csv(path, mapped=True)
+    master_data.registry = registry
+    registry.register(master_data)
+    sampled = None
+    if master_data.count() > sample_rows:
+        # 並列に実行してもマスタ毎に同じ行を選ぶように、シードとマスタ名から乱数を作る
+        rng = random.Random(f'{sample_seed}:{master_name}') if sample_seed is not None else random.Random()
+        sampled = master_data.sample(sample_rows, rng)
+        logging.debug(f'sampled {master_name} {sampled.count()}/{master_data.count()} rows')
+    return compiled.execute(master_data, hooks, on_result, sampled)
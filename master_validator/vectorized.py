@@ -0,0 +1,174 @@
+"""
+NumPyでカラムの索引と選択の更新をまとめて行うためのモジュール
+NumPyは任意の依存パッケージで、インストールされていない場合は使わない。
+"""
+from array import array
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# NumPyの配列にする型名 -> dtype
+_DTYPES = {
+    'int': 'int64',
+    'float': 'float64',
+    'datetime': 'datetime64[us]',
+}
+
+_enabled = np is not None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(enabled: bool):
+    """
+    NumPyを使うか切り替える。NumPyが無い場合は常に使わない
+    :param enabled:
+    :return:
+    """
+    global _enabled
+    _enabled = enabled and np is not None
+
+
+def column_array(store, column: str, kind: str):
+    """
+    columnカラムをkind型のNumPy配列にして返す。配列はストアにキャッシュする
+    変換できない値がある場合はNoneを返す
+    :param store: ColumnStore
+    :param column:
+    :param kind:
+    :return:
+    """
+    key = (column, kind)
+    if key in store.vector_cache:
+        return store.vector_cache[key]
+
+    source = store.column(column)
+    if kind in ('int', 'float') and source.is_int:
+        # 整数で保持しているカラムは文字列を経由せずに配列にする
+        array = np.array(source.ints, dtype=_DTYPES[kind])
+    else:
+        values = store.conversions.convert_all(column, kind)
+        array = None if values is None else _to_array(values, kind)
+
+    store.vector_cache[key] = array
+    return array
+
+
+def _to_array(values, kind: str):
+    try:
+        return np.array(values, dtype=_DTYPES[kind])
+    except (OverflowError, ValueError, TypeError):
+        # int64の範囲外の値などは配列にできない
+        return None
+
+
+class SortedIndex:
+    """
+    NumPyで作るカラムのソート済み索引
+    値の昇順に並べた行位置を保持し、等値と範囲の検索をsearchsortedで行う。
+    """
+
+    def __init__(self, array, kind: str):
+        self._kind = kind
+        self._order = np.argsort(array, kind='stable')
+        self._sorted = array[self._order]
+
+    def positions(self, op: str, value):
+        """
+        「カラムの値 op value」を満たす行位置の配列を返す。valueを配列にできない場合はNone
+        :param op: 'eq', 'gt', 'lt', 'ge', 'le' のいずれか
+        :param value:
+        :return:
+        """
+        v = _to_array(value, self._kind)
+        if v is None:
+            return None
+        if op == 'eq':
+            return self._order[np.searchsorted(self._sorted, v, 'left'):np.searchsorted(self._sorted, v, 'right')]
+        if op == 'gt':
+            return self._order[np.searchsorted(self._sorted, v, 'right'):]
+        if op == 'ge':
+            return self._order[np.searchsorted(self._sorted, v, 'left'):]
+        if op == 'lt':
+            return self._order[:np.searchsorted(self._sorted, v, 'left')]
+        if op == 'le':
+            return self._order[:np.searchsorted(self._sorted, v, 'right')]
+        raise ValueError(f'unknown operator. op=[{op}]')
+
+
+def build_index(store, column: str, kind: str) -> Optional[SortedIndex]:
+    array = column_array(store, column, kind)
+    return None if array is None else SortedIndex(array, kind)
+
+
+def is_array(positions) -> bool:
+    return np is not None and isinstance(positions, np.ndarray)
+
+
+def clear_positions(mask: bytearray, positions) -> int:
+    """
+    選択のビットマップmaskからpositionsの行を外す
+    :param mask: MasterDataManipulatorの選択のビットマップ
+    :param positions: 行位置の配列
+    :return: 残った行数
+    """
+    selection = np.frombuffer(mask, dtype=np.uint8)
+    selection[positions] = 0
+    return int(np.count_nonzero(selection))
+
+
+def keep_positions(new_mask: bytearray, mask: Optional[bytearray], positions) -> int:
+    """
+    maskで選択中の行のうちpositionsの行だけをnew_maskで選択する
+    :param new_mask: 全て0のビットマップ
+    :param mask: 現在の選択のビットマップ。Noneは全行選択
+    :param positions: 行位置の配列
+    :return: 選択した行数
+    """
+    selection = np.frombuffer(new_mask, dtype=np.uint8)
+    if mask is None:
+        selection[positions] = 1
+    else:
+        selection[positions] = np.frombuffer(mask, dtype=np.uint8)[positions]
+    return int(np.count_nonzero(selection))
+
+
+def row_offsets(buffer, chunk_size: int = 1 << 26):
+    """
+    csvのバイト列の各行の開始位置と終了位置を求める。mapped_csv.scan_row_offsetsのNumPy版
+    引用符の数が偶数になる位置の改行だけを行の区切りとする。作業用の配列が大きくならないようにchunk_size毎に処理する
+    :param buffer: bytesやmmap
+    :param chunk_size:
+    :return: 開始位置と終了位置を交互に並べたarray('q')。空行は含めない
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    size = len(data)
+    newlines = []
+    parity = 0
+    for begin in range(0, size, chunk_size):
+        chunk = data[begin:begin + chunk_size]
+        quotes = np.flatnonzero(chunk == ord('"'))
+        lf = np.flatnonzero(chunk == ord('\n'))
+        # 各改行より前にある引用符の数が偶数なら、その改行は引用符の外にある
+        outside = (np.searchsorted(quotes, lf) + parity) % 2 == 0
+        newlines.append(lf[outside] + begin)
+        parity = (parity + len(quotes)) % 2
+    if parity:
+        raise ValueError('unterminated quoted field.')
+
+    ends = np.concatenate(newlines + [np.empty(0, dtype=np.int64)]).astype(np.int64) + 1
+    if size and (len(ends) == 0 or ends[-1] != size):
+        ends = np.append(ends, size)
+    starts = np.concatenate([np.zeros(1, dtype=np.int64), ends[:-1]])[:len(ends)]
+    lengths = ends - starts
+    first = data[np.minimum(starts, max(size - 1, 0))] if size else np.empty(0, dtype=np.uint8)
+    blank = ((lengths == 1) & (first == ord('\n'))) | ((lengths == 2) & (first == ord('\r')) &
+                                                       (data[np.minimum(starts + 1, max(size - 1, 0))] == ord('\n')))
+    offsets = array('q')
+    offsets.frombytes(np.stack([starts[~blank], ends[~blank]], axis=1).astype(np.int64).tobytes())
+    return offsets
@@ -0,0 +1,18 @@
+from master_validator.declaration import predicate
+from master_validator.master_data import MasterDataManipulator, ComparisonInt
+
+
+def _keep_le(max_attack):
+    value = ComparisonInt(max_attack)
+    return lambda row: row.get_column_int('attack') <= value.value
+
+
+@predicate(_keep_le)
+def test_predicate_filter(master_data: MasterDataManipulator, max_attack):
+    """
+    テスト用フィルター
+    attackがmax_attack以下のレコードを残す
+    :return:
+    """
+    master_data.remove_gt('attack', ComparisonInt(max_attack))
+    return master_data
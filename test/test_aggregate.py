@@ -0,0 +1,103 @@
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from master_validator import compiler, validator
+from master_validator.aggregate import Aggregate, Count, Max, Sum, run_aggregates
+from master_validator.compiler import ValidatorExecutionError
+from master_validator.csv_reader import iter_csv_rows, read_csv
+from master_validator.master_data import ComparisonInt, MasterDataStream
+
+# item_testのmaxは 10, 10, 1, 100, 5, 100
+LINES = ['no_filter() > sum_validation(max, 0, 200)\n',
+         'no_filter() > min_validation(max, 2)\n',
+         'no_filter() > max_validation(max, 100)\n',
+         'no_filter() > count_validation(3)\n',
+         'no_filter() > group_count_validation(max, 2)\n',
+         'no_filter() > distinct_count_validation(max, 5)\n',
+         'equal_filter(max, 100) > sum_validation(max, 200, 200)\n']
+
+
+class TestAggregate(TestCase):
+    def setUp(self):
+        compiler.clear_memory_cache()
+        self.path = Path('fixtures/item_test.csv')
+        self.master = read_csv(self.path)
+
+    def test_validations(self):
+        test_cases = [
+            {'is_err': True, 'pks': [], 'msg': 'maxの合計が0以上200以下ではありません。226'},
+            {'is_err': True, 'pks': [3], 'msg': 'maxの最小値が2未満です。1'},
+            {'is_err': False, 'pks': [], 'msg': ''},
+            {'is_err': False, 'pks': [], 'msg': ''},
+            {'is_err': True, 'pks': [3, 5], 'msg': 'max毎に2件以上のレコードがありません。1:1件, 5:1件'},
+            {'is_err': True, 'pks': [], 'msg': 'maxの値が5種類以上ありません。4種類'},
+            {'is_err': False, 'pks': [], 'msg': ''},
+        ]
+        compiled = compiler.compile_lines('item_test', LINES)
+        result_list = compiled.execute(self.master)
+        # フィルター列が同じ集計のバリデーションは1回の走査でまとめて実行される
+        self.assertEqual(compiled.stats['fused_aggregates'], 5)
+        for line, tc, result in zip(LINES, test_cases, result_list):
+            with self.subTest(line=line):
+                self.assertEqual(result.is_err, tc['is_err'])
+                self.assertEqual([row.get_pk() for row in result.get_error_data()], tc['pks'])
+                self.assertIn(tc['msg'], result.message())
+
+        # 1行ずつ実行した場合とストリーム実行した場合も同じ結果になる
+        expect = [r.message() for r in result_list]
+        self.assertEqual([compiler.compile_lines('item_test', [line]).execute(self.master)[0].message()
+                          for line in LINES], expect)
+        self.assertTrue(compiled.is_streamable())
+        self.assertEqual([r.message() for r in compiled.execute_stream(self.path, 'item_test')], expect)
+        # ストリーム実行でも集計はまとめて1回だけcsvファイルを読む
+        self.assertEqual(compiled.stats, {'csv_scans': 3, 'fused_aggregates': 5})
+
+    def test_execute_compiled(self):
+        compiled = compiler.compile_lines('item_test', LINES)
+        expect = [r.message() for r in compiled.execute(self.master)]
+        self.addCleanup(validator.set_stream_min_bytes, validator.DEFAULT_STREAM_MIN_BYTES)
+        test_cases = [
+            # 既定ではマスタを1度だけ読み込み、集計を1回の走査でまとめて実行する
+            {'min_bytes': validator.DEFAULT_STREAM_MIN_BYTES, 'csv_scans': 0, 'read_csv': 1},
+            # ストリーム実行では、まとめた集計の5行と残りの2行で3回だけcsvファイルを読む
+            {'min_bytes': 0, 'csv_scans': 3, 'read_csv': 0},
+        ]
+        for tc in test_cases:
+            with self.subTest(min_bytes=tc['min_bytes']):
+                validator.set_stream_min_bytes(tc['min_bytes'])
+                with patch('master_validator.compiler.iter_csv_rows', wraps=iter_csv_rows) as iter_rows, \
+                        patch('master_validator.validator.read_csv', wraps=read_csv) as read:
+                    results = validator.execute_compiled(compiled, self.path, 'item_test')
+                self.assertEqual((iter_rows.call_count, read.call_count), (tc['csv_scans'], tc['read_csv']))
+                self.assertEqual(compiled.stats['fused_aggregates'], 5)
+                self.assertEqual([r.message() for r in results], expect)
+
+    def test_single_scan(self):
+        # ストリームは1度しか反復できないので、全ての集計が1回の走査で求まっていることが分かる
+        stream = MasterDataStream(iter_csv_rows(self.path), 'item_test')
+
+        def check(master_name, groups):
+            return {key: accumulator.value for key, accumulator in groups.items()}
+
+        checks = run_aggregates(stream, [Aggregate((), Count, check),
+                                         Aggregate(('max',), Count, check),
+                                         Aggregate((), lambda: Sum('max'), check),
+                                         Aggregate(('max',), lambda: Max('id'), check)])
+        self.assertEqual(checks, [{(): 6}, {(10,): 2, (1,): 1, (100,): 2, (5,): 1}, {(): 226},
+                                  {(10,): 2, (1,): 3, (100,): 6, (5,): 5}])
+
+    def test_empty(self):
+        master = self.master.view()
+        master.remove_gt('id', ComparisonInt('0'))
+        lines = ['no_filter() > sum_validation(max, 1, 10)\n', 'no_filter() > min_validation(max, 2)\n',
+                 'no_filter() > group_count_validation(max, 2)\n']
+        self.assertEqual([r.is_err for r in compiler.compile_lines('item_test', lines).execute(master)],
+                         [True, False, False])
+
+    def test_error_line(self):
+        lines = ['no_filter() > sum_validation(max, 0, 200)\n', 'no_filter() > min_validation(max, a)\n']
+        # まとめた実行で失敗しても、失敗した行が分かる
+        with self.assertRaises(ValidatorExecutionError) as cm:
+            compiler.compile_lines('item_test', lines).execute(self.master)
+        self.assertEqual(cm.exception.validator, 'no_filter() > min_validation(max, a)')
@@ -0,0 +1,30 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from benchmark.generator import ColumnSpec, generate_master, generate_validator
+from benchmark.run import compare
+from master_validator import compiler
+from master_validator.csv_reader import read_csv
+
+
+class TestBenchmark(TestCase):
+    def test_generate(self):
+        columns = [ColumnSpec('type', 'int', 'constant'), ColumnSpec('start_data', 'datetime', 'zipf', 3)]
+        with tempfile.TemporaryDirectory() as work_dir:
+            csv_path = Path(work_dir, 'csv', 'bench.csv')
+            generate_master(csv_path, 50, columns, seed=1)
+            master = read_csv(csv_path)
+            self.assertEqual(master.count(), 50)
+            self.assertEqual({row.get_column_int('type') for row in master.all()}, {1})
+
+            validator_path = Path(work_dir, 'validator', 'bench.txt')
+            generate_validator(validator_path, columns)
+            lines = validator_path.read_text().splitlines(keepends=True)
+            compiled = compiler.compile_lines('bench', lines)
+            self.assertEqual(len(compiled.execute(master)), len(lines))
+
+    def test_compare(self):
+        baseline = {'results': {'1000': {'read_csv': 1.0, 'lexer': 1.0}}}
+        current = {'results': {'1000': {'read_csv': 1.5, 'lexer': 1.1, 'validate_all': 1.0}}}
+        self.assertEqual([(r['metric'], r['ratio']) for r in compare(current, baseline, 1.2)], [('read_csv', 1.5)])
@@ -0,0 +1,129 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from master_validator import compiler, validator
+from master_validator.csv_reader import read_csv
+from master_validator.lexer import ValidatorSyntaxError
+from master_validator.parser import FusedFilter
+
+
+class TestCompiler(TestCase):
+    def setUp(self):
+        compiler.clear_memory_cache()
+        self.master = read_csv(Path('fixtures/character/character_test.csv'))
+        self.lines = ['test_arg0_filter() > test_arg0_validation()\n',
+                      'test_arg1_filter(2) > test_arg1_validation(6)\n']
+
+    def test_execute(self):
+        compiled = compiler.compile_lines('character_test', self.lines, 'test.command')
+        self.assertEqual([str(v) for v in compiled.validators],
+                         ['test_arg0_filter() > test_arg0_validation()',
+                          'test_arg1_filter(2) > test_arg1_validation(6)'])
+
+        result_list = compiled.execute(self.master)
+        self.assertEqual([r.is_err for r in result_list], [True, True])
+        self.assertEqual(result_list[0].get_error_data(), [self.master.find_by_pk(1)])
+        # 各行の絞り込みは元のマスタに影響しない
+        self.assertEqual(self.master.count(), 6)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            compiled = compiler.load_compiled('character_test', self.lines, 'test.command', cache_dir)
+            self.assertIs(compiler.load_compiled('character_test', self.lines, 'test.command'), compiled)
+            self.assertEqual(len(list(Path(cache_dir).glob('*.pickle'))), 1)
+
+            # ディスクキャッシュから読み込む
+            compiler.clear_memory_cache()
+            loaded = compiler.load_compiled('character_test', self.lines, 'test.command', cache_dir)
+            self.assertIsNot(loaded, compiled)
+            self.assertEqual([str(v) for v in loaded.validators], [str(v) for v in compiled.validators])
+            self.assertEqual([r.is_err for r in loaded.execute(self.master)], [True, True])
+
+            # 内容が変わればキャッシュキーも変わる
+            other = compiler.load_compiled('character_test', self.lines[:1], 'test.command', cache_dir)
+            self.assertEqual(len(other.validators), 1)
+            self.assertEqual(len(list(Path(cache_dir).glob('*.pickle'))), 2)
+
+            # 内容が同じでもバリデーター名が異なれば別のキャッシュにする
+            renamed = compiler.load_compiled('character_test2', self.lines, 'test.command', cache_dir)
+            self.assertIsNot(renamed, compiled)
+            self.assertEqual(renamed.name, 'character_test2')
+
+    def test_command_version(self):
+        version = compiler.command_version('test.command')
+        # ファイルが変わっていなければソースを読み直さない
+        with patch.object(Path, 'read_bytes') as read_bytes:
+            self.assertEqual(compiler.command_version('test.command'), version)
+            compiler.load_compiled('character_test', self.lines, 'test.command')
+        read_bytes.assert_not_called()
+
+    def test_execute_stream(self):
+        lines = ['equal_filter(max, 100) > count_validation(3)\n',
+                 'no_filter() > time_0sec_validation()\n']
+        compiled = compiler.compile_lines('item_test', lines)
+        self.assertTrue(compiled.is_streamable())
+        self.assertFalse(compiler.compile_lines('character_test', self.lines, 'test.command').is_streamable())
+
+        path = Path('fixtures/item_test.csv')
+        expect = [r.message() for r in compiled.execute(read_csv(path))]
+        self.assertEqual([r.message() for r in compiled.execute_stream(path, 'item_test')], expect)
+
+        # ストリーム実行は設定したサイズ以上のcsvファイルだけで行い、既定ではメモリに読み込んで実行する
+        self.addCleanup(validator.set_stream_min_bytes, validator.DEFAULT_STREAM_MIN_BYTES)
+        test_cases = [
+            {'min_bytes': validator.DEFAULT_STREAM_MIN_BYTES, 'streamed': False},
+            {'min_bytes': None, 'streamed': False},
+            {'min_bytes': 0, 'streamed': True},
+        ]
+        for tc in test_cases:
+            with self.subTest(min_bytes=tc['min_bytes']):
+                validator.set_stream_min_bytes(tc['min_bytes'])
+                with patch.object(compiled, 'execute_stream', wraps=compiled.execute_stream) as execute_stream:
+                    results = validator.execute_compiled(compiled, path, 'item_test')
+                self.assertEqual(execute_stream.called, tc['streamed'])
+                self.assertEqual([r.message() for r in results], expect)
+
+    def test_prefix_sharing(self):
+        lines = ['test_arg1_filter(2) > test_arg2_filter(2, 5) > test_arg0_validation()\n',
+                 'test_arg1_filter(2) > test_arg2_filter(2, 5) > test_arg1_validation(3)\n',
+                 'test_arg1_filter(2) > test_arg1_validation(6)\n',
+                 'test_arg1_filter(3) > test_arg1_validation(4)\n']
+        compiled = compiler.compile_lines('character_test', lines, 'test.command')
+        result_list = compiled.execute(self.master)
+        self.assertEqual([r.is_err for r in result_list], [False, False, True, False])
+        self.assertEqual(compiled.stats,
+                         {'filter_evaluations': 3, 'saved_filter_evaluations': 3, 'fused_aggregates': 0})
+
+    def test_fused_filter(self):
+        lines = ['test_predicate_filter(5) > test_predicate_filter(3) > test_arg1_validation(3)\n',
+                 'test_predicate_filter(5) > test_arg1_filter(2) > test_predicate_filter(3) > test_arg1_validation(3)\n']
+        compiled = compiler.compile_lines('character_test', lines, 'test.command')
+        self.assertIsInstance(compiled.validators[0].filters[0], FusedFilter)
+        self.assertEqual(len(compiled.validators[0].filters), 1)
+        self.assertEqual(len(compiled.validators[1].filters), 3)
+        self.assertEqual(str(compiled.validators[0]),
+                         'test_predicate_filter(5) > test_predicate_filter(3) > test_arg1_validation(3)')
+        self.assertEqual([r.is_err for r in compiled.execute(self.master)], [False, True])
+
+    def test_syntax_errors(self):
+        lines = ['test_arg0_filter() > test_arg0_validation()\n',
+                 'test_arg0_filter() test_arg0_validation()\n',
+                 'test_arg1_filter(2 > test_arg1_validation(6)\n',
+                 '\n',
+                 'test_arg0_filter() > test_arg0_validation() ? unknown_filter(\n',
+                 'unknown_filter() > test_arg0_validation()\n',
+                 'test_arg0_filter() > test_arg1_validation(6\n']
+        # 全ての行の構文エラーを行番号と列番号付きでまとめて報告する
+        with self.assertLogs(level='ERROR'):
+            with self.assertRaises(ValidatorSyntaxError) as cm:
+                compiler.compile_lines('character_test', lines, 'test.command')
+        self.assertEqual([str(e) for e in cm.exception.errors],
+                         ['2:20: unexpected token=<test_arg0_validation>.',
+                          '3:20: unexpected token=<>>.',
+                          '4:1: validator is empty.',
+                          '5:45: invalid token. token=<?>',
+                          '6:1: unknown command. token=<unknown_filter>',
+                          '7:44: unexpected end of line.'])
+        self.assertIn('character_test:2:20: unexpected token=<test_arg0_validation>.', str(cm.exception))
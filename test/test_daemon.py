@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+from urllib.request import Request, urlopen
+
+from master_validator.daemon import ValidationDaemon, create_server
+from master_validator.validator import validate_all
+
+
+def _touch(path: Path, text: str):
+    path.write_text(text)
+    # 更新日時の分解能が粗いファイルシステムでも変更を検出できるようにする
+    stat = path.stat()
+    ns = stat.st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(ns, ns))
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.csv_dir = self.tmp_dir.joinpath('csv')
+        self.validator_dir = self.tmp_dir.joinpath('validator')
+        shutil.copytree('fixtures', self.csv_dir)
+        shutil.copytree('validator', self.validator_dir)
+        self.daemon = ValidationDaemon(self.csv_dir, self.validator_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_refresh(self):
+        expect = [r.message() for r in validate_all(self.csv_dir)]
+        self.assertEqual(self.daemon.refresh(), ['character_test', 'item_test'])
+        self.assertEqual([r.message() for r in self.daemon.results()], expect)
+        self.assertEqual(self.daemon.refresh(), [])
+
+        # 変更したマスタだけを再検証する
+        item_path = self.csv_dir.joinpath('item_test.csv')
+        _touch(item_path, item_path.read_text() + '7,"アイテム7",100,"2022-05-01 14:00:00"\n')
+        self.assertEqual(self.daemon.refresh(), ['item_test'])
+        self.assertEqual([r.is_err for r in self.daemon.results()], [True, False, False])
+
+        # バリデーターファイルは追加された行だけを実行する
+        validator_path = self.validator_dir.joinpath('item_test.txt')
+        _touch(validator_path, validator_path.read_text() + 'no_filter() > reference_validation(id, character_test)\n')
+        self.assertEqual(self.daemon.refresh(), ['item_test'])
+        self.assertEqual([r.is_err for r in self.daemon.results()], [True, False, False, True])
+        self.assertEqual(len(self.daemon.results(errors_only=True)), 2)
+
+        # 参照先のマスタが変わった場合は参照する行も再実行する
+        character_path = self.csv_dir.joinpath('character', 'character_test.csv')
+        _touch(character_path, character_path.read_text() + '7,"キャラ7",7,10,"2022-05-05 14:00:00"\n')
+        self.assertEqual(self.daemon.refresh(), ['character_test', 'item_test'])
+        self.assertEqual([r.is_err for r in self.daemon.results()], [True, False, False, False])
+
+        # 壊れたcsvは結果を返さず、失敗として報告する
+        _touch(item_path, '"name"\n"x"\n')
+        self.daemon.refresh()
+        self.assertEqual([r._master_name for r in self.daemon.results()], ['character_test'])
+        self.assertIn('item_test', self.daemon.status()['failures'])
+
+    def test_server(self):
+        self.daemon.refresh()
+        server = create_server(self.daemon, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}'
+            with urlopen(f'{url}/results?errors_only=1') as res:
+                body = json.loads(res.read())
+            self.assertEqual([(r['master'], r['validation']) for r in body['results']],
+                             [('character_test', 'time_0sec_validation'), ('item_test', 'count_validation')])
+            with urlopen(Request(f'{url}/refresh', method='POST')) as res:
+                self.assertEqual(json.loads(res.read()), {'validated': []})
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,112 @@
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import compiler
+from master_validator.csv_reader import read_csv
+from master_validator.diff import diff_rows, execute_diff, load_baseline, save_baseline
+from master_validator.registry import MasterRegistry
+
+BASELINE_DIR = Path('fixtures/character')
+
+LINES = ['no_filter() > time_0sec_validation()\n',
+         'no_filter() > max_validation(attack, 6)\n',
+         'no_filter() > count_validation(3)\n']
+
+# 1は秒を0に直し、2は名前だけ、6は名前だけを変更し、5を削除して7を追加する
+CURRENT = '''"id","name","attack","defence","start_data"
+1,"キャラ1",1,11,"2022-05-01 14:00:00"
+2,"キャラ2改",2,12,"2022-05-01 14:00:00"
+3,"キャラ3",3,13,"2022-05-02 14:00:00"
+4,"キャラ4",4,14,"2022-05-05 14:00:00"
+6,"キャラ6改",6,10,"2022-05-05 14:59:59"
+7,"キャラ7",7,10,"2022-05-05 14:00:30"
+'''
+
+
+class TestDiff(TestCase):
+    def setUp(self):
+        compiler.clear_memory_cache()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.csv_dir = self.tmp.joinpath('csv')
+        self.csv_dir.mkdir()
+        self.path = self.csv_dir.joinpath('character_test.csv')
+        self.path.write_text(CURRENT)
+
+    def test_diff_rows(self):
+        baseline = read_csv(BASELINE_DIR.joinpath('character_test.csv'))._store
+        diff = diff_rows(baseline, read_csv(self.path)._store)
+        self.assertEqual((sorted(diff.added), sorted(diff.changed), sorted(diff.removed)), ([7], [1, 2, 6], [5]))
+        self.assertEqual(diff_rows(baseline, baseline), ([], [], []))
+
+    def test_execute_diff(self):
+        compiled = compiler.compile_lines('character_test', LINES)
+        results = execute_diff(compiled, self.path, 'character_test', None, MasterRegistry(self.csv_dir), None,
+                               BASELINE_DIR)
+        test_cases = [
+            # 変更した行だけを検証する。1は直り、6は以前からのエラー、7は新しいエラー
+            {'is_err': True, 'pks': [6, 7], 'existing': {6}, 'fixed': 1,
+             'msg': 'diff=<new 1, existing 1, fixed 1> new_error_pks=<[7]> changed_rows=<4/6>'},
+            # 集計はマスタ全体で検証する
+            {'is_err': True, 'pks': [7], 'existing': set(), 'fixed': 0,
+             'msg': 'diff=<new 1, existing 0, fixed 0> new_error_pks=<[7]>'},
+            {'is_err': False, 'pks': [], 'existing': set(), 'fixed': 0, 'msg': ''},
+        ]
+        for line, tc, result in zip(LINES, test_cases, results):
+            with self.subTest(line=line):
+                self.assertEqual(result.is_err, tc['is_err'])
+                self.assertEqual([row.get_pk() for row in result.get_error_data()], tc['pks'])
+                self.assertEqual(set(result.existing_error_pks), tc['existing'])
+                self.assertEqual(result.fixed_error_count, tc['fixed'])
+                self.assertIn(tc['msg'], result.message())
+        self.assertEqual(results[0].to_dict()['new_error_pks'], [7])
+        self.assertEqual(pickle.loads(pickle.dumps(results[0])).message(), results[0].message())
+
+    def test_baseline_snapshot(self):
+        baseline_dir = self.tmp.joinpath('baseline')
+        save_baseline(BASELINE_DIR, baseline_dir)
+        self.assertTrue(baseline_dir.joinpath('character_test.snapshot').exists())
+        self.assertEqual(len(load_baseline(baseline_dir, 'character_test')), 6)
+        self.assertIsNone(load_baseline(baseline_dir, 'item_test'))
+
+        # スナップショットとcsvファイルのどちらをベースラインにしても同じ結果になる
+        compiled = compiler.compile_lines('character_test', LINES)
+        registry = MasterRegistry(self.csv_dir)
+        expect = [r.message() for r in execute_diff(compiled, self.path, 'character_test', None, registry, None,
+                                                     BASELINE_DIR)]
+        self.assertEqual([r.message() for r in execute_diff(compiled, self.path, 'character_test', None, registry,
+                                                            None, baseline_dir)], expect)
+
+    def test_no_baseline(self):
+        # ベースラインに無いマスタは全ての行が新しい
+        empty = self.tmp.joinpath('empty')
+        empty.mkdir()
+        compiled = compiler.compile_lines('character_test', LINES[:1])
+        result = execute_diff(compiled, self.path, 'character_test', None, MasterRegistry(self.csv_dir), None,
+                              empty)[0]
+        self.assertIn('diff=<new 2, existing 0, fixed 0> new_error_pks=<[6, 7]> changed_rows=<6/6>',
+                      result.message())
+
+    def test_reference_changed(self):
+        # 参照先のitem_testからid=3を削除し、character_testは変更しない
+        baseline_dir = self.tmp.joinpath('baseline')
+        baseline_dir.mkdir()
+        shutil.copy(BASELINE_DIR.joinpath('character_test.csv'), baseline_dir)
+        shutil.copy('fixtures/item_test.csv', baseline_dir)
+        shutil.copy(BASELINE_DIR.joinpath('character_test.csv'), self.path)
+        item_lines = Path('fixtures/item_test.csv').read_text().splitlines(keepends=True)
+        self.csv_dir.joinpath('item_test.csv').write_text(''.join(line for line in item_lines
+                                                                  if not line.startswith('3,')))
+
+        compiled = compiler.compile_lines('character_test', ['no_filter() > reference_validation(attack, item_test)\n'])
+        result = execute_diff(compiled, self.path, 'character_test', None, MasterRegistry(self.csv_dir), None,
+                              baseline_dir)[0]
+        # 変更されていない行も検証し、ベースラインの参照先ではエラーでなかったので新しいエラーになる
+        self.assertTrue(result.is_err)
+        self.assertEqual([row.get_pk() for row in result.get_error_data()], [3])
+        self.assertIn('diff=<new 1, existing 0, fixed 0> new_error_pks=<[3]>', result.message())
+        self.assertNotIn('changed_rows', result.message())
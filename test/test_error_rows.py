@@ -0,0 +1,103 @@
+import gc
+import pickle
+import weakref
+from array import array
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import parser
+from master_validator.csv_reader import read_csv
+from master_validator.error_rows import ErrorRows, ListRows, TableRows, compact
+from master_validator.master_data import MasterRow
+from master_validator.parser import RowsResult, set_message_rows
+
+
+def _store_result(master_data, pks):
+    rows = [row for row in master_data.all() if row.get_pk() in pks]
+    return RowsResult(True, master_data.master_name, 'x_validation', 'error', rows)
+
+
+class TestErrorRows(TestCase):
+    def setUp(self):
+        self.master_data = read_csv(Path('fixtures/character/character_test.csv'))
+
+    def test_compact(self):
+        store_rows = list(self.master_data.all())
+        test_cases = [
+            {'rows': [], 'expect': TableRows},
+            {'rows': store_rows, 'expect': TableRows},
+            {'rows': [MasterRow({'id': '1', 'a': 'x'}), MasterRow({'id': '2', 'a': 'y'})], 'expect': TableRows},
+            # カラムの異なる行が混ざっている場合は行のリストで持つ
+            {'rows': [MasterRow({'id': '1'}), MasterRow({'id': '2', 'a': 'y'})], 'expect': ListRows},
+            {'rows': store_rows[:1] + [MasterRow({'id': '9'})], 'expect': ListRows},
+        ]
+        for tc in test_cases:
+            with self.subTest(rows=tc['rows']):
+                rows = compact(tc['rows'])
+                self.assertIsInstance(rows, tc['expect'])
+                self.assertEqual(rows.rows(), tc['rows'])
+                self.assertEqual(list(rows.pks()), [row.get_pk() for row in tc['rows']])
+                # マスタのストアへの参照は持たない
+                self.assertTrue(all(row._store is None for row in rows.rows()))
+                self.assertEqual(rows.head(1).rows(), tc['rows'][:1])
+
+    def test_pks(self):
+        store_rows = list(self.master_data.all())
+        test_cases = [
+            {'rows': store_rows, 'expect': array},
+            {'rows': [MasterRow({'id': '1'}, _pk=('1', 'a')), MasterRow({'id': '2'}, _pk=('2', 'b'))], 'expect': list},
+            {'rows': [MasterRow({'id': str(2 ** 64)})], 'expect': list},
+        ]
+        for tc in test_cases:
+            with self.subTest(rows=tc['rows']):
+                rows = compact(tc['rows'])
+                # 整数のpkはarrayで、それ以外はリストで持つ
+                self.assertIsInstance(rows._pks, tc['expect'])
+                self.assertEqual(list(rows.pks()), [row.get_pk() for row in tc['rows']])
+                self.assertEqual([row.get_pk() for row in rows.rows()], [row.get_pk() for row in tc['rows']])
+        with self.assertRaises(TypeError):
+            ErrorRows()
+
+    def test_pickle(self):
+        result = _store_result(self.master_data, {2, 5, 6})
+        self.assertIsInstance(result._err_rows, TableRows)
+        restored = pickle.loads(pickle.dumps(result))
+        self.assertIsInstance(restored._err_rows, TableRows)
+        self.assertEqual(restored.message(), result.message())
+        self.assertEqual(restored.to_dict(), result.to_dict())
+        self.assertEqual([row.get_pk() for row in restored.get_error_data()], [2, 5, 6])
+
+        # err_rowsをリストで持っていた古いpickleも読み込める
+        old = RowsResult.__new__(RowsResult)
+        state = dict(result.__dict__)
+        state['err_rows'] = state.pop('_err_rows').rows()
+        old.__setstate__(state)
+        self.assertEqual(old.message(), result.message())
+
+    def test_message_rows(self):
+        self.addCleanup(set_message_rows, parser.DEFAULT_MESSAGE_ROWS)
+        result = _store_result(self.master_data, {1, 2, 3, 4, 5})
+        test_cases = [
+            {'rows': None, 'shown': 5, 'suffix': "'2022-05-05 14:00:00'})]>"},
+            {'rows': 2, 'shown': 2, 'suffix': "})]> error_count=<5>"},
+            {'rows': 0, 'shown': 0, 'suffix': "error_master_data=<[]> error_count=<5>"},
+        ]
+        for tc in test_cases:
+            with self.subTest(rows=tc['rows']):
+                set_message_rows(tc['rows'])
+                msg = result.additional_msg()
+                self.assertEqual(msg.count('MasterRow('), tc['shown'])
+                self.assertTrue(msg.endswith(tc['suffix']), msg)
+                # 出力には全ての行を書き出す
+                self.assertEqual(len(result.to_dict()['error_rows']), 5)
+        self.assertEqual([row.get_pk() for row in result.error_rows_page(1, 2)], [2, 3])
+        self.assertEqual([row.get_pk() for row in result.error_rows_page(4)], [5])
+
+    def test_release_store(self):
+        # 結果を保持していても、エラーになったマスタのストアは解放される
+        store = weakref.ref(self.master_data._store)
+        result = _store_result(self.master_data, {2})
+        del self.master_data
+        gc.collect()
+        self.assertIsNone(store())
+        self.assertEqual([row.get_pk() for row in result.get_error_data()], [2])
@@ -0,0 +1,58 @@
+import contextlib
+import io
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import csv_reader
+from master_validator.incremental import validate_incremental
+from master_validator.main import parse_args
+from master_validator.validator import validate_all
+
+
+class TestIncremental(TestCase):
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.csv_dir = self.tmp_dir.joinpath('csv')
+        shutil.copytree('fixtures', self.csv_dir)
+        self.state_dir = self.tmp_dir.joinpath('state')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_validate_incremental(self):
+        expect = [r.message() for r in validate_all(self.csv_dir)]
+
+        with self.assertLogs(level='INFO') as log:
+            self.assertEqual([r.message() for r in validate_incremental(self.csv_dir, self.state_dir)], expect)
+        self.assertIn('executed=3 reused=0', log.output[-1])
+
+        with self.assertLogs(level='INFO') as log:
+            self.assertEqual([r.message() for r in validate_incremental(self.csv_dir, self.state_dir)], expect)
+        self.assertIn('executed=0 reused=3', log.output[-1])
+
+        # 変更したマスタのバリデータだけを再実行する
+        item_path = self.csv_dir.joinpath('item_test.csv')
+        item_path.write_text(item_path.read_text() + '7,"アイテム7",100,"2022-05-01 14:00:00"\n')
+        with self.assertLogs(level='INFO') as log:
+            result_list = validate_incremental(self.csv_dir, self.state_dir)
+        self.assertIn('executed=2 reused=1', log.output[-1])
+        self.assertEqual([r.is_err for r in result_list], [True, False, False])
+
+        # 主キーの設定を変えたマスタのバリデータも再実行する
+        self.addCleanup(csv_reader.set_primary_keys, {})
+        csv_reader.set_primary_keys({'item_test': ['id', 'name']})
+        with self.assertLogs(level='INFO') as log:
+            validate_incremental(self.csv_dir, self.state_dir)
+        self.assertIn('executed=2 reused=1', log.output[-1])
+
+    def test_parse_args(self):
+        self.assertEqual(parse_args(['--incremental', 'state', '--cache-dir', 'cache']).incremental, 'state')
+        # インクリメンタル実行で無視されるオプションはエラーにする
+        for argv in [['--incremental', 'state', '-j', '2'], ['--incremental', 'state', '--trace', 'trace.json'],
+                     ['--incremental', 'state', '--sample', '10'], ['--incremental', 'state', '--baseline', 'base'],
+                     ['--sample', '10', '--baseline', 'base']]:
+            with self.subTest(argv=argv):
+                with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                    parse_args(argv)
@@ -1,7 +1,7 @@
 import os
 from unittest import TestCase
 
-from master_validator.lexer import analyze
+from master_validator.lexer import Token, ValidatorSyntaxError, analyze, invalid_tokens, lexer, tokenize
 
 
 class TestLexerMethods(TestCase):
@@ -50,3 +50,28 @@ class TestLexerMethods(TestCase):
             with self.subTest(tc['name']):
                 with self.assertRaises(tc['expect']):
                     analyze(tc['arg'])
+
+    def test_tokenize(self):
+        tokens = tokenize('equal_filter(name, "キャラ 1") > # コメント\n  max_validation(max, -1.5)')
+        self.assertEqual(tokens[:6], [Token('word', 'equal_filter', 1, 1), Token('symbol', '(', 1, 13),
+                                      Token('word', 'name', 1, 14), Token('symbol', ',', 1, 18),
+                                      Token('word', 'キャラ 1', 1, 20), Token('symbol', ')', 1, 27)])
+        self.assertEqual(tokens[7:10], [Token('word', 'max_validation', 2, 3), Token('symbol', '(', 2, 17),
+                                        Token('word', 'max', 2, 18)])
+        self.assertEqual(tokens[-2], Token('word', '-1.5', 2, 23))
+        self.assertEqual(invalid_tokens(tokens), [])
+
+    def test_invalid_tokens(self):
+        test_cases = [
+            {'arg': 'a_filter(1) ! b_validation()', 'expect': [Token('invalid', '!', 1, 13)]},
+            {'arg': 'a_filter(1;2) > b_validation(@@)',
+             'expect': [Token('invalid', ';', 1, 11), Token('invalid', '@@', 1, 30)]},
+            {'arg': 'a_filter("x) > b_validation()', 'expect': [Token('unterminated', '"x) > b_validation()', 1, 10)]},
+        ]
+        for tc in test_cases:
+            with self.subTest(tc['arg']):
+                self.assertEqual(invalid_tokens(tokenize(tc['arg'])), tc['expect'])
+                with self.assertRaises(ValidatorSyntaxError) as cm:
+                    lexer(tc['arg'])
+                self.assertEqual([(e.line, e.column) for e in cm.exception.errors],
+                                 [(t.line, t.column) for t in tc['expect']])
@@ -0,0 +1,84 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import vectorized
+from master_validator.csv_reader import read_csv
+from master_validator.mapped_csv import MappedStore, scan_row_offsets
+from master_validator.master_data import ComparisonInt
+
+
+class TestMappedCsv(TestCase):
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        vectorized.set_enabled(True)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_scan_row_offsets(self):
+        table = [
+            {'name': '空', 'data': b'', 'expect': []},
+            {'name': '末尾の改行なし', 'data': b'a\nb', 'expect': [0, 2, 2, 3]},
+            {'name': '引用符内の改行', 'data': b'a,b\n"x\ny",2\r\n', 'expect': [0, 4, 4, 13]},
+            {'name': 'エスケープした引用符', 'data': b'"q""\n"\n4\n', 'expect': [0, 7, 7, 9]},
+            {'name': '空行', 'data': b'a\n\n\r\nb\n', 'expect': [0, 2, 5, 7]},
+        ]
+        for enabled in [True, False]:
+            vectorized.set_enabled(enabled)
+            for tc in table:
+                with self.subTest(f'{tc["name"]} vectorized={vectorized.is_enabled()}'):
+                    self.assertEqual(list(scan_row_offsets(tc['data'])), tc['expect'])
+            with self.subTest(f'閉じていない引用符 vectorized={vectorized.is_enabled()}'):
+                with self.assertRaises(ValueError):
+                    scan_row_offsets(b'a\n"b\n')
+
+    def test_same_as_read_csv(self):
+        duplicate = self.tmp_dir.joinpath('duplicate.csv')
+        duplicate.write_text('"id","name","start_data"\n"3","a","2022-05-01 14:00:00"\n"4","b",""\n'
+                             '"5","c",""\n"6","d",""\n"3","e","2022-05-02 14:00:00"\n')
+        for path in [Path('fixtures/item_test.csv'), Path('fixtures/character/character_test.csv'), duplicate]:
+            with self.subTest(path=path):
+                expect = read_csv(path)
+                master_data = read_csv(path, mapped=True)
+                self.assertIsInstance(master_data._store, MappedStore)
+                self.assertEqual(master_data.count(), expect.count())
+                self.assertEqual(master_data._store.duplicates, expect._store.duplicates)
+                self.assertEqual([row.row for row in master_data.all()], [row.row for row in expect.all()])
+                self.assertEqual([row.get_pk() for row in master_data.all()], [row.get_pk() for row in expect.all()])
+                self.assertEqual(master_data.find_by_pk(3), expect.find_by_pk(3))
+                self.assertEqual(master_data.find_by_pk(3).get_column_datetime('start_data'),
+                                 expect.find_by_pk(3).get_column_datetime('start_data'))
+                for view in [master_data.view(), expect.view()]:
+                    view.remove_lt('id', ComparisonInt('3'))
+                self.assertEqual([row.get_pk() for row in view.all()], [3, 4, 5, 6])
+
+    def test_lazy_decode(self):
+        path = self.tmp_dir.joinpath('quoted.csv')
+        path.write_text('"id","name","memo"\n"1","a","1行目\n2行目"\n\n"2","b"\n', encoding='utf-8')
+        store = MappedStore(path, encoding='utf-8')
+        # 行の位置だけを求め、値もpkの索引もまだ作っていない
+        self.assertEqual(store.header, ['id', 'name', 'memo'])
+        self.assertEqual((store._columns, store._pk_index, store._last_pos), ({}, None, -1))
+
+        # 行数を求めるときに主キーの値だけをデコードしてpkの索引を作る
+        self.assertEqual(len(store), 2)
+        self.assertEqual((store._columns, store._pk_index, store._last_pos), ({}, {1: 0, 2: 1}, -1))
+        self.assertEqual(store.value(0, 'memo'), '1行目\n2行目')
+        self.assertEqual(store.row_dict(1), {'id': '2', 'name': 'b', 'memo': None})
+        self.assertEqual((store._columns, store.pk_at(1), store.position_of(2)), ({}, 2, 1))
+        store.close()
+
+    def test_duplicate_pk(self):
+        path = self.tmp_dir.joinpath('duplicate.csv')
+        path.write_text('id,name\n1,a\n2,b\n1,c\n')
+        master_data = read_csv(path, mapped=True)
+        self.assertIsNone(master_data._store._pk_index)
+        # read_csv()と同じく、同じpkの行は最初の行の位置に最後の行の値を残して1行にする
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(master_data.count(), 2)
+        self.assertEqual(master_data._store.duplicates, {1: 1})
+        self.assertEqual([row.row for row in master_data.all()], [{'id': '1', 'name': 'c'}, {'id': '2', 'name': 'b'}])
+        self.assertEqual(master_data.find_by_pk(1).row, {'id': '1', 'name': 'c'})
+        self.assertEqual(master_data._store.column('name')[0], 'c')
@@ -0,0 +1,133 @@
+from pathlib import Path
+from unittest import TestCase, skipUnless
+
+from master_validator import vectorized
+from master_validator.csv_reader import read_csv
+from master_validator.master_data import ComparisonDatetime, ComparisonFloat, ComparisonInt, ComparisonPredicate, MasterRow
+
+
+class TestMasterDataManipulator(TestCase):
+    def setUp(self):
+        self.test_data_path = Path('fixtures/character/character_test.csv')
+
+    def test_columnar_store(self):
+        master = read_csv(self.test_data_path)
+        store = master._store
+        self.assertEqual(store.header, ['id', 'name', 'attack', 'defence', 'start_data'])
+        self.assertTrue(store.column('attack').is_int)
+        self.assertFalse(store.column('name').is_int)
+        self.assertEqual(master.count(), 6)
+        self.assertEqual(master.find_by_pk(3), MasterRow(
+            {'id': '3', 'name': 'キャラ3', 'attack': '3', 'defence': '13', 'start_data': '2022-05-02 14:00:00'}))
+        self.assertEqual([row.get_pk() for row in master.all()], [1, 2, 3, 4, 5, 6])
+
+    def test_duplicate_pk_overwrites(self):
+        master = read_csv(self.test_data_path)
+        master._store.append({'id': '2', 'name': 'x', 'attack': ' 9', 'defence': '0', 'start_data': ''})
+        self.assertEqual(len(master._store), 6)
+        self.assertEqual(master._store.value(1, 'attack'), ' 9')
+        self.assertEqual(master._store.value(0, 'attack'), '1')
+
+    def test_remove(self):
+        test_cases = [
+            {'name': 'remove_eq', 'method': 'remove_eq', 'value': '3', 'expect': [1, 2, 4, 5, 6]},
+            {'name': 'remove_not_eq', 'method': 'remove_not_eq', 'value': '3', 'expect': [3]},
+            {'name': 'remove_gt', 'method': 'remove_gt', 'value': '3', 'expect': [1, 2, 3]},
+            {'name': 'remove_lt', 'method': 'remove_lt', 'value': '3', 'expect': [3, 4, 5, 6]},
+            {'name': 'remove_ge', 'method': 'remove_ge', 'value': '3', 'expect': [1, 2]},
+            {'name': 'remove_le', 'method': 'remove_le', 'value': '3', 'expect': [4, 5, 6]},
+        ]
+        for tc in test_cases:
+            with self.subTest(tc['name']):
+                master = read_csv(self.test_data_path)
+                getattr(master, tc['method'])('attack', ComparisonInt(tc['value']))
+                self.assertEqual([row.get_pk() for row in master.all()], tc['expect'])
+                self.assertEqual(master.count(), len(tc['expect']))
+
+    def test_conversion_cache(self):
+        master = read_csv(self.test_data_path)
+        for _ in range(2):
+            dts = [row.get_column_datetime('start_data') for row in master.all()]
+        # 同じ文字列の変換結果は共有される
+        self.assertIs(dts[3], dts[4])
+        # 6行中、異なる文字列は5種類
+        self.assertEqual(master.conversion_cache.stats(), {'hits': 7, 'misses': 5})
+
+        with self.assertRaises(ValueError):
+            master.find_by_pk(1).get_column_int('name')
+        with self.assertRaises(ValueError):
+            master.find_by_pk(1).get_column_int('name')
+
+    def test_view(self):
+        master = read_csv(self.test_data_path)
+        view1 = master.view()
+        view1.remove_gt('attack', ComparisonInt('3'))
+        view2 = view1.view()
+        view2.remove_lt('attack', ComparisonInt('2'))
+        view3 = master.view()
+        view3.remove_eq('attack', ComparisonInt('2'))
+
+        self.assertEqual([row.get_pk() for row in master.all()], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([row.get_pk() for row in view1.all()], [1, 2, 3])
+        self.assertEqual([row.get_pk() for row in view2.all()], [2, 3])
+        self.assertEqual([row.get_pk() for row in view1.intersection(view3).all()], [1, 3])
+
+        with self.assertRaises(KeyError):
+            view2.find_by_pk(1)
+        with self.assertRaises(KeyError):
+            view2.remove_by_pk(1)
+        self.assertEqual(master.find_by_pk(1).get_pk(), 1)
+
+    def test_comparison(self):
+        test_cases = [
+            {'name': 'float', 'column': 'defence', 'value': ComparisonFloat('12.5'),
+             'expect': {'remove_eq': [1, 2, 3, 4, 5, 6], 'remove_gt': [1, 2, 6], 'remove_le': [3, 4, 5]}},
+            {'name': 'float eq', 'column': 'defence', 'value': ComparisonFloat('13'),
+             'expect': {'remove_not_eq': [3], 'remove_ge': [1, 2, 6], 'remove_lt': [3, 4, 5]}},
+            {'name': 'datetime', 'column': 'start_data', 'value': ComparisonDatetime('2022-05-05 14:00:00'),
+             'expect': {'remove_eq': [1, 2, 3, 6], 'remove_gt': [1, 2, 3, 4, 5], 'remove_le': [6]}},
+        ]
+        for enabled in [False, True]:
+            vectorized.set_enabled(enabled)
+            for tc in test_cases:
+                for method, expect in tc['expect'].items():
+                    with self.subTest(f'{tc["name"]} {method} vectorized={vectorized.is_enabled()}'):
+                        master = read_csv(self.test_data_path)
+                        getattr(master, method)(tc['column'], tc['value'])
+                        self.assertEqual([row.get_pk() for row in master.all()], expect)
+                        self.assertEqual(master.count(), len(expect))
+        vectorized.set_enabled(True)
+
+    def test_column_index(self):
+        for enabled in [False, True]:
+            vectorized.set_enabled(enabled)
+            with self.subTest(f'vectorized={vectorized.is_enabled()}'):
+                master = read_csv(self.test_data_path)
+                view = master.view()
+                view.remove_gt('attack', ComparisonInt('4'))
+                view.remove_not_eq('defence', ComparisonInt('12'))
+                self.assertEqual([row.get_pk() for row in view.all()], [2])
+                self.assertEqual(view.count(), 1)
+                # 索引は初回に作られ、他のビューと共有される
+                index = master._store.indexes[('attack', 'int')]
+                master.view().remove_le('attack', ComparisonInt('2'))
+                self.assertIs(master._store.indexes[('attack', 'int')], index)
+                # 変換できない値があるカラムは索引を作らず1行ずつ比較する
+                with self.assertRaises(ValueError):
+                    master.view().remove_eq('name', ComparisonInt('3'))
+                self.assertIsNone(master._store.indexes[('name', 'int')])
+        vectorized.set_enabled(True)
+
+    def test_keep_if(self):
+        master = read_csv(self.test_data_path)
+        evaluated = []
+
+        def keep_even(row):
+            evaluated.append(row.get_pk())
+            return row.get_pk() % 2 == 0
+
+        master.keep_if([ComparisonPredicate('attack', ComparisonInt('4'), 'lt'), keep_even,
+                        lambda row: row.get_column_int('defence') > 11])
+        self.assertEqual([row.get_pk() for row in master.all()], [2])
+        # 索引で絞り込んだ行だけを走査する
+        self.assertEqual(evaluated, [1, 2, 3])
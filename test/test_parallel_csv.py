@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import csv_reader
+from master_validator.csv_reader import _parse_csv, read_csv
+from master_validator.parallel_csv import chunk_ranges, parse_parallel
+
+CSV = ('"id","name","memo"\r\n'
+       '"1","a","x"\r\n'
+       '"2","b","改行を\n含む\n値"\r\n'
+       '\r\n'
+       '"3","c","""引用符"",\n"""\r\n'
+       '"2","b2","上書き"\r\n'
+       '"4","d",""\r\n'
+       '"5","e","1"\r\n'
+       '"1","a2","最後"')
+
+
+class TestParallelCsv(TestCase):
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.csv_path = self.tmp_dir.joinpath('drop.csv')
+        self.csv_path.write_bytes(CSV.encode())
+
+    def tearDown(self):
+        csv_reader.set_parse_jobs(None)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_chunk_ranges(self):
+        data = CSV.encode()
+        header_end = data.index(b'\r\n') + 2
+        for chunks in range(1, 12):
+            with self.subTest(chunks=chunks):
+                header, ranges = chunk_ranges(data, chunks)
+                self.assertEqual(header, (0, header_end))
+                self.assertLessEqual(len(ranges), chunks)
+                # 範囲は隙間なく並び、引用符の中では切れない
+                self.assertEqual(ranges[0][0], header_end)
+                self.assertEqual(ranges[-1][1], len(data))
+                for (_, end), (begin, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, begin)
+                    self.assertEqual(data[:begin].count(b'"') % 2, 0)
+                    self.assertEqual(data[begin - 1:begin], b'\n')
+
+    def test_parse_parallel(self):
+        expect = _parse_csv(self.csv_path)
+        self.assertEqual(expect.duplicates, {1: 1, 2: 1})
+        for jobs in [1, 2, 3, 8]:
+            with self.subTest(jobs=jobs):
+                store = parse_parallel(self.csv_path, jobs)
+                self.assertEqual(store.to_snapshot(), expect.to_snapshot())
+                self.assertEqual(store.row_dict(store.position_of(3))['memo'], '"引用符",\n"')
+
+    def test_read_csv(self):
+        csv_reader.set_parse_jobs(3, 0)
+        with self.assertLogs(level='WARNING'):
+            master_data = read_csv(self.csv_path)
+        self.assertEqual([row.get_pk() for row in master_data.all()], [1, 2, 3, 4, 5])
+        self.assertEqual(master_data.find_by_pk(2).row['name'], 'b2')
+        self.assertEqual(master_data.duplicate_keys(), {1: 1, 2: 1})
+
+    def test_header_only(self):
+        self.csv_path.write_text('"id","name"\n')
+        store = parse_parallel(self.csv_path, 4)
+        self.assertEqual((store.header, len(store)), (['id', 'name'], 0))
@@ -0,0 +1,60 @@
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import compiler
+from master_validator.csv_reader import read_csv
+from master_validator.registry import MasterRegistry, normalize_key
+from master_validator.validator import execute_compiled
+
+LINES = ['no_filter() > reference_validation(attack, item_test)\n',
+         'no_filter() > reference_validation(defence, item_test, max)\n',
+         'equal_filter(attack, 1) > reference_validation(id, character_test)\n']
+
+
+class TestRegistry(TestCase):
+    def test_normalize_key(self):
+        table = [('1', 1), (' 5 ', 5), ('05', 5), ('a', 'a'), (' a ', 'a'), ('', None), ('  ', None), (None, None)]
+        for value, expect in table:
+            with self.subTest(value=value):
+                self.assertEqual(normalize_key(value), expect)
+
+    def test_key_set(self):
+        registry = MasterRegistry('fixtures')
+        self.assertEqual(registry.key_set('item_test'), frozenset(range(1, 7)))
+        self.assertEqual(registry.key_set('item_test', 'max'), frozenset([1, 5, 10, 100]))
+        self.assertEqual(registry.key_set('item_test', 'name'), frozenset(f'アイテム{i}' for i in range(1, 7)))
+        # 集合は1度だけ作って共有する
+        self.assertIs(registry.key_set('item_test'), registry.key_set('item_test'))
+        with self.assertRaises(ValueError):
+            registry.key_set('unknown')
+
+    def test_register(self):
+        master_data = read_csv(Path('fixtures/character/character_test.csv'))
+        registry = MasterRegistry()
+        registry.register(master_data)
+        self.assertEqual(registry.get('character_test').count(), 6)
+        self.assertIs(registry.get('character_test')._store, master_data._store)
+
+    def test_reference_validation(self):
+        compiled = compiler.compile_lines('character_test', LINES)
+        self.assertEqual([v.references() for v in compiled.validators],
+                         [['item_test'], ['item_test'], ['character_test']])
+
+        path = Path('fixtures/character/character_test.csv')
+        for streamable in [True, False]:
+            with self.subTest(streamable=streamable):
+                registry = MasterRegistry('fixtures')
+                if streamable:
+                    result_list = compiled.execute_stream(path, 'character_test', registry=registry)
+                else:
+                    master_data = read_csv(path)
+                    master_data.registry = registry
+                    result_list = compiled.execute(master_data)
+                self.assertEqual([r.is_err for r in result_list], [False, True, False])
+                self.assertEqual([row.get_pk() for row in result_list[1].get_error_data()], [1, 2, 3, 4, 5])
+                self.assertEqual(result_list[1].message().split(' error_master_data')[0],
+                                 'master=<character_test> validation=<reference_validation> '
+                                 'error_message=<defenceの値がitem_testのmaxに存在しません。>')
+
+        result_list = execute_compiled(compiled, path, 'character_test', registry=MasterRegistry('fixtures'))
+        self.assertEqual([r.is_err for r in result_list], [False, True, False])
@@ -0,0 +1,70 @@
+import io
+import json
+import pickle
+from unittest import TestCase
+
+from master_validator.master_data import MasterRow
+from master_validator.parser import RowsResult
+from master_validator.result_sink import FailFast, JsonLinesSink, ResultCollector, ResultSink
+from master_validator.validator import validate_all
+
+
+class _ListSink(ResultSink):
+    def __init__(self):
+        self.results = []
+
+    def write(self, result):
+        self.results.append(result)
+
+
+def _rows_result(n):
+    return RowsResult(n > 0, 'item', 'x_validation', 'error', [MasterRow({'id': str(i)}) for i in range(n)])
+
+
+class TestResultSink(TestCase):
+    def test_truncate(self):
+        result = _rows_result(5)
+        result.truncate(2)
+        self.assertEqual(result.error_count, 5)
+        self.assertEqual([row.get_pk() for row in result.get_error_data()], [0, 1])
+        self.assertTrue(result.additional_msg().endswith(' error_count=<5>'))
+
+        # 上限以下なら表示は変わらない
+        result = pickle.loads(pickle.dumps(_rows_result(2)))
+        result.truncate(2)
+        self.assertEqual(result.error_count, 2)
+        self.assertEqual(result.additional_msg(), "error_master_data=<[MasterRow(row={'id': '0'}), "
+                                                  "MasterRow(row={'id': '1'})]>")
+
+    def test_json_lines_sink(self):
+        f = io.StringIO()
+        collector = ResultCollector([JsonLinesSink(f, errors_only=True)], max_error_rows=1)
+        for n in [3, 0]:
+            collector.add(_rows_result(n))
+        self.assertEqual([json.loads(line) for line in f.getvalue().splitlines()], [
+            {'master': 'item', 'validation': 'x_validation', 'is_err': True, 'error_message': 'error',
+             'error_count': 3, 'error_rows': [{'id': '0'}]},
+        ])
+        self.assertEqual((collector.results, collector.errors, collector.stopped), (2, 1, False))
+
+    def test_fail_after(self):
+        collector = ResultCollector(fail_after=2)
+        collector.add(_rows_result(1))
+        collector.add(_rows_result(0))
+        with self.assertRaises(FailFast):
+            collector.add(_rows_result(1))
+        self.assertTrue(collector.stopped)
+
+    def test_validate_all_fail_fast(self):
+        for jobs in [None, 2]:
+            with self.subTest(jobs=jobs):
+                sink = _ListSink()
+                collector = ResultCollector([sink], max_error_rows=1, fail_after=2)
+                # collectorを渡した場合は結果を保持しない
+                self.assertEqual(validate_all('fixtures', jobs=jobs, collector=collector), [])
+                result_list = sink.results
+                self.assertEqual([(r._master_name, r._validator_name, r.is_err) for r in result_list],
+                                 [('character_test', 'time_0sec_validation', True),
+                                  ('item_test', 'count_validation', True)])
+                self.assertEqual((result_list[0].error_count, len(result_list[0].get_error_data())), (2, 1))
+                self.assertTrue(collector.stopped)
@@ -0,0 +1,145 @@
+import os
+import pickle
+import random
+import subprocess
+import sys
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import compiler
+from master_validator.aggregate import nearest_rank
+from master_validator.csv_reader import read_csv
+from master_validator.master_data import MasterDataManipulator
+from master_validator.parser import APPROXIMATE_SAMPLE, APPROXIMATE_SKETCH
+from master_validator.sketch import HyperLogLog, QuantileSketch, reservoir_sample, stable_hash
+from master_validator.validator import validate_all
+
+LINES = ['no_filter() > time_0sec_validation()\n',
+         'no_filter() > distinct_count_validation(max, 5)\n',
+         'no_filter() > quantile_validation(max, 0.5, 20, 100)\n',
+         'no_filter() > sum_validation(max, 0, 200)\n',
+         'no_filter() > count_validation(3)\n']
+
+
+class TestSketch(TestCase):
+    def test_reservoir_sample(self):
+        test_cases = [
+            {'n': 0, 'size': 3, 'expect': 0},
+            {'n': 2, 'size': 3, 'expect': 2},
+            {'n': 1000, 'size': 0, 'expect': 0},
+            {'n': 1000, 'size': 10, 'expect': 10},
+        ]
+        for tc in test_cases:
+            with self.subTest(tc=tc):
+                sample = reservoir_sample(range(tc['n']), tc['size'], random.Random(0))
+                self.assertEqual(len(sample), tc['expect'])
+                self.assertEqual(len(set(sample)), tc['expect'])
+        # 全ての要素がほぼ同じ確率で選ばれる
+        counts = [0] * 20
+        for seed in range(2000):
+            for item in reservoir_sample(range(20), 5, random.Random(seed)):
+                counts[item] += 1
+        self.assertTrue(all(400 < count < 600 for count in counts), counts)
+
+    def test_stable_hash(self):
+        values = [0, 1, -1, 2 ** 40, 'a', 'アイテム1', '2022-05-01 14:00:00']
+        expect = [stable_hash(value) for value in values]
+        self.assertTrue(all(0 <= x < 1 << 64 for x in expect))
+        self.assertEqual(len(set(expect)), len(values))
+        # PYTHONHASHSEEDの異なるプロセスでも同じ値になる
+        code = f'from master_validator.sketch import stable_hash; print([stable_hash(v) for v in {values!r}])'
+        for seed in ['0', '1']:
+            with self.subTest(seed=seed):
+                out = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parent.parent, check=True,
+                                     env={**os.environ, 'PYTHONHASHSEED': seed}, capture_output=True, text=True)
+                self.assertEqual(out.stdout.strip(), str(expect))
+
+    def test_hyper_log_log(self):
+        test_cases = [
+            {'n': 0, 'value': str},
+            {'n': 10, 'value': int},
+            {'n': 1000, 'value': int},
+            {'n': 50000, 'value': int},
+            {'n': 50000, 'value': lambda i: i * 4096},
+            {'n': 50000, 'value': lambda i: f'name{i}'},
+        ]
+        for tc in test_cases:
+            n = tc['n']
+            with self.subTest(n=n, value=tc['value'](1)):
+                sketch = HyperLogLog()
+                for i in range(n):
+                    sketch.add(tc['value'](i))
+                    sketch.add(tc['value'](i))
+                self.assertLessEqual(abs(sketch.count() - n), n * 0.05)
+        # 分けて作ったスケッチをまとめると、1つのスケッチに全て加えた場合と同じになる
+        a, b, whole = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            (a if i % 2 else b).add(str(i))
+            whole.add(str(i))
+        a.merge(b)
+        self.assertEqual(a.count(), whole.count())
+
+    def test_quantile_sketch(self):
+        values = list(range(100000))
+        random.Random(0).shuffle(values)
+        a, b = QuantileSketch(seed=0), QuantileSketch(seed=1)
+        for i, value in enumerate(values):
+            (a if i % 2 else b).add(value)
+        a.merge(b)
+        self.assertEqual((a.n, a.min, a.max), (100000, 0, 99999))
+        for q in [0.0, 0.01, 0.5, 0.99, 1.0]:
+            with self.subTest(q=q):
+                # 順位の誤差が1%以内
+                self.assertLessEqual(abs(a.quantile(q) - nearest_rank(sorted(values), q)), 1000)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+
+class TestSampling(TestCase):
+    def setUp(self):
+        compiler.clear_memory_cache()
+
+    def test_execute(self):
+        master = read_csv(Path('fixtures/item_test.csv'), mapped=True)
+        exact = compiler.compile_lines('item_test', LINES).execute(master)
+        self.assertFalse(any(r.is_approximate for r in exact))
+
+        sampled = master.sample(3, random.Random(0))
+        self.assertEqual(sampled.count(), 3)
+        results = compiler.compile_lines('item_test', LINES).execute(master, sampled=sampled)
+        test_cases = [
+            {'approximation': APPROXIMATE_SAMPLE, 'is_err': False},
+            {'approximation': APPROXIMATE_SKETCH, 'is_err': True},
+            {'approximation': APPROXIMATE_SKETCH, 'is_err': True},
+            {'approximation': None, 'is_err': True},
+            {'approximation': None, 'is_err': False},
+        ]
+        for line, tc, result, expect in zip(LINES, test_cases, results, exact):
+            with self.subTest(line=line):
+                self.assertEqual(result.approximation, tc['approximation'])
+                self.assertEqual(result.is_err, tc['is_err'])
+                self.assertEqual(result.is_err, expect.is_err)
+        self.assertIn('approximate=<sketch>', results[1].message())
+        self.assertEqual(results[0].to_dict()['sampled_rows'], 3)
+        self.assertEqual(results[0].to_dict()['total_rows'], 6)
+
+    def test_estimated_error_count(self):
+        rows = [{'id': str(i), 'start_data': f'2022-05-01 14:00:{i % 2:02d}'} for i in range(1000)]
+        master = MasterDataManipulator(rows, 'time_test')
+        compiled = compiler.compile_lines('time_test', ['no_filter() > time_0sec_validation()\n'])
+        result = compiled.execute(master, sampled=master.sample(200, random.Random(0)))[0]
+        self.assertEqual(result.error_count, len(result.get_error_data()))
+        # 半分の行がエラーなので、推定値は500件前後になる
+        self.assertLess(abs(result.estimated_error_count - 500), 100)
+        self.assertIn(f'estimated_error_count=<{result.estimated_error_count}>', result.message())
+        self.assertIn('approximate=<sample 200/1000 rows>', result.message())
+        # 古いpickleと同じく、近似の属性はプロセスをまたいでも保たれる
+        self.assertEqual(pickle.loads(pickle.dumps(result)).message(), result.message())
+
+    def test_validate_all(self):
+        exact = validate_all('fixtures')
+        # マスタの行数以上のサンプルでは厳密に実行する
+        self.assertEqual([r.message() for r in validate_all('fixtures', sample_rows=100)], [r.message() for r in exact])
+        results = validate_all('fixtures', sample_rows=3, sample_seed=1)
+        self.assertEqual([r.is_approximate for r in results], [True, False, False])
+        self.assertEqual([r.message() for r in validate_all('fixtures', jobs=2, sample_rows=3, sample_seed=1)],
+                         [r.message() for r in results])
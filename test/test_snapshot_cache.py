@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import csv_reader
+from master_validator.csv_reader import read_csv
+from master_validator.snapshot_cache import SnapshotCache, content_hash
+
+
+class TestSnapshotCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.csv_path = self.tmp_dir.joinpath('item_test.csv')
+        shutil.copy('fixtures/item_test.csv', self.csv_path)
+        self.cache = SnapshotCache(self.tmp_dir.joinpath('snapshot'))
+        csv_reader.set_snapshot_cache(self.cache)
+
+    def tearDown(self):
+        csv_reader.set_snapshot_cache(None)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_csv(self):
+        expect = list(read_csv(Path('fixtures/item_test.csv'), mapped=True).all())
+        self.assertEqual(list(read_csv(self.csv_path).all()), expect)
+        master_data = read_csv(self.csv_path)
+        self.assertEqual(list(master_data.all()), expect)
+        self.assertEqual(master_data.find_by_pk(4).get_column_int('max'), 100)
+        # キーはファイルの内容なので、同じ内容なら別のパスでも使える
+        self.assertEqual(read_csv(Path('fixtures/item_test.csv')).master_name, 'item_test')
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 1})
+
+        # 内容が変わったcsvファイルは解析し直す
+        self.csv_path.write_text(self.csv_path.read_text() + '7,"アイテム7",100,"2022-05-01 14:00:00"\n')
+        self.assertEqual(read_csv(self.csv_path).count(), 7)
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 2})
+
+    def test_invalid_snapshot(self):
+        read_csv(self.csv_path)
+        self.cache.cache_dir.joinpath(content_hash(self.csv_path) + '.snapshot').write_bytes(b'broken')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(read_csv(self.csv_path).count(), 6)
+        # 壊れたスナップショットは作り直される
+        self.assertEqual(read_csv(self.csv_path).count(), 6)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2})
+
+    def test_evict(self):
+        master_data = read_csv(self.csv_path)
+        path = next(self.cache.cache_dir.iterdir())
+        self.cache.max_bytes = path.stat().st_size * 2
+        path.unlink()
+        for i, key in enumerate(['a', 'b']):
+            self.cache.save(key, master_data._store)
+            # aの方が古くなるように更新日時を過去にずらす
+            path = self.cache.cache_dir.joinpath(f'{key}.snapshot')
+            ns = path.stat().st_mtime_ns - (2 - i) * 10 ** 9
+            os.utime(path, ns=(ns, ns))
+        self.assertEqual(sorted(path.stem for path in self.cache.cache_dir.iterdir()), ['a', 'b'])
+        # 使われたものは追い出されない
+        self.assertIsNotNone(self.cache.load('a'))
+        self.cache.save('c', master_data._store)
+        self.assertEqual(sorted(path.stem for path in self.cache.cache_dir.iterdir()), ['a', 'c'])
@@ -0,0 +1,49 @@
+import json
+from pathlib import Path
+from unittest import TestCase
+
+from master_validator import compiler
+from master_validator.csv_reader import read_csv
+from master_validator.tracing import TraceRecorder
+from master_validator.validator import validate_all
+
+
+class TestTracing(TestCase):
+    def test_trace_recorder(self):
+        recorder = TraceRecorder()
+        lines = ['test_arg1_filter(2) > test_arg2_filter(2, 5) > test_arg0_validation()\n',
+                 'test_arg1_filter(2) > test_arg1_validation(6)\n']
+        compiled = compiler.compile_lines('character_test', lines, 'test.command', [recorder])
+        compiled.execute(read_csv(Path('fixtures/character/character_test.csv')), [recorder])
+
+        self.assertEqual([(r.category, r.name, r.rows_in, r.rows_out) for r in recorder.records], [
+            # フィルターとバリデーションの解析は、それを含むバリデータの解析の中で記録される
+            ('parse', 'test_arg1_filter', None, None),
+            ('parse', 'test_arg2_filter', None, None),
+            ('parse', 'test_arg0_validation', None, None),
+            ('parse', 'test_arg1_filter(2) > test_arg2_filter(2, 5) > test_arg0_validation()', None, None),
+            ('parse', 'test_arg1_filter', None, None),
+            ('parse', 'test_arg1_validation', None, None),
+            ('parse', 'test_arg1_filter(2) > test_arg1_validation(6)', None, None),
+            ('filter', 'test_arg1_filter', 6, 5),
+            ('filter', 'test_arg2_filter', 5, 3),
+            ('validation', 'test_arg0_validation', 3, None),
+            ('validator', 'test_arg1_filter(2) > test_arg2_filter(2, 5) > test_arg0_validation()', None, None),
+            # 共有されたフィルターは再評価されない
+            ('validation', 'test_arg1_validation', 5, None),
+            ('validator', 'test_arg1_filter(2) > test_arg1_validation(6)', None, None),
+        ])
+        self.assertEqual(recorder.records[7].validator, lines[0].strip())
+        slowest = recorder.slowest_commands(2)
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]['total'], slowest[1]['total'])
+        trace = json.loads(json.dumps(recorder.to_chrome_trace()))
+        self.assertEqual(len(trace['traceEvents']), 13)
+        self.assertEqual(trace['traceEvents'][7]['args']['rows_out'], 5)
+
+    def test_parallel_merge(self):
+        recorder = TraceRecorder()
+        compiler.clear_memory_cache()
+        validate_all('fixtures', jobs=2, hooks=[recorder])
+        self.assertEqual(sorted({r.master_name for r in recorder.records}), ['character_test', 'item_test'])
+        self.assertIn('count_validation', recorder.summary_table())
@@ -0,0 +1,114 @@
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from master_validator import compiler, csv_reader, validator
+from master_validator.csv_reader import read_csv
+from master_validator.master_data import DuplicateKeyError, MasterDataManipulator
+
+CSV = ('"character_id","level","attack","name"\n'
+       '"1","1","10","a"\n'
+       '"1","2","20","b"\n'
+       '"2","1","10","a"\n'
+       '"1","02","30","c"\n'
+       '"3","1","10",""\n')
+
+
+class TestUniqueness(TestCase):
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp())
+        self.csv_path = self.tmp_dir.joinpath('character_level.csv')
+        self.csv_path.write_text(CSV, encoding='utf-8')
+        csv_reader.set_primary_keys({'character_level': ['character_id', 'level']})
+
+    def tearDown(self):
+        csv_reader.set_primary_keys({})
+        shutil.rmtree(self.tmp_dir)
+
+    def test_composite_key(self):
+        for mapped in [False, True]:
+            with self.subTest(mapped=mapped):
+                master_data = read_csv(self.csv_path, mapped=mapped)
+                self.assertEqual(master_data.find_by_pk((1, 2)).row['attack'], '30')
+                self.assertEqual(master_data.find_by_pk((3, 1)).get_pk(), (3, 1))
+                self.assertEqual(master_data.duplicate_keys(), {(1, 2): 1})
+                # pickleした行もpkを引ける
+                row = pickle.loads(pickle.dumps(master_data.find_by_pk((2, 1))))
+                self.assertEqual(row.get_pk(), (2, 1))
+                with self.assertRaises(KeyError):
+                    master_data.find_by_pk(1)
+
+        # 同じpkの行は上書きされるので、メモリマップしてもしなくても同じ行数になる
+        self.assertEqual(read_csv(self.csv_path, mapped=False).count(), 4)
+        self.assertEqual(read_csv(self.csv_path, mapped=True).count(), 4)
+
+    def test_stream(self):
+        self.addCleanup(validator.set_stream_min_bytes, validator.DEFAULT_STREAM_MIN_BYTES)
+        validator.set_stream_min_bytes(0)
+        compiler.clear_memory_cache()
+        compiled = compiler.compile_lines('character_level', ['equal_filter(attack, 10) > count_validation(4)\n',
+                                                              'no_filter() > count_validation(5)\n'])
+        # 同じpkの行があるとストリーム実行はできず、メモリに読み込んで実行した場合と同じ結果になる
+        with self.assertRaises(DuplicateKeyError):
+            compiled.execute_stream(self.csv_path, 'character_level')
+        expect = [r.message() for r in compiled.execute(read_csv(self.csv_path))]
+        self.assertEqual([r.message() for r in validator.execute_compiled(compiled, self.csv_path, 'character_level')],
+                         expect)
+        self.assertIn('4件', expect[1])
+
+        # idカラムが無い複合主キーのマスタもストリーム実行できる
+        self.csv_path.write_text(CSV.replace('"1","02","30","c"\n', ''), encoding='utf-8')
+        expect = [r.message() for r in compiled.execute(read_csv(self.csv_path))]
+        self.assertEqual([r.message() for r in compiled.execute_stream(self.csv_path, 'character_level')], expect)
+
+    def test_parallel_workers(self):
+        # spawnで起動したワーカーにも主キーの設定が引き継がれる
+        spawn_executor = partial(ProcessPoolExecutor, mp_context=get_context('spawn'))
+        for jobs in [None, 2]:
+            with self.subTest(jobs=jobs), patch.object(validator, 'ProcessPoolExecutor', spawn_executor):
+                result_list = validator.validate_all(self.tmp_dir, jobs=jobs)
+                self.assertEqual([(r._validator_name, r.is_err) for r in result_list],
+                                 [('duplicate_key_validation', True)])
+                self.assertEqual([row.get_pk() for row in result_list[0].get_error_data()], [(1, 2)])
+
+    def test_duplicate_warning(self):
+        with self.assertLogs(level='WARNING') as logs:
+            read_csv(self.csv_path, mapped=False)
+        self.assertIn('duplicate primary key. master=[character_level] key=[character_id,level] count=[1]',
+                      logs.output[0])
+
+    def test_missing_key_column(self):
+        csv_reader.set_primary_keys({'character_level': ['character_id', 'rank']})
+        for mapped in [False, True]:
+            with self.subTest(mapped=mapped):
+                with self.assertRaises(KeyError):
+                    read_csv(self.csv_path, mapped=mapped)
+        with self.assertRaises(ValueError):
+            csv_reader.set_primary_keys({'character_level': 'character_id'})
+
+    def test_validations(self):
+        master_data = MasterDataManipulator(
+            [{'id': '1', 'a': '1', 'b': '7'}, {'id': '2', 'a': '2', 'b': '7'}, {'id': '3', 'a': '01', 'b': '7'},
+             {'id': '4', 'a': '2', 'b': '8'}, {'id': '5', 'a': '', 'b': '7'}, {'id': '6', 'a': '', 'b': '7'},
+             {'id': '2', 'a': '2', 'b': '7'}],
+            'uniq')
+        test_cases = [
+            {'line': 'no_filter() > uniqueness_validation(id)', 'expect': []},
+            {'line': 'no_filter() > uniqueness_validation(a)', 'expect': [1, 3, 2, 4]},
+            {'line': 'no_filter() > uniqueness_validation(a, b)', 'expect': [1, 3]},
+            {'line': 'no_filter() > uniqueness_validation(b)', 'expect': [1, 2, 3, 5, 6]},
+            {'line': 'equal_filter(b, 8) > uniqueness_validation(b)', 'expect': []},
+            {'line': 'no_filter() > duplicate_key_validation()', 'expect': [2]},
+            {'line': 'equal_filter(b, 8) > duplicate_key_validation()', 'expect': []},
+        ]
+        compiled = compiler.compile_lines('uniq', [tc['line'] + '\n' for tc in test_cases])
+        for tc, result in zip(test_cases, compiled.execute(master_data)):
+            with self.subTest(line=tc['line']):
+                self.assertEqual(result.is_err, len(tc['expect']) >= 1)
+                self.assertEqual([row.get_pk() for row in result.get_error_data()], tc['expect'])
@@ -0,0 +1,22 @@
+import pickle
+from unittest import TestCase
+
+from master_validator.compiler import ValidatorExecutionError
+from master_validator.validator import validate_all
+
+
+class TestValidator(TestCase):
+    def test_validate_all(self):
+        result_list = validate_all('fixtures')
+        self.assertEqual([(r._master_name, r._validator_name, r.is_err) for r in result_list],
+                         [('character_test', 'time_0sec_validation', True),
+                          ('item_test', 'count_validation', True),
+                          ('item_test', 'count_validation', False)])
+
+    def test_validate_all_parallel(self):
+        expect = [r.message() for r in validate_all('fixtures')]
+        self.assertEqual([r.message() for r in validate_all('fixtures', jobs=2)], expect)
+
+    def test_execution_error(self):
+        e = pickle.loads(pickle.dumps(ValidatorExecutionError('item', 'no_filter() > x_validation()', 'ValueError()')))
+        self.assertEqual(str(e), 'master=<item> validator=<no_filter() > x_validation()> error=<ValueError()>')